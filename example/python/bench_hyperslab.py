@@ -0,0 +1,64 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Measure per-call overhead of reading small patches:
+# load_hyperslab vs prepared read plan
+#
+
+import argparse
+import time
+
+import numpy as np
+
+from minc2_simple import minc2_file
+
+
+def parse_options():
+    parser = argparse.ArgumentParser(description='Measure time per call of small hyperslab reads')
+    parser.add_argument('input', help="Input minc file")
+    parser.add_argument('--patch', type=int, default=8, help="Patch size")
+    parser.add_argument('--n', type=int, default=10000, help="Number of reads")
+    parser.add_argument('--torch', action='store_true', help="Read into torch tensors")
+    return parser.parse_args()
+
+
+def report(name, t, n):
+    print("{:<24} {:8.2f} us per call".format(name, t*1e6/n))
+
+
+if __name__ == "__main__":
+    options = parse_options()
+    m = minc2_file(options.input)
+    m.setup_standard_order()
+    shape = m.data.shape
+    p = options.patch
+    rng = np.random.RandomState(0)
+    starts = [tuple(rng.randint(0, s-p+1) for s in shape) for _ in range(options.n)]
+    load = m.load_hyperslab_t if options.torch else m.load_hyperslab
+
+    t0 = time.perf_counter()
+    for st in starts:
+        load([(s, s+p) for s in st])
+    report('load_hyperslab', time.perf_counter()-t0, options.n)
+
+    plan = m.read_plan([p]*len(shape), tensor=options.torch)
+    t0 = time.perf_counter()
+    for st in starts:
+        plan.read(st)
+    report('read_plan', time.perf_counter()-t0, options.n)
+
+    out = plan.read(starts[0])
+    t0 = time.perf_counter()
+    for st in starts:
+        plan.read(st, out=out)
+    report('read_plan with out', time.perf_counter()-t0, options.n)
+
+    # single voxel reads show pure call overhead
+    plan = m.read_plan([1]*len(shape), tensor=options.torch)
+    out = plan.read(starts[0])
+    t0 = time.perf_counter()
+    for st in starts:
+        plan.read(st, out=out)
+    report('read_plan 1 voxel', time.perf_counter()-t0, options.n)
+    m.close()
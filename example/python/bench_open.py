@@ -0,0 +1,48 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Benchmark opening minc files: full open vs header-only open
+#
+
+import argparse
+import time
+
+from minc2_simple import minc2_file,minc2_error
+
+
+def parse_options():
+    parser = argparse.ArgumentParser(description='Measure number of minc files opened per second')
+    parser.add_argument('input', nargs='+', help="Input minc files")
+    parser.add_argument('--repeat', type=int, default=3, help="Number of passes over input files")
+    parser.add_argument('--attribute', action='append', default=[],
+                        help="Read attribute group:name after opening, i.e dicom_0x0008:el_0x0020")
+    return parser.parse_args()
+
+
+def scan(files, header_only, attributes):
+    for f in files:
+        m = minc2_file(f, header_only=header_only)
+        m.store_dims()
+        m.store_dtype()
+        for a in attributes:
+            g, n = a.split(':', 1)
+            try:
+                m.read_attribute(g, n)
+            except minc2_error:
+                pass
+        m.close()
+
+
+if __name__ == "__main__":
+    options = parse_options()
+
+    for header_only in (False, True):
+        best = None
+        for r in range(options.repeat):
+            t0 = time.perf_counter()
+            scan(options.input, header_only, options.attribute)
+            t = time.perf_counter()-t0
+            best = t if best is None else min(best, t)
+        print("header_only={}: {:.1f} opens/s ({:.3f} ms per file)".format(
+              header_only, len(options.input)/best, best*1000.0/len(options.input)))
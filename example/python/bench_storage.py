@@ -0,0 +1,102 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#
+# Compare HDF5 storage settings (chunk shape, compression) on synthetic volumes:
+# file size, write throughput, whole-volume and slice-by-slice reads, random patch reads
+#
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from minc2_simple import minc2_file,minc2_dim
+
+
+def parse_options():
+    parser = argparse.ArgumentParser(description='Measure read/write throughput and file size for different storage settings')
+    parser.add_argument('--shape', type=int, nargs=3, default=[192, 256, 256], help="Volume shape (z y x)")
+    parser.add_argument('--type', default='int16', help="Storage data type")
+    parser.add_argument('--chunks', action='append', default=None,
+                        help="Chunk shape z,y,x or 'default', can be repeated")
+    parser.add_argument('--compression', type=int, action='append', default=None,
+                        help="zlib compression level, can be repeated")
+    parser.add_argument('--patch', type=int, default=32, help="Size of random patches")
+    parser.add_argument('--n', type=int, default=200, help="Number of random patch reads")
+    parser.add_argument('--tmp', default=None, help="Directory for temporary files")
+    return parser.parse_args()
+
+
+def synthetic_volume(shape):
+    # smooth signal with noise, compresses like a real image
+    z, y, x = np.meshgrid(*[np.linspace(-1.0, 1.0, s) for s in shape], indexing='ij')
+    vol = 100.0*np.exp(-(x**2+y**2+z**2)*3.0)+20.0*np.sin(8.0*x)*np.cos(6.0*y)
+    vol += np.random.normal(0.0, 2.0, shape)
+    return vol.astype(np.float32)
+
+
+def run(path, data, store_type, chunks, compression, patch, n):
+    dims = [minc2_dim(id=i+1, length=data.shape[2-i], start=0.0, step=1.0, have_dir_cos=False, dir_cos=None)
+            for i in range(3)]
+    mb = data.nbytes/1024.0/1024.0
+    r = {}
+
+    t0 = time.perf_counter()
+    v = minc2_file()
+    v.define(dims, store_type, 'float32', chunks=chunks, compression=compression, path=path)
+    v.save_complete_volume(data)
+    v.close()
+    r['write MB/s'] = mb/(time.perf_counter()-t0)
+    r['size MB'] = os.path.getsize(path)/1024.0/1024.0
+
+    v = minc2_file(path)
+    info = v.storage_info()
+    r['chunks'] = 'x'.join(str(c) for c in info['chunks']) if info['chunks'] else 'contiguous'
+    r['zlib'] = info['compression'] if info['compression'] is not None else '-'
+
+    t0 = time.perf_counter()
+    v.load_complete_volume('float32')
+    r['read MB/s'] = mb/(time.perf_counter()-t0)
+
+    t0 = time.perf_counter()
+    plan = v.read_plan((1, None, None), 'float32')
+    out = np.empty(plan.shape, np.float32)
+    for z in range(data.shape[0]):
+        plan.read((z, 0, 0), out=out)
+    r['slices MB/s'] = mb/(time.perf_counter()-t0)
+
+    plan = v.read_plan((patch, patch, patch), 'float32')
+    out = np.empty(plan.shape, np.float32)
+    starts = [tuple(np.random.randint(0, s-patch+1) for s in data.shape) for _ in range(n)]
+    t0 = time.perf_counter()
+    for s in starts:
+        plan.read(s, out=out)
+    r['patches/s'] = n/(time.perf_counter()-t0)
+    v.close()
+    return r
+
+
+if __name__ == "__main__":
+    options = parse_options()
+    chunks = options.chunks or ['default', '1,{},{}'.format(*options.shape[1:]), '32,32,32', '64,64,64']
+    compression = options.compression or [0, 1, 4]
+    data = synthetic_volume(options.shape)
+    tmp = tempfile.mkdtemp(prefix='bench-storage-', dir=options.tmp)
+
+    columns = ['chunks', 'zlib', 'size MB', 'write MB/s', 'read MB/s', 'slices MB/s', 'patches/s']
+    print("{:<12} {:<8}".format('requested', 'level')+''.join("{:>13}".format(c) for c in columns))
+    try:
+        for c in chunks:
+            _chunks = None if c == 'default' else [int(i) for i in c.split(',')]
+            for level in compression:
+                path = os.path.join(tmp, 'bench.mnc')
+                r = run(path, data, options.type, _chunks, level, options.patch, options.n)
+                os.remove(path)
+                print("{:<12} {:<8}".format(c, level)+''.join(
+                    "{:>13.1f}".format(r[k]) if isinstance(r[k], float) else "{:>13}".format(r[k]) for k in columns))
+    finally:
+        shutil.rmtree(tmp)
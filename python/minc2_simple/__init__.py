@@ -1,9 +1,16 @@
 from .minc2_simple import minc2_error,minc2_transform_parameters
 from .minc2_simple import minc2_file,minc2_xfm,minc2_tags,minc2_dim
 from .minc2_simple import minc2_input_iterator,minc2_output_iterator
+from .minc2_simple import minc2_lazy_array,minc2_dask_stack,minc2_read_plan,minc2_stream_writer
+from .scan import scan_headers
+from .cache import minc2_header_cache,set_header_cache,get_header_cache
+from .voxelwise import voxelwise_stats,map_voxels
 
 __all__ = ['minc2_error','minc2_transform_parameters',
            'minc2_file','minc2_xfm','minc2_tags','minc2_dim',
-           'minc2_input_iterator','minc2_output_iterator']
+           'minc2_input_iterator','minc2_output_iterator',
+           'minc2_lazy_array','minc2_dask_stack','minc2_read_plan','minc2_stream_writer',
+           'scan_headers','minc2_header_cache','set_header_cache','get_header_cache',
+           'voxelwise_stats','map_voxels']
 
 
@@ -0,0 +1,235 @@
+from __future__ import print_function
+
+import contextlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from .utils import to_unicode
+
+
+class minc2_header_cache(object):
+    """
+    Persistent cache of minc file headers and metadata, stored in sqlite database.
+    Entries are keyed by absolute file path, and are valid only while file size and modification time
+    are unchanged. When number of entries exceeds max_entries, least recently used entries are evicted.
+    Access times of cache hits are kept in memory and written together, see atime_flush and batch
+    """
+    #: name of the database file inside cache directory
+    db_name = 'minc2_headers.sqlite'
+    #: number of cache hits after which their access times are written to the database
+    atime_flush = 1000
+
+    def __init__(self, directory=None, max_entries=100000):
+        """
+        :param directory: directory for the database, default - $MINC2_SIMPLE_CACHE_DIR or ~/.cache/minc2_simple
+        :param max_entries: maximum number of files kept in the cache
+        """
+        if directory is None:
+            directory = os.environ.get('MINC2_SIMPLE_CACHE_DIR',
+                                       os.path.join(os.path.expanduser('~'), '.cache', 'minc2_simple'))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._batch = 0
+        self._touched = {}  # path -> access time, not written yet
+        self._count = None  # running number of entries, queried on first eviction check
+        self._db = sqlite3.connect(os.path.join(directory, self.db_name), timeout=60.0, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS headers ("
+                             "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, atime REAL, "
+                             "header BLOB, metadata BLOB)")
+
+    @staticmethod
+    def _key(path):
+        """
+        internal function: cache key and stat information of the file
+        :return: (key, size, mtime) or (key, None, None) if file doesn't exist
+        """
+        path = os.path.abspath(to_unicode(path))
+        try:
+            st = os.stat(path)
+        except OSError:
+            return path, None, None
+        mtime = st.st_mtime_ns if hasattr(st, 'st_mtime_ns') else int(st.st_mtime*1e9)
+        return path, st.st_size, mtime
+
+    def _get(self, path, column):
+        key, size, mtime = self._key(path)
+        with self._lock:
+            row = None
+            if size is not None:
+                row = self._db.execute("SELECT size,mtime,{} FROM headers WHERE path=?".format(column),
+                                       (key,)).fetchone()
+            if row is None or row[0] != size or row[1] != mtime or row[2] is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[key] = time.time()
+            if not self._batch and len(self._touched) >= self.atime_flush:
+                self._flush()
+            return pickle.loads(row[2])
+
+    def _put(self, path, values):
+        """
+        internal function: store several columns of a file in one statement
+        :param values: dict column -> value
+        """
+        key, size, mtime = self._key(path)
+        if size is None:
+            return
+        columns = sorted(values.keys())
+        blobs = [sqlite3.Binary(pickle.dumps(values[c], protocol=2)) for c in columns]
+        with self._lock:
+            row = self._db.execute("SELECT size,mtime FROM headers WHERE path=?", (key,)).fetchone()
+            if row is not None and row[0] == size and row[1] == mtime:
+                self._db.execute("UPDATE headers SET {},atime=? WHERE path=?".format(",".join(c+"=?" for c in columns)),
+                                 blobs+[time.time(), key])
+            else:
+                # new file, or file was modified - drop all stale information
+                self._db.execute("INSERT OR REPLACE INTO headers (path,size,mtime,atime,{}) VALUES (?,?,?,?{})".format(
+                                 ",".join(columns), ",?"*len(columns)), [key, size, mtime, time.time()]+blobs)
+                if row is None and self._count is not None:
+                    self._count += 1
+            self._touched.pop(key, None)
+            if not self._batch:
+                self._flush()
+
+    def _flush(self):
+        """
+        internal function: write pending access times, evict old entries and commit, called with the lock held
+        """
+        if self._touched:
+            self._db.executemany("UPDATE headers SET atime=? WHERE path=?",
+                                 [(t, k) for k,t in self._touched.items()])
+            self._touched = {}
+        self._evict()
+        self._db.commit()
+
+    def _evict(self):
+        """
+        internal function: remove least recently used entries above max_entries
+        """
+        if self._count is None or self._count > self.max_entries:
+            # entries could be added by other processes, so the count is only trusted below the limit
+            self._count = self._db.execute("SELECT COUNT(*) FROM headers").fetchone()[0]
+        if self._count > self.max_entries:
+            self._db.execute("DELETE FROM headers WHERE path IN "
+                             "(SELECT path FROM headers ORDER BY atime LIMIT ?)", (self._count-self.max_entries,))
+            self._count = self.max_entries
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Context manager grouping all updates into a single transaction, committed at the end,
+        least recently used entries are evicted once at the end as well
+        """
+        with self._lock:
+            self._batch += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch -= 1
+                if not self._batch:
+                    self._flush()
+
+    def get_header(self, path):
+        """
+        Get cached header information (see scan_headers)
+        :param path: file path
+        :return: dict, or None if the file is not in the cache or was modified
+        """
+        return self._get(path, 'header')
+
+    def put_header(self, path, header):
+        """
+        Store header information
+        :param path: file path
+        :param header: dict
+        """
+        self._put(path, {'header': header})
+
+    def get_metadata(self, path):
+        """
+        Get cached metadata (see minc2_file.metadata)
+        :param path: file path
+        :return: dict, or None if the file is not in the cache or was modified
+        """
+        return self._get(path, 'metadata')
+
+    def put_metadata(self, path, metadata):
+        """
+        Store metadata
+        :param path: file path
+        :param metadata: dict
+        """
+        self._put(path, {'metadata': metadata})
+
+    def put(self, path, header, metadata):
+        """
+        Store header information and metadata of a file at once
+        :param path: file path
+        :param header: dict
+        :param metadata: dict
+        """
+        self._put(path, {'header': header, 'metadata': metadata})
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM headers").fetchone()[0]
+
+    def stats(self):
+        """
+        :return: dict with number of hits, misses and entries
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self)}
+
+    def clear(self):
+        """
+        Remove all entries and reset counters
+        """
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM headers")
+            self._touched = {}
+            self._count = 0
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        """
+        Close the database, writing pending access times
+        """
+        with self._lock:
+            self._flush()
+        self._db.close()
+
+
+_header_cache = None
+
+
+def set_header_cache(cache):
+    """
+    Enable header cache, used by minc2_file.metadata and scan_headers
+    :param cache: minc2_header_cache, directory path for a new minc2_header_cache, or None to disable caching
+    :return: previous cache
+    """
+    global _header_cache
+    prev = _header_cache
+    if cache is not None and not isinstance(cache, minc2_header_cache):
+        cache = minc2_header_cache(cache)
+    _header_cache = cache
+    return prev
+
+
+def get_header_cache():
+    """
+    :return: current header cache, or None if caching is disabled
+    """
+    return _header_cache
@@ -3,6 +3,7 @@ from __future__ import print_function
 from ._simple import ffi,lib
 from .utils   import to_bytes,to_unicode
 from .utils   import text_type
+from .cache   import get_header_cache
 import six
 import sys
 import collections
@@ -42,6 +43,27 @@ class minc2_transform_parameters(object):
 minc2_dim=collections.namedtuple('minc2_dim',['id','length', 'start', 'step', 'have_dir_cos', 'dir_cos'])
 
 
+def _lattice(dims):
+    """
+    internal function: describe sampling lattice of spatial dimensions
+    :param dims: list of minc2_dim, should contain X,Y and Z dimensions
+    :return: (coord, spatial) - coord: list of arrays of world coordinates of the voxels along X,Y,Z dimensions,
+             i.e coord[0][i]=(start+i*step)*dir_cos for X,
+             spatial: X,Y and Z minc2_dim, in this order
+    """
+    import numpy as np
+    _dims={ d.id:d for d in dims }
+    _axes=[lib.MINC2_DIM_X, lib.MINC2_DIM_Y, lib.MINC2_DIM_Z]
+    if any(i not in _dims for i in _axes):
+        raise minc2_error("Sampling lattice should have X,Y and Z dimensions")
+    coord=[]
+    for a,i in enumerate(_axes):
+        d=_dims[i]
+        c=np.asarray(d.dir_cos,np.float64) if d.have_dir_cos else np.eye(3)[a]
+        coord+=[ np.outer(d.start+np.arange(d.length)*d.step, c) ]
+    return coord, [_dims[i] for i in _axes]
+
+
 class minc2_file:
     """
     MINC2 file object (Volume on the disk, stored in .mnc file)
@@ -105,12 +127,23 @@ class minc2_file:
     minc2_to_numpy=__minc2_to_numpy
     numpy_to_minc2=__numpy_to_minc2
 
-    def __init__(self, path=None, standard=False, handle=None):
+    # reasons why volume can't be memory-mapped
+    __mmap_status = {
+            lib.MINC2_MMAP_NOT_OPEN:       'file is not open',
+            lib.MINC2_MMAP_HDF5_ERROR:     'image dataset could not be inspected',
+            lib.MINC2_MMAP_NOT_CONTIGUOUS: 'image is stored in chunks',
+            lib.MINC2_MMAP_FILTERED:       'image is compressed',
+            lib.MINC2_MMAP_NOT_ALLOCATED:  'image storage is not allocated',
+            lib.MINC2_MMAP_BYTE_ORDER:     'image byte order is not native',
+        }
+
+    def __init__(self, path=None, standard=False, handle=None, header_only=False):
         """
 
         :param path: file path to open
         :param standard: after opening, immedeately switch to standard orientation ( see @setup_standard_order)
         :param handle: use library handle to already opened minc2 file
+        :param header_only: read only dimensions and storage type on open, see @open
         """
 
         if handle is None:
@@ -118,19 +151,32 @@ class minc2_file:
         else:
             self._v = handle
 
+        self._path = None
+        self._standard = False
+        self._affine = None
+        self._shape = None
+
         if path is not None:
-            self.open(path)
+            self.open(path, header_only=header_only)
             if standard:
                 self.setup_standard_order()
 
-    def open(self, path):
+    def open(self, path, header_only=False):
         """
         Open existing minc2 file
         :param path: file path
+        :param header_only: read only dimensions and storage type, scaling information and volume range
+                            are read on the first voxel access or data type query. Makes opening faster
+                            when only geometry and attributes are needed
         :return: None
         """
-        if lib.minc2_open(self._v, to_bytes(path))!=lib.MINC2_SUCCESS:
+        flags = lib.MINC2_OPEN_HEADER_ONLY if header_only else lib.MINC2_OPEN_DEFAULT
+        if lib.minc2_open_flags(self._v, to_bytes(path), flags)!=lib.MINC2_SUCCESS:
             raise minc2_error("Can't open file:"+path)
+        self._path = path
+        self._standard = False
+        self._affine = None
+        self._shape = None
 
     def close(self):
         """
@@ -223,7 +269,8 @@ class minc2_file:
         if path is not None:
             self.create(path)
 
-    def define(self, dims, store_type=None, representation_type=None, slice_scaling=None, global_scaling=None, path=None):
+    def define(self, dims, store_type=None, representation_type=None, slice_scaling=None, global_scaling=None, path=None,
+               chunks=None, compression=None, shuffle=False):
         """
         Define new minc2 volume
         :param dims:  dimensions description (as will be stored on disk)
@@ -232,8 +279,14 @@ class minc2_file:
         :param slice_scaling:  use slice scaling
         :param global_scaling: use global scaling
         :param path: output file path
+        :param chunks: HDF5 chunk shape, in file order (numpy style, slowest dimension first), default - libminc default.
+                       libminc uses chunks only for compressed images
+        :param compression: zlib compression level 0-9 (0 - no compression), default - MINC_COMPRESS environment variable
+        :param shuffle: use HDF5 shuffle filter, not supported by libminc
         :return:
         """
+        if shuffle:
+            raise minc2_error("Shuffle filter is not supported by libminc")
         _dims = dims
         if store_type is None:
             store_type=lib.MINC2_SHORT
@@ -264,6 +317,8 @@ class minc2_file:
                     _dims[i]=j
             _dims[len(dims)]={'id':lib.MINC2_DIM_END}
 
+        self._affine = None
+        self._shape = None
         if lib.minc2_define(self._v, _dims, _store_type, _representation_type)!=lib.MINC2_SUCCESS:
             raise minc2_error("Error defining new minc file")
 
@@ -276,6 +331,17 @@ class minc2_file:
 
             if lib.minc2_set_scaling(self._v,_global_scaling,_slice_scaling )!=lib.MINC2_SUCCESS:
                 raise minc2_error()
+
+        if chunks is not None or compression is not None:
+            ndims = len(dims)
+            _chunks = ffi.NULL
+            if chunks is not None:
+                if len(chunks)!=ndims:
+                    raise minc2_error("Chunks should have {} dimensions".format(ndims))
+                _chunks = ffi.new("int[]", [int(chunks[ndims-1-i]) for i in range(ndims)])
+            if lib.minc2_set_storage(self._v, _chunks, -1 if compression is None else int(compression))!=lib.MINC2_SUCCESS:
+                raise minc2_error("Error setting storage options")
+
         if path is not None:
             self.create(path)
 
@@ -285,6 +351,8 @@ class minc2_file:
         :param path: file path
         :return:
         """
+        self._affine = None
+        self._shape = None
         if lib.minc2_create(self._v, to_bytes(path) )!=lib.MINC2_SUCCESS:
             raise minc2_error("Error creating file:"+path)
     
@@ -297,15 +365,20 @@ class minc2_file:
         if lib.minc2_copy_metadata(another._v,self._v)!=lib.MINC2_SUCCESS:
             raise minc2_error("Error copying metadata")
     
-    def load_complete_volume(self, data_type=None):
+    def load_complete_volume(self, data_type=None, threads=None, out=None):
         """
         Load the whole volume as numpy ndarray
-        :param data_type: python data required
-        :return: numpy.ndarray
+        :param data_type: python data required, by default data type of out or representation data type
+        :param threads: number of threads, if more then one - the volume is split into slabs along the slowest dimension
+                        and each slab is read through a separate file handle (only for files opened with .open,
+                        and only if HDF5 library is thread-safe, otherwise the volume is read in the current thread)
+        :param out: optional output buffer: C-contiguous writable numpy.ndarray of matching shape and data type,
+                    or writable object supporting buffer protocol of matching size
+        :return: numpy.ndarray (out, or numpy view of it)
         """
         import numpy as np
         if data_type is None:
-            data_type = np.dtype( self.representation_dtype() )
+            data_type = out.dtype if isinstance(out, np.ndarray) else np.dtype( self.representation_dtype() )
         buf=None
         _dims=self.representation_dims()
         # dims=torch.LongStorage(self:ndim())
@@ -327,20 +400,119 @@ class minc2_file:
         else:
             raise minc2_error("Unsupported buffer data type:"+repr(data_type))
 
-        buf = np.empty(shape, dtype, 'C')
-        if lib.minc2_load_complete_volume(self._v, ffi.cast("void *", buf.ctypes.data) , data_type)!=lib.MINC2_SUCCESS:
+        buf = np.empty(shape, dtype, 'C') if out is None else self._check_out(out, shape, dtype)
+        if threads is not None and threads>1 and self._path is not None and shape[0]>1 and lib.minc2_hdf5_threadsafe():
+            self._load_slabs_threaded(buf, data_type, threads)
+        elif lib.minc2_load_complete_volume(self._v, ffi.cast("void *", buf.ctypes.data) , data_type)!=lib.MINC2_SUCCESS:
             raise minc2_error("Error loading volume")
         return buf
 
-    def load_complete_volume_tensor(self, data_type=None):
+    def _load_slabs_threaded(self, buf, data_type, threads):
+        """
+        internal function: read volume into preallocated C-ordered buffer using several threads,
+        every thread opens it's own handle and reads a disjoint slab along the slowest dimension.
+        The library releases GIL during the I/O calls, HDF5 have to be built thread-safe (see minc2_hdf5_threadsafe)
+        :param buf: output numpy.ndarray
+        :param data_type: minc2 data type of the buffer
+        :param threads: number of threads
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        ndims = buf.ndim
+        n_slabs = min(threads, buf.shape[0])
+        bounds = [ (buf.shape[0]*i)//n_slabs for i in range(n_slabs+1) ]
+
+        def _read_slab(i):
+            _h = minc2_file(self._path)
+            try:
+                if self._standard:
+                    _h.setup_standard_order()
+
+                slab_start = ffi.new("int[]", ndims)
+                slab_count = ffi.new("int[]", ndims)
+                for j in range(ndims):
+                    slab_count[ndims-1-j] = buf.shape[j]
+                # slowest dimension is the last one in minc2 order
+                slab_start[ndims-1] = bounds[i]
+                slab_count[ndims-1] = bounds[i+1]-bounds[i]
+
+                _slab = buf[bounds[i]:bounds[i+1]]
+                r = lib.minc2_read_hyperslab(_h._v, slab_start, slab_count,
+                                             ffi.cast("void *", _slab.ctypes.data), data_type)
+            finally:
+                _h.close()
+            if r != lib.MINC2_SUCCESS:
+                raise minc2_error("Error loading volume slab {}:{}".format(bounds[i],bounds[i+1]))
+
+        with ThreadPoolExecutor(max_workers=n_slabs) as executor:
+            # propagate exceptions
+            for _ in executor.map(_read_slab, range(n_slabs)):
+                pass
+
+    @staticmethod
+    def _check_out(out, shape, dtype):
+        """
+        internal function: verify that output buffer can be used to read data of given shape and type directly
+        :param out: numpy.ndarray or object supporting buffer protocol
+        :param shape: expected shape
+        :param dtype: expected numpy data type
+        :return: numpy.ndarray sharing memory with out
+        """
+        import numpy as np
+        dtype = np.dtype(dtype)
+        if not isinstance(out, np.ndarray):
+            try:
+                m = memoryview(out)
+            except TypeError:
+                raise minc2_error("Output buffer should be numpy.ndarray or support buffer protocol:"+repr(type(out)))
+            if m.readonly:
+                raise minc2_error("Output buffer is read-only")
+            if not m.c_contiguous:
+                raise minc2_error("Output buffer is not C-contiguous")
+            if m.nbytes != int(np.prod(shape))*dtype.itemsize:
+                raise minc2_error("Output buffer size {} doesn't match {} elements of {}".format(m.nbytes, int(np.prod(shape)), dtype.name))
+            return np.frombuffer(m.cast('B'), dtype=dtype).reshape(shape)
+        if out.shape != tuple(shape):
+            raise minc2_error("Output buffer shape {} doesn't match {}".format(out.shape, tuple(shape)))
+        if out.dtype != dtype:
+            raise minc2_error("Output buffer data type {} doesn't match {}".format(out.dtype.name, dtype.name))
+        if not out.flags.c_contiguous:
+            raise minc2_error("Output buffer is not C-contiguous")
+        if not out.flags.writeable:
+            raise minc2_error("Output buffer is read-only")
+        return out
+
+    @staticmethod
+    def _check_out_tensor(out, shape, tensor_type):
+        """
+        internal function: verify that output tensor can be used to read data of given shape and type directly
+        :param out: torch.Tensor
+        :param shape: expected shape
+        :param tensor_type: expected tensor type i.e 'torch.FloatTensor'
+        :return: out
+        """
+        import torch
+        if not isinstance(out, torch.Tensor):
+            raise minc2_error("Output buffer should be torch.Tensor:"+repr(type(out)))
+        if tuple(out.shape) != tuple(shape):
+            raise minc2_error("Output tensor shape {} doesn't match {}".format(tuple(out.shape), tuple(shape)))
+        if out.type() != tensor_type:
+            raise minc2_error("Output tensor type {} doesn't match {}".format(out.type(), tensor_type))
+        if out.device.type != 'cpu':
+            raise minc2_error("Output tensor should be on CPU")
+        if not out.is_contiguous():
+            raise minc2_error("Output tensor is not contiguous")
+        return out
+
+    def load_complete_volume_tensor(self, data_type=None, out=None):
         """
         Load the whole volume as pytorch tensor
-        :param data_type: python data required
+        :param data_type: python data required, by default type of out or representation data type
+        :param out: optional output contiguous CPU tensor of matching shape and type
         :return: torch.Tensor
         """
         import torch
         if data_type is None:
-            data_type=self.representation_dtype_tensor()
+            data_type=out.type() if out is not None else self.representation_dtype_tensor()
         buf=None
         _dims=self.representation_dims()
         # dims=torch.LongStorage(self:ndim())
@@ -349,22 +521,120 @@ class minc2_file:
         for i in range(self.ndim()):
             shape[self.ndim()-i-1]=_dims[i].length
 
-        dtype=None
+        dtype, data_type = self._torch_type(data_type)
 
-        if data_type in minc2_file.__minc2_to_torch:
-            dtype=eval(minc2_file.__minc2_to_torch[data_type])
-        elif data_type in minc2_file.__torch_to_minc2:
-            dtype=eval(data_type)
-            data_type=minc2_file.__torch_to_minc2[data_type]
+        if out is None:
+            buf=dtype(*shape)
         else:
-            raise minc2_error("Unsupported data type:"+repr(data_type))
+            buf=self._check_out_tensor(out, shape, minc2_file.__minc2_to_torch[data_type])
 
-        buf=dtype(*shape)
-
-        if lib.minc2_load_complete_volume(self._v, ffi.cast("void *", buf.untyped_storage().data_ptr()) , data_type)!=lib.MINC2_SUCCESS:
+        if lib.minc2_load_complete_volume(self._v, ffi.cast("void *", buf.data_ptr()) , data_type)!=lib.MINC2_SUCCESS:
             raise minc2_error("Error loading volume")
         return buf
 
+    def mmap_status(self, data_type=None):
+        """
+        Check if the volume can be memory-mapped directly from the file (see @load_mmap)
+        :param data_type: requested data type, by default representation type
+        :return: tuple (offset,reason): file offset of the image data and None, or None and the reason why it is not possible
+        """
+        import numpy as np
+        if self._path is None:
+            return (None, "file was not opened with .open")
+
+        if data_type is None:
+            dtype = self.representation_dtype()
+        elif data_type in minc2_file.__minc2_to_numpy:
+            dtype = minc2_file.__minc2_to_numpy[data_type]
+        else:
+            dtype = np.dtype(data_type).name
+
+        if dtype != self.store_dtype():
+            return (None, "requested data type {} is different from storage type {}".format(dtype, self.store_dtype()))
+
+        global_scaling, slice_scaling = self.get_scaling()
+        if slice_scaling:
+            return (None, "volume uses slice scaling")
+        if global_scaling:
+            return (None, "volume uses global scaling")
+
+        offset = ffi.new("long long*", -1)
+        status = ffi.new("int*", 0)
+        if lib.minc2_get_image_offset(self._v, offset, status)!=lib.MINC2_SUCCESS:
+            return (None, minc2_file.__mmap_status.get(status[0], "unknown error"))
+        return (offset[0], None)
+
+    def load_mmap(self, data_type=None, fallback=True):
+        """
+        Map the whole volume from the file as read-only numpy.memmap, without copying data.
+        Only possible for volumes stored contiguously, without compression and scaling,
+        when the requested data type is the same as storage type
+        :param data_type: requested data type, by default representation type
+        :param fallback: if volume can't be mapped - issue a warning and use @load_complete_volume, otherwise raise minc2_error
+        :return: numpy.memmap (or numpy.ndarray when falling back)
+        """
+        import numpy as np
+        offset, reason = self.mmap_status(data_type)
+        if offset is None:
+            if not fallback:
+                raise minc2_error("Volume can't be memory-mapped: "+reason)
+            import warnings
+            warnings.warn("Volume {} can't be memory-mapped: {}, loading into memory".format(self._path, reason))
+            return self.load_complete_volume(data_type)
+
+        _store = self.store_dims()
+        _repr  = self.representation_dims()
+        ndims  = len(_store)
+
+        # numpy array defines dimensions in a slowest first fashion
+        buf = np.memmap(self._path, dtype=self.store_dtype(), mode='r', offset=offset,
+                        shape=tuple(_store[ndims-i-1].length for i in range(ndims)), order='C')
+
+        # map file order into the current representation order
+        store_ids = [_store[ndims-i-1].id for i in range(ndims)]
+        axes = [store_ids.index(_repr[ndims-i-1].id) for i in range(ndims)]
+        flip = tuple( slice(None, None, -1) if _repr[ndims-i-1].id != lib.MINC2_DIM_VEC and
+                                               _repr[ndims-i-1].step*_store[ndims-1-axes[i]].step < 0 else slice(None)
+                      for i in range(ndims) )
+        if axes != list(range(ndims)):
+            buf = buf.transpose(axes)
+        return buf[flip]
+
+    def storage_chunks(self):
+        """
+        Query HDF5 chunk shape of the image, in the current representation order (numpy style)
+        :return: tuple of chunk sizes, or None if the image is not stored in chunks
+        """
+        if self._path is None:
+            return None
+        ndims = self.ndim()
+        chunk = ffi.new("int[]", ndims)
+        if lib.minc2_get_chunking(self._v, chunk)!=lib.MINC2_SUCCESS:
+            raise minc2_error("Error querying image chunking")
+        if chunk[0]==0:
+            return None
+        _store = self.store_dims()
+        _repr  = self.representation_dims()
+        store_ids = [d.id for d in _store]
+        return tuple( chunk[store_ids.index(_repr[ndims-i-1].id)] for i in range(ndims) )
+
+    def storage_info(self):
+        """
+        Query HDF5 storage options of the image
+        :return: dictionary with keys 'chunks' (chunk shape in file order, numpy style, or None if not chunked),
+                 'compression' (zlib compression level, or None if not compressed) and 'shuffle' (shuffle filter is used)
+        """
+        ndims = self.ndim()
+        chunk = ffi.new("int[]", ndims)
+        _compression = ffi.new("int*", 0)
+        _shuffle = ffi.new("int*", 0)
+        if lib.minc2_get_chunking(self._v, chunk)!=lib.MINC2_SUCCESS or \
+           lib.minc2_get_storage_filters(self._v, _compression, _shuffle)!=lib.MINC2_SUCCESS:
+            raise minc2_error("Error querying image storage")
+        return {'chunks':      tuple(chunk[ndims-1-i] for i in range(ndims)) if chunk[0]!=0 else None,
+                'compression': _compression[0] if _compression[0]>=0 else None,
+                'shuffle':     _shuffle[0]!=0}
+
     def setup_standard_order(self):
         """
         Request library to use stamdard order: positive step sizes
@@ -373,12 +643,17 @@ class minc2_file:
         """
         if lib.minc2_setup_standard_order(self._v)!=lib.MINC2_SUCCESS:
             raise minc2_error("Error setting up standard volume order")
+        self._standard = True
+        self._affine = None
+        self._shape = None
 
-    def save_complete_volume(self, buf):
+    def save_complete_volume(self, buf, value_range=None):
         """
         Dump whole numpy.ndarray into minc2 volume
         volume have to be open for writing and initialized (i.e .create or .imitate have been called)
         :param buf: numpy.ndarray
+        :param value_range: optional (min,max) range of values in buf, if known it is used instead of scanning the buffer.
+                            Ignored when slice scaling is used
         :return: numpy.ndarray
         """
         import numpy as np
@@ -391,15 +666,26 @@ class minc2_file:
 
         data_type=minc2_file.__numpy_to_minc2[store_type]
         
-        if lib.minc2_save_complete_volume(self._v,ffi.cast("void *", buf.ctypes.data),data_type)!=lib.MINC2_SUCCESS:
+        if self._save_complete_volume(ffi.cast("void *", buf.ctypes.data), data_type, value_range)!=lib.MINC2_SUCCESS:
             raise minc2_error("Error saving volume")
         return buf
 
-    def save_complete_volume_tensor(self, buf):
+    def _save_complete_volume(self, ptr, data_type, value_range):
+        """
+        internal function: save complete volume from a raw pointer, with optional known range of values
+        :return: status code
+        """
+        if value_range is None:
+            return lib.minc2_save_complete_volume(self._v, ptr, data_type)
+        return lib.minc2_save_complete_volume_range(self._v, ptr, data_type,
+                                                    float(value_range[0]), float(value_range[1]))
+
+    def save_complete_volume_tensor(self, buf, value_range=None):
         """
         Dump whole torch.Tensor into minc2 volume
         volume have to be open for writing and initialized (i.e .create or .imitate have been called)
         :param buf: torch.Tensor
+        :param value_range: optional (min,max) range of values in buf, see @save_complete_volume
         :return: torch.Tensor
         """
         #import torch
@@ -411,15 +697,78 @@ class minc2_file:
 
         data_type=minc2_file.__torch_to_minc2[store_type]
 
-        if lib.minc2_save_complete_volume(self._v,ffi.cast("void *", buf.untyped_storage().data_ptr()),data_type)!=lib.MINC2_SUCCESS:
+        if self._save_complete_volume(ffi.cast("void *", buf.untyped_storage().data_ptr()), data_type, value_range)!=lib.MINC2_SUCCESS:
             raise minc2_error("Error saving volume")
         return buf
 
-    def world_to_voxel(self, xyz):
+    @property
+    def voxel_to_world_affine(self):
+        """
+        4x4 affine matrix converting voxel coordinates (i,j,k,1) to world coordinates (X,Y,Z,1),
+        voxel coordinates follow the same convention as in @voxel_to_world.
+        Computed once from the volume geometry and cached
+        :return: numpy.ndarray 4x4
+        """
+        import numpy as np
+        if self._affine is None:
+            _in  = np.zeros(3, np.float64, 'C')
+            _out = np.empty(3, np.float64, 'C')
+            affine = np.eye(4)
+            for j in range(-1, 3):
+                _in[:] = 0.0
+                if j>=0:
+                    _in[j] = 1.0
+                if lib.minc2_voxel_to_world(self._v, ffi.cast("double *", _in.ctypes.data), ffi.cast("double *", _out.ctypes.data)) != lib.MINC2_SUCCESS:
+                    raise minc2_error("Error in voxel_to_world")
+                if j<0:
+                    affine[0:3, 3] = _out
+                else:
+                    affine[0:3, j] = _out-affine[0:3, 3]
+            self._affine = affine
+        return self._affine.copy()
+
+    @property
+    def world_to_voxel_affine(self):
+        """
+        4x4 affine matrix converting world coordinates (X,Y,Z,1) to voxel coordinates (i,j,k,1)
+        :return: numpy.ndarray 4x4
+        """
+        import numpy as np
+        return np.linalg.inv(self.voxel_to_world_affine)
+
+    @staticmethod
+    def _apply_affine(affine, pts, threads=None):
+        """
+        internal function: apply 4x4 affine matrix to array of points, one per row
+        :param threads: number of threads to split points between
+        :return: numpy.ndarray
+        """
+        import numpy as np
+        out = np.empty(pts.shape, np.float64, 'C')
+        rot = np.ascontiguousarray(affine[0:3, 0:3].T)
+        shift = affine[0:3, 3]
+
+        def _apply(bounds):
+            np.dot(pts[bounds[0]:bounds[1]], rot, out=out[bounds[0]:bounds[1]])
+            out[bounds[0]:bounds[1]] += shift
+
+        n = pts.shape[0]
+        if threads is not None and threads>1 and n>threads:
+            from concurrent.futures import ThreadPoolExecutor
+            bounds = [ (n*i)//threads for i in range(threads+1) ]
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                for _ in executor.map(_apply, zip(bounds[:-1], bounds[1:])):
+                    pass
+        else:
+            _apply((0, n))
+        return out
+
+    def world_to_voxel(self, xyz, threads=None):
         """
         Convert world coordinates (X,Y,Z) to voxel coordinates (i,j,k)
 
         :param xyz: - numpy array either length of 3 or 2D array with each row being X,Y,Z
+        :param threads: - number of threads to use for 2D array
         :return:    - either 1D array of (i,j,k) or 2D array with each row (i,j,k)
         """
         import numpy as np
@@ -430,16 +779,14 @@ class minc2_file:
                 raise minc2_error("Error world_to_voxel")
             return out_ijk
         else:
-            out_ijk = np.empty(in_xyz.shape, np.float64, 'C')
-            if lib.minc2_world_to_voxel_vec(self._v, in_xyz.shape[0], 3, ffi.cast("double *", in_xyz.ctypes.data), ffi.cast("double *", out_ijk.ctypes.data))!=lib.MINC2_SUCCESS:
-                raise minc2_error("Error world_to_voxel_vec")
-            return out_ijk
+            return self._apply_affine(self.world_to_voxel_affine, in_xyz, threads)
 
-    def voxel_to_world(self, ijk):
+    def voxel_to_world(self, ijk, threads=None):
         """
         Convert voxel coordinates (i,j,k) to world coordinates (X,Y,Z)
 
         :param ijk: - numpy array either length of 3 or 2D array with each row being i,j,k
+        :param threads: - number of threads to use for 2D array
         :return:    - either 1D array of (X,Y,Z) or 2D array with each row (X,Y,Z)
         """
         import numpy as np
@@ -450,11 +797,281 @@ class minc2_file:
                 raise minc2_error("Error in voxel_to_world")
             return out_xyz
         else:
-            out_xyz = np.empty(in_ijk.shape, np.float64, 'C')
-            if lib.minc2_world_to_voxel_vec(self._v, in_ijk.shape[0], 3, ffi.cast("double *", in_ijk.ctypes.data), ffi.cast("double *", out_xyz.ctypes.data)) != lib.MINC2_SUCCESS:
-                raise minc2_error("Error in voxel_to_world_vec")
-            return out_xyz
+            return self._apply_affine(self.voxel_to_world_affine, in_ijk, threads)
+
+    def resample(self, like, xfm=None, order='linear', path=None, store_type=None, fill=0.0, invert_xfm=False, threads=None):
+        """
+        Resample volume onto the sampling lattice of another volume, optionally applying transformation.
+        Follows mincresample convention: xfm maps this volume into the space of like,
+        so the inverse transformation is applied to every output voxel.
+        Volume is loaded into memory as float32, output is produced one slice at a time
+        :param like: minc2_file or list of minc2_dim describing output sampling lattice
+        :param xfm: minc2_xfm or path to .xfm file
+        :param order: interpolation order: 'nearest','linear' or 'cubic'
+        :param path: output file, if None - numpy array is returned
+        :param store_type: output file storage type, by default same as this volume,
+                           values are clamped to the range of the input volume and fill value for integer types
+        :param fill: value for the voxels outside of the volume
+        :param invert_xfm: apply forward transformation to output voxels instead
+        :param threads: number of threads to use
+        :return: numpy.ndarray of shape [z,y,x], or None when writing into file
+        """
+        import numpy as np
+        _orders={ 'nearest':lib.MINC2_RESAMPLE_NEAREST, 'linear':lib.MINC2_RESAMPLE_LINEAR, 'cubic':lib.MINC2_RESAMPLE_CUBIC }
+        if order in _orders:
+            order=_orders[order]
+        elif order not in _orders.values():
+            raise minc2_error("Unsupported interpolation order:"+repr(order))
+
+        _repr=self.representation_dims()
+        if self.ndim()!=3 or any(d.id not in (lib.MINC2_DIM_X,lib.MINC2_DIM_Y,lib.MINC2_DIM_Z) for d in _repr):
+            raise minc2_error("Only 3D spatial volumes can be resampled")
+
+        if isinstance(xfm, six.string_types):
+            xfm=minc2_xfm(xfm)
+        if isinstance(like, minc2_file):
+            like=like.store_dims()
+        _coord, _spatial = _lattice(like)
+        nx,ny,nz=[d.length for d in _spatial]
+
+        src=self.load_complete_volume('float32')
+        _src_dims=ffi.new("int[]", list(src.shape))
+
+        # source voxel index (in numpy order) to world
+        i2w=np.eye(4)
+        for a in range(3):
+            d=_repr[2-a]
+            c=np.asarray(d.dir_cos,np.float64) if d.have_dir_cos else np.eye(3)[d.id-lib.MINC2_DIM_X]
+            i2w[0:3,a]  = d.step*c
+            i2w[0:3,3] += d.start*c
+        w2i=np.linalg.inv(i2w)
+
+        out=None
+        out_file=None
+        if path is not None:
+            if store_type is None:
+                store_type=self.store_dtype()
+            store_type=np.dtype(store_type).name
+            out_file=minc2_file()
+            out_file.define(_spatial, store_type, 'float32')
+            out_file.create(path)
+            clamp=np.dtype(store_type).kind in 'iu'
+            if clamp:
+                vmin,vmax=min(float(np.nanmin(src)),fill),max(float(np.nanmax(src)),fill)
+                out_file.set_volume_range(vmin,vmax)
+            else:
+                vmin,vmax=np.inf,-np.inf
+            buf=np.empty((1,ny,nx),np.float32,'C')
+        else:
+            out=np.empty((nz,ny,nx),np.float32,'C')
+
+        plane=(_coord[1][:,None,:]+_coord[0][None,:,:]).reshape(-1,3)
+        for k in range(nz):
+            xyz=plane+_coord[2][k]
+            if xfm is not None:
+                xyz=xfm.transform_point(xyz,threads=threads) if invert_xfm else xfm.inverse_transform_point(xyz,threads=threads)
+            ijk=minc2_file._apply_affine(w2i, xyz, threads)
+            res=buf[0] if out is None else out[k]
+            minc2_file._interpolate(src, _src_dims, ijk, res.reshape(-1), order, fill, threads)
+
+            if out_file is not None:
+                if clamp:
+                    np.clip(res,vmin,vmax,out=res)
+                else:
+                    vmin,vmax=min(vmin,float(np.nanmin(res))),max(vmax,float(np.nanmax(res)))
+                out_file.save_hyperslab(buf,[k,None,None])
 
+        if out_file is not None:
+            if not clamp:
+                out_file.set_volume_range(vmin,vmax)
+            out_file.close()
+        return out
+
+    @staticmethod
+    def _interpolate(src, src_dims, ijk, out, order, fill, threads=None):
+        """
+        internal function: interpolate float32 volume at voxel coordinates, optionally splitting points between threads
+        """
+        n=ijk.shape[0]
+
+        def _run(bounds):
+            return lib.minc2_interpolate_volume(ffi.cast("const float *", src.ctypes.data), src_dims, bounds[1]-bounds[0],
+                                                ffi.cast("const double *", ijk[bounds[0]:bounds[1]].ctypes.data),
+                                                ffi.cast("float *", out[bounds[0]:bounds[1]].ctypes.data), order, fill)
+
+        if threads is not None and threads>1 and n>threads:
+            from concurrent.futures import ThreadPoolExecutor
+            bounds=[ (n*i)//threads for i in range(threads+1) ]
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                r=list(executor.map(_run, zip(bounds[:-1],bounds[1:])))
+        else:
+            r=[_run((0,n))]
+        if any(i!=lib.MINC2_SUCCESS for i in r):
+            raise minc2_error("Error interpolating volume")
+
+
+    #: operations supported by @reduce
+    reduce_ops = ('count', 'sum', 'mean', 'var', 'std', 'min', 'max', 'argmin', 'argmax', 'histogram')
+
+    def reduce(self, op, axis=None, mask=None, bins=256, hist_range=None, buffer_bytes=64*1024*1024):
+        """
+        Calculate statistics of the volume, reading it slab by slab, without loading the whole volume into memory.
+        Non-finite values are ignored. All requested statistics are calculated in a single pass
+        :param op: operation name, one of reduce_ops, or a list of them
+        :param axis: None - reduce over the whole volume, int or tuple of ints - dimensions (numpy order) to reduce
+        :param mask: optional mask: minc2_file, file name or numpy.ndarray with the same shape as the volume,
+                     only voxels with mask values above 0.5 are used
+        :param bins: number of histogram bins
+        :param hist_range: (min,max) of the histogram, default - volume range, empty range is extended by 0.5 on both sides
+        :param buffer_bytes: maximum size of the read buffer, at least one slice is read at a time
+        :return: result of the operation, scalar or numpy.ndarray, for histogram a tuple (hist, bin_edges)
+                 as in numpy.histogram; if op is a list - dictionary of results.
+                 Statistics of empty sets are NaN, argmin/argmax are -1
+        """
+        import numpy as np
+        ops = [op] if isinstance(op, six.string_types) else list(op)
+        for o in ops:
+            if o not in minc2_file.reduce_ops:
+                raise minc2_error("Unsupported operation:"+repr(o))
+
+        shape = self._representation_shape()
+        ndims = len(shape)
+        if axis is None:
+            axes = tuple(range(ndims))
+        else:
+            axes = tuple(a % ndims for a in ((axis,) if isinstance(axis, int) else axis))
+        if 'histogram' in ops and len(axes) != ndims:
+            raise minc2_error("Histogram is supported only for the whole volume")
+        if ('argmin' in ops or 'argmax' in ops) and axis is not None and not isinstance(axis, int):
+            raise minc2_error("argmin and argmax support only a single axis")
+
+        out_shape = tuple(shape[i] for i in range(ndims) if i not in axes)
+        keep = ffi.new("int[]", ndims)
+        for i in range(ndims):
+            keep[ndims-1-i] = 0 if i in axes else 1
+
+        r = ffi.new("struct minc2_reduction *")
+        arrays = {}
+        def _output(name, dtype=np.float64):
+            a = np.empty(out_shape, dtype)
+            arrays[name] = a
+            setattr(r, name, ffi.cast("long long *" if dtype == np.int64 else "double *", a.ctypes.data))
+        _output('count')
+        if set(ops) & set(('sum', 'mean', 'var', 'std')):
+            _output('mean')
+        if set(ops) & set(('var', 'std')):
+            _output('m2')
+        if set(ops) & set(('min', 'argmin')):
+            _output('min')
+        if set(ops) & set(('max', 'argmax')):
+            _output('max')
+        if 'argmin' in ops:
+            _output('argmin', np.int64)
+        if 'argmax' in ops:
+            _output('argmax', np.int64)
+        hist = None
+        if 'histogram' in ops:
+            if hist_range is None:
+                hist_range = self.volume_range()
+            hist_min, hist_max = float(hist_range[0]), float(hist_range[1])
+            if not (np.isfinite(hist_min) and np.isfinite(hist_max)):
+                raise minc2_error("Histogram range should be finite:"+repr(hist_range))
+            if hist_min > hist_max:
+                raise minc2_error("Histogram range max should not be less then min:"+repr(hist_range))
+            if hist_min == hist_max:
+                # empty range, i.e. of a constant volume, is widened like in numpy.histogram
+                hist_min, hist_max = hist_min-0.5, hist_max+0.5
+            hist = np.zeros(bins, np.float64)
+            r.bins = bins
+            r.hist_min, r.hist_max = hist_min, hist_max
+            r.hist = ffi.cast("double *", hist.ctypes.data)
+
+        mask_v = ffi.NULL
+        mask_buffer = ffi.NULL
+        mask_file = None
+        if isinstance(mask, np.ndarray):
+            if mask.shape != tuple(shape):
+                raise minc2_error("Mask shape {} doesn't match volume shape {}".format(mask.shape, tuple(shape)))
+            mask = np.ascontiguousarray(mask > 0.5, dtype=np.uint8)
+            mask_buffer = ffi.cast("unsigned char *", mask.ctypes.data)
+        elif mask is not None:
+            if not isinstance(mask, minc2_file):
+                mask = mask_file = minc2_file(mask)
+                if self._standard:
+                    mask.setup_standard_order()
+            if mask._representation_shape() != shape:
+                if mask_file is not None:
+                    mask_file.close()
+                raise minc2_error("Mask dimensions don't match the volume")
+            mask_v = mask._v
+
+        try:
+            if lib.minc2_reduce(self._v, mask_v, mask_buffer, keep, max(1, buffer_bytes//8), r) != lib.MINC2_SUCCESS:
+                raise minc2_error("Error calculating statistics")
+        finally:
+            if mask_file is not None:
+                mask_file.close()
+
+        count = arrays['count']
+        empty = count == 0
+        results = {}
+        for o in ops:
+            if o == 'count':
+                v = count.astype(np.int64)
+            elif o == 'sum':
+                v = arrays['mean']*count
+            elif o == 'mean':
+                v = np.where(empty, np.nan, arrays['mean'])
+            elif o in ('var', 'std'):
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    v = np.where(empty, np.nan, arrays['m2']/count)
+                if o == 'std':
+                    v = np.sqrt(v)
+            elif o in ('min', 'max'):
+                v = np.where(empty, np.nan, arrays[o])
+            elif o in ('argmin', 'argmax'):
+                v = arrays[o]
+                if axis is not None:
+                    # convert flat index into index along the reduced axis
+                    v = np.where(v < 0, -1, np.unravel_index(np.maximum(v, 0), shape)[axes[0]])
+            else:
+                edges = np.linspace(r.hist_min, r.hist_max, bins+1)
+                v = (hist, edges)
+            if o != 'histogram' and axis is None:
+                v = v[()].item()
+            results[o] = v
+        return results[op] if isinstance(op, six.string_types) else results
+
+    def as_lazy_array(self, data_type=None):
+        """
+        Create array-like proxy of the volume, which doesn't read voxel data until it is indexed
+        :param data_type: numpy datatype of the data, default - representation data type
+        :return: minc2_lazy_array
+        """
+        return minc2_lazy_array(self, data_type)
+
+    def to_dask(self, chunks='auto', data_type=None):
+        """
+        Create dask array backed by the file, each dask task opens it's own handle
+        and reads it's chunk with a hyperslab read, current dimension order is preserved.
+        Unless HDF5 library is thread-safe (see minc2_hdf5_threadsafe), reads of all files
+        are serialized with a single lock
+        :param chunks: dask chunk specification, by default chunks are aligned with the HDF5 chunks of the file
+        :param data_type: numpy datatype of the data, default - representation data type
+        :return: dask.array.Array
+        """
+        import numpy as np
+        import dask.array as da
+        from dask.utils import SerializableLock
+        if self._path is None:
+            raise minc2_error("file was not opened with .open")
+        reader = _minc2_dask_reader(self, data_type)
+        chunks = da.core.normalize_chunks(chunks, reader.shape, dtype=reader.dtype,
+                                          previous_chunks=self.storage_chunks())
+        # locks with the same token are shared, i.e between all volumes of minc2_dask_stack
+        lock = False if lib.minc2_hdf5_threadsafe() else SerializableLock('minc2-simple-hdf5')
+        return da.from_array(reader, chunks=chunks, lock=lock, asarray=False,
+                             meta=np.empty((0,)*reader.ndim, reader.dtype))
 
     def read_attribute(self, group, attribute):
         """
@@ -542,38 +1159,64 @@ class minc2_file:
 
     def metadata(self):
         """
-        Read complete metadata from minc2 volume into a dictionary
+        Read complete metadata from minc2 volume into a dictionary,
+        uses header cache if it is enabled ( see set_header_cache )
         :return: dict
         """
-        ret={}
-
-        group_iterator=ffi.gc(lib.minc2_allocate_info_iterator(), lib.minc2_free_info_iterator)
-        attr_iterator=ffi.gc(lib.minc2_allocate_info_iterator(), lib.minc2_free_info_iterator)
-
-        if lib.minc2_start_group_iterator(self._v,group_iterator)!=lib.MINC2_SUCCESS:
-            raise minc2_error("Error navigating groups")
-
-        while lib.minc2_iterator_group_next(group_iterator)==lib.MINC2_SUCCESS:
-            gname=lib.minc2_iterator_group_name(group_iterator)
-            if lib.minc2_start_attribute_iterator(self._v, gname, attr_iterator)!=lib.MINC2_SUCCESS:
-                raise minc2_error("Error iterating group:"+gname)
-            g={}
-
-            while lib.minc2_iterator_attribute_next(attr_iterator)==lib.MINC2_SUCCESS:
-                aname=lib.minc2_iterator_attribute_name(attr_iterator)
-                g[ to_unicode(ffi.string(aname)) ] = self.read_attribute(ffi.string(gname), ffi.string(aname))
-
-            ret[ to_unicode( ffi.string(lib.minc2_iterator_group_name(group_iterator)) ) ] = g
-            lib.minc2_stop_info_iterator(attr_iterator)
-
-        lib.minc2_stop_info_iterator(group_iterator)
-
-        # special attributes
-        ret['']={}
-        ret['']['history']=self.read_attribute('', 'history')
-        ret['']['ident']=self.read_attribute('', 'ident')
-        ret['']['minc_version']=self.read_attribute('', 'minc_version')
+        cache = get_header_cache() if self._path is not None else None
+        if cache is not None:
+            ret = cache.get_metadata(self._path)
+            if ret is None:
+                ret = self._read_metadata()
+                cache.put_metadata(self._path, ret)
+            return ret
+        return self._read_metadata()
 
+    def _read_metadata(self):
+        """
+        internal function: read complete metadata from the file in one call
+        :return: dict
+        """
+        buf=ffi.new("void*[1]")
+        size=ffi.new("size_t*",0)
+        if lib.minc2_metadata_dump(self._v,buf,size)!=lib.MINC2_SUCCESS:
+            raise minc2_error("Error reading metadata")
+        try:
+            data=ffi.buffer(buf[0],size[0])[:]
+        finally:
+            lib.minc2_free_metadata_dump(buf[0])
+        return self._decode_metadata(data)
+
+    @staticmethod
+    def _decode_metadata(data):
+        """
+        internal function: decode buffer produced by minc2_metadata_dump
+        :param data: bytes
+        :return: dict
+        """
+        import numpy as np
+        import struct
+        record=struct.Struct("=iiii")
+        ret={}
+        pos=0
+        while pos<len(data):
+            glen,alen,atype,length=record.unpack_from(data,pos)
+            pos+=record.size
+            g=ret.setdefault(to_unicode(data[pos:pos+glen]),{})
+            pos+=glen
+            if alen<0: # start of group
+                continue
+            name=to_unicode(data[pos:pos+alen])
+            pos+=alen
+            if atype == lib.MINC2_STRING:
+                g[name]=to_unicode(data[pos:pos+length].split(b'\0',1)[0])
+                pos+=length
+            elif atype in minc2_file.__minc2_to_numpy:
+                dtype=np.dtype(minc2_file.__minc2_to_numpy[atype])
+                g[name]=np.frombuffer(data,dtype,length,pos).copy()
+                pos+=length*dtype.itemsize
+            else:
+                raise minc2_error("Error determining attribute type {}".format(name))
         return ret
 
     def write_metadata(self, m):
@@ -606,6 +1249,39 @@ class minc2_file:
             raise minc2_error("Error setting representation type")
         return minc2_file.__minc2_to_numpy[_dtype[0]]
 
+    def get_scaling(self):
+        """
+        query intensity scaling used by the volume
+        :return: tuple (global_scaling, slice_scaling) of booleans
+        """
+        _global = ffi.new("int*",0)
+        _slice  = ffi.new("int*",0)
+        if lib.minc2_get_scaling(self._v,_global,_slice)!=lib.MINC2_SUCCESS:
+            raise minc2_error("Error getting scaling")
+        return (_global[0]!=0, _slice[0]!=0)
+
+    def volume_range(self):
+        """
+        query real value range of the volume
+        :return: tuple (min,max)
+        """
+        _min = ffi.new("double*",0.0)
+        _max = ffi.new("double*",0.0)
+        if lib.minc2_get_volume_range(self._v,_min,_max)!=lib.MINC2_SUCCESS:
+            raise minc2_error("Error getting volume range")
+        return (_min[0], _max[0])
+
+    def valid_range(self):
+        """
+        query valid range of voxel values as stored on disk
+        :return: tuple (min,max)
+        """
+        _min = ffi.new("double*",0.0)
+        _max = ffi.new("double*",0.0)
+        if lib.minc2_get_valid_range(self._v,_min,_max)!=lib.MINC2_SUCCESS:
+            raise minc2_error("Error getting valid range")
+        return (_min[0], _max[0])
+
     def representation_dtype_tensor(self):
         """
         query representation datatype (as python sees the volume)
@@ -706,6 +1382,100 @@ class minc2_file:
         if lib.minc2_set_volume_range(self._v,rmin,rmax) != lib.MINC2_SUCCESS:
             raise minc2_error()
 
+    def _representation_shape(self):
+        """
+        internal function: cached volume shape in current representation (numpy style)
+        """
+        if self._shape is None:
+            _dims = self.representation_dims_()
+            self._shape = tuple(_dims[i].length for i in reversed(range(self.ndim())))
+        return self._shape
+
+    def _slab_arrays(self, slab):
+        """
+        internal function: convert hyperslab description into arrays for the C library
+        :param slab: array of format ((dim1_start[,dim1_stop]),(dim2_start[,dim2_stop]),....), see @load_hyperslab
+        :return: (slab_start, slab_count, dims) - C arrays of starts and counts and a list of counts (numpy style)
+        """
+        shape = self._representation_shape()
+        ndims = len(shape)
+        dims = [None]*ndims
+
+        slab_start = ffi.new("int[]",ndims)
+        slab_count = ffi.new("int[]",ndims)
+
+        for i in range(ndims):
+            s = slab[i] if len(slab)>i else None
+            if s is None:
+                slab_count[ndims-1-i] = shape[i]
+                slab_start[ndims-1-i] = 0
+            elif isinstance(s, list) or isinstance(s, tuple):
+                if len(s) == 2:
+                    slab_count[ndims-1-i] = s[1]-s[0]
+                    slab_start[ndims-1-i] = s[0]
+                else:# -- assume it's the whole dimension
+                    slab_count[ndims-1-i] = shape[i]
+                    slab_start[ndims-1-i] = 0
+            else: # assume it's a number
+                slab_count[ndims-1-i] = 1
+                slab_start[ndims-1-i] = s
+            dims[i] = slab_count[ndims-1-i]
+        return slab_start, slab_count, dims
+
+    @staticmethod
+    def _numpy_type(data_type):
+        """
+        internal function: resolve data type specification
+        :param data_type: minc2 data type, numpy data type name or numpy.dtype
+        :return: (numpy data type name, minc2 data type)
+        """
+        if data_type in minc2_file.__minc2_to_numpy:
+            return minc2_file.__minc2_to_numpy[data_type], data_type
+        elif data_type in minc2_file.__numpy_to_minc2:
+            return data_type, minc2_file.__numpy_to_minc2[data_type]
+        elif hasattr(data_type, 'name') and data_type.name in minc2_file.__numpy_to_minc2:
+            return data_type.name, minc2_file.__numpy_to_minc2[data_type.name]
+        raise minc2_error("Unsupported data type:"+repr(data_type))
+
+    @staticmethod
+    def _torch_type(data_type):
+        """
+        internal function: resolve data type specification for torch
+        :param data_type: minc2 data type or torch tensor type name (i.e. 'torch.FloatTensor')
+        :return: (torch tensor type, minc2 data type)
+        """
+        import torch
+        if data_type in minc2_file.__minc2_to_torch:
+            name = minc2_file.__minc2_to_torch[data_type]
+        elif data_type in minc2_file.__torch_to_minc2:
+            name, data_type = data_type, minc2_file.__torch_to_minc2[data_type]
+        else:
+            raise minc2_error("Unsupported data type:"+repr(data_type))
+        return getattr(torch, name.split('.')[-1]), data_type
+
+    def read_plan(self, count, data_type=None, tensor=False):
+        """
+        Prepare repeated reading of hyperslabs of the same size and data type, i.e. patches for training,
+        see minc2_read_plan. The plan is bound to the current dimension order
+        :param count: size of the hyperslab (numpy style), None entries mean the whole dimension
+        :param data_type: requested data type, by default representation data type
+        :param tensor: produce torch.Tensor instead of numpy.ndarray
+        :return: minc2_read_plan
+        """
+        return minc2_read_plan(self, count, data_type, tensor)
+
+    def open_stream_writer(self, spool=None, directory=None):
+        """
+        Start writing the volume slab by slab, in any order, without knowing the range of values in advance,
+        see minc2_stream_writer. Scaling information is finalized when the writer is closed.
+        Volume have to be open for writing (i.e .create was called), the writer is bound to the current dimension order
+        :param spool: keep written data in a temporary file until the writer is closed, by default used only
+                      when the range have to be known before writing, i.e. integer storage without slice scaling
+        :param directory: directory for the temporary file, default - system temporary directory
+        :return: minc2_stream_writer, use as a context manager
+        """
+        return minc2_stream_writer(self, spool=spool, directory=directory)
+
     def save_hyperslab(self, buf, start=None):
         """
         save a hyperslab into minc2 volume
@@ -716,36 +1486,8 @@ class minc2_file:
         if start is None:
             return self.save_complete_volume(buf)
         else:
-            #import numpy as np
-            data_type  = lib.MINC2_FLOAT
-            store_type = buf.dtype.name
-
-            ndims = self.ndim()
-            _dims = self.representation_dims_()
-            #dims = buf.shape # can't be used if we are using array with missing dimensions
-
-            # TODO: unsqueeze array
-
-            slab_start=ffi.new("int[]",ndims)
-            slab_count=ffi.new("int[]",ndims)
-
-            for i in range(ndims):
-                if start[i] is not None:
-                    if isinstance(start[i], list) or isinstance(start[i], tuple):
-                        if len(start[i])==2:
-                            slab_count[ndims-1-i]=start[i][1]-start[i][0]
-                            slab_start[ndims-1-i]=start[i][0]
-                        else: # assume it's the whole dimension
-                            slab_count[ndims-1-i]=_dims[ndims-i-1].length
-                            slab_start[ndims-1-i]=0
-                    else: # assume it's a number
-                        slab_count[ndims-1-i]=1 # _dims[ndims-i-1].length
-                        slab_start[ndims-1-i]=start[i]
-                else:
-                    slab_count[ndims-1-i]=_dims[ndims-i-1].length
-                    slab_start[ndims-1-i]=0
-            
-            data_type=minc2_file.__numpy_to_minc2[store_type]
+            slab_start, slab_count, dims = self._slab_arrays(start)
+            data_type=minc2_file.__numpy_to_minc2[buf.dtype.name]
 
             if lib.minc2_write_hyperslab( self._v, slab_start, slab_count,
                                           ffi.cast("void *", buf.ctypes.data),
@@ -764,36 +1506,10 @@ class minc2_file:
         if start is None:
             return self.save_complete_volume(buf)
         else:
-            import torch
             store_type=buf.type()
             assert(store_type in minc2_file.__torch_to_minc2)
-            # TODO: verify dimensions of the array
-
-            #data_type = minc2_file.store_type[store_type]
             data_type=minc2_file.__torch_to_minc2[store_type]
-
-            ndims =self.ndim()
-            #dims = buf.size()
-            _dims = self.representation_dims_()
-
-            slab_start=ffi.new("int[]",ndims)
-            slab_count=ffi.new("int[]",ndims)
-
-            for i in range(ndims):
-                if start[i] is not None:
-                    if isinstance(start[i], list) or isinstance(start[i], tuple):
-                        if len(start[i])==2:
-                            slab_count[ndims-1-i]=start[i][1]-start[i][0]
-                            slab_start[ndims-1-i]=start[i][0]
-                        else: # assume it's the whole dimension (?)
-                            slab_count[ndims-1-i]=_dims[ndims-1-i]
-                            slab_start[ndims-1-i]=0
-                    else: #assume it's a number
-                        slab_count[ndims-1-i]=1 # dims[i]
-                        slab_start[ndims-1-i]=start[i]
-                else: # use the whole dimension (?)
-                    slab_count[ndims-1-i]=_dims[ndims-1-i]
-                    slab_start[ndims-1-i]=0
+            slab_start, slab_count, dims = self._slab_arrays(start)
 
             if lib.minc2_write_hyperslab( self._v, slab_start, slab_count,
                                           ffi.cast("void *", buf.untyped_storage().data_ptr()),
@@ -801,58 +1517,24 @@ class minc2_file:
                 raise minc2_error("Error writing hyperslab")
             return buf
 
-    def load_hyperslab(self, slab=None, data_type=None):
+    def load_hyperslab(self, slab=None, data_type=None, out=None):
         """
         Load hyperslab into memory
         :param slab: array of format ((dim1_start[,dim1_stop]),(dim2_start[,dim2_stop]),....) describing the hyperslab to read
-        :param data_type: requested numpy datatype
+        :param data_type: requested numpy datatype, by default data type of out or representation data type
+        :param out: optional output buffer, see @load_complete_volume
         :return: numpy.ndarray
         """
+        import numpy as np
         if data_type is None:
-            data_type=self.representation_dtype()
+            data_type=out.dtype if isinstance(out, np.ndarray) else self.representation_dtype()
         if slab is None:
-            return self.load_complete_volume(data_type)
+            return self.load_complete_volume(data_type, out=out)
         else:
-            import numpy as np
-            buf = None
-            _dims = self.representation_dims_()
-            ndims = self.ndim()
-            dims = [None]*ndims
-
-            slab_start = ffi.new("int[]",ndims)
-            slab_count = ffi.new("int[]",ndims)
-
-            for i in range(ndims):
-                if len(slab)>i and slab[i] is not None:
-                    if isinstance(slab[i], list) or isinstance(slab[i], tuple):
-                        if len(slab[i]) == 2:
-                            slab_count[ndims-1-i] = slab[i][1]-slab[i][0]
-                            slab_start[ndims-1-i] = slab[i][0]
-                        else:# -- assume it's the whole dimension
-                            slab_count[ndims-1-i] = _dims[ndims-i-1].length
-                            slab_start[ndims-1-i] = 0
-                    else: # assume it's a number
-                        slab_count[ndims-1-i] = 1
-                        slab_start[ndims-1-i] = slab[i]
-                else:
-                    slab_count[ndims-1-i] = _dims[ndims-i-1].length
-                    slab_start[ndims-1-i] = 0
-                dims[i] = slab_count[ndims-1-i]
-
-            dtype = None
-
-            if data_type in minc2_file.__minc2_to_numpy:
-                dtype=minc2_file.__minc2_to_numpy[data_type]
-            elif data_type in minc2_file.__numpy_to_minc2:
-                dtype=data_type
-                data_type=minc2_file.__numpy_to_minc2[dtype]
-            elif isinstance(data_type, np.dtype):
-                dtype=data_type
-                data_type=minc2_file.__numpy_to_minc2[dtype.name]
-            else:
-                raise minc2_error("Unsupported data type:"+repr(data_type))
+            slab_start, slab_count, dims = self._slab_arrays(slab)
+            dtype, data_type = self._numpy_type(data_type)
 
-            buf = np.empty(dims, dtype, 'C')
+            buf = np.empty(dims, dtype, 'C') if out is None else self._check_out(out, dims, dtype)
 
             if lib.minc2_read_hyperslab( self._v, slab_start, slab_count,
                                          ffi.cast("void *", buf.ctypes.data),
@@ -860,103 +1542,746 @@ class minc2_file:
                 raise minc2_error("Error reading hyperslab")
             return buf
 
-    def load_hyperslab_t(self, slab=None, data_type=None):
+    def load_hyperslab_t(self, slab=None, data_type=None, out=None):
         """
         Load hyperslab into memory, for torch
         :param slab: array of format ((dim1_start[,dim1_stop]),(dim2_start[,dim2_stop]),....) describing the hyperslab to read
-        :param data_type: requested numpy datatype
+        :param data_type: requested numpy datatype, by default type of out or representation data type
+        :param out: optional output contiguous CPU tensor of matching shape and type
         :return: torch.Tensor
         """
         if data_type is None:
-            data_type=self.representation_dtype_tensor()
+            data_type=out.type() if out is not None else self.representation_dtype_tensor()
         if slab is None:
-            return self.load_complete_volume_tensor(data_type)
+            return self.load_complete_volume_tensor(data_type, out=out)
         else:
-            import torch
-            buf = None
-            _dims = self.representation_dims()
-            ndims = self.ndim()
-            dims = [None]*ndims
-
-            slab_start = ffi.new("int[]",ndims)
-            slab_count = ffi.new("int[]",ndims)
-
-            for i in range(ndims):
-                if len(slab)>i and slab[i] is not None:
-                    if isinstance(slab[i], list) or isinstance(slab[i], tuple):
-                        if len(slab[i]) == 2:
-                            slab_count[ndims-1-i] = slab[i][1]-slab[i][0]
-                            slab_start[ndims-1-i] = slab[i][0]
-                        else:# -- assume it's the whole dimension
-                            slab_count[ndims-1-i] = _dims[ndims-i-1].length
-                            slab_start[ndims-1-i] = 0
-                    else: # assume it's a number
-                        slab_count[ndims-1-i] = 1
-                        slab_start[ndims-1-i] = slab[i]
-                else:
-                    slab_count[ndims-1-i] = _dims[ndims-i-1].length
-                    slab_start[ndims-1-i] = 0
-                dims[i] = slab_count[ndims-1-i]
-
-            dtype=None
+            slab_start, slab_count, dims = self._slab_arrays(slab)
+            dtype, data_type = self._torch_type(data_type)
 
-            if data_type in minc2_file.__minc2_to_torch:
-                dtype=eval(minc2_file.__minc2_to_torch[data_type])
-            elif data_type in minc2_file.__torch_to_minc2:
-                #print("evaluate:{}".format(data_type))
-                dtype=eval(data_type)
-                data_type=minc2_file.__torch_to_minc2[data_type]
+            if out is None:
+                buf=dtype(*dims)
             else:
-                raise minc2_error("Unsupported data type:"+repr(data_type))
-
-            buf=dtype(*dims)
+                buf=self._check_out_tensor(out, dims, minc2_file.__minc2_to_torch[data_type])
 
             if lib.minc2_read_hyperslab( self._v, slab_start, slab_count,
-                                         ffi.cast("void *", buf.untyped_storage().data_ptr()),
+                                         ffi.cast("void *", buf.data_ptr()),
                                          data_type ) != lib.MINC2_SUCCESS:
                 raise minc2_error("Error reading hyperslab")
             return buf
 
-    def _slices_to_slab(self, args):
-        # assume it's either a number, or slice
-        args = args if isinstance(args, tuple) else (args,)
-        slab=[]
-        _dims = self.representation_dims()
-        ndims = self.ndim()
+    # maximum number of separate hyperslab reads issued by a single __getitem__/__setitem__,
+    # beyond that neighbouring reads are merged into bounding boxes
+    max_hyperslab_reads = 1024
+    # indices along a dimension are always read as one bounding box if it is
+    # at most this many times larger then the number of indices
+    hyperslab_merge_ratio = 8
+    # merged bounding box is read at once only if it is at most this many bytes, or at most
+    # twice as large as the voxels used from it, otherwise it is read plane by plane
+    hyperslab_merge_bytes = 4*1024*1024
 
-        if len(args)!=self.ndim():
-            raise minc2_error("Unsupported number of dimensions")
+    def _parse_index(self, s):
+        """
+        internal function: convert numpy-style index into per-dimension items
+        :param s: index, as passed to __getitem__
+        :return: (items, key) - items: one entry per dimension, either int, slice or numpy array of
+                 non-negative integers, key: items in the original order, with None (newaxis) entries kept
+        """
+        import numpy as np
+        args = s if isinstance(s, tuple) else (s,)
+        _dims = self.representation_dims_()
+        ndims = self.ndim()
+        shape = [_dims[ndims-i-1].length for i in range(ndims)]
+
+        parsed=[]
+        for a in args:
+            if a is None or a is Ellipsis or isinstance(a, slice):
+                parsed+=[a]
+            elif isinstance(a, (bool, np.bool_)):
+                raise minc2_error("Unsupported index:"+repr(a))
+            elif isinstance(a, six.integer_types+(np.integer,)):
+                parsed+=[int(a)]
+            else:
+                a = np.asarray(a)
+                if a.dtype == np.bool_:
+                    parsed+=[a] # boolean mask, expanded below
+                elif a.dtype.kind in 'iu' or a.size==0:
+                    parsed+=[int(a)] if a.ndim==0 else [a.astype(np.intp)]
+                else:
+                    raise minc2_error("Unsupported index type:"+repr(a.dtype))
+
+        ellipsis = [j for j,a in enumerate(parsed) if a is Ellipsis]
+        if len(ellipsis)>1:
+            raise IndexError("an index can only have a single ellipsis ('...')")
+        used = sum(a.ndim if isinstance(a, np.ndarray) and a.dtype==np.bool_ else 1
+                   for a in parsed if a is not None and a is not Ellipsis)
+        if used>ndims:
+            raise IndexError("too many indices: volume is {}-dimensional, but {} were indexed".format(ndims,used))
+        if ellipsis:
+            i = ellipsis[0]
+            parsed = parsed[:i] + [slice(None)]*(ndims-used) + parsed[i+1:]
+        else:
+            parsed += [slice(None)]*(ndims-used)
+
+        items=[]
+        key=[]
+        for a in parsed:
+            if a is None:
+                key+=[None]
+                continue
+            if isinstance(a, np.ndarray) and a.dtype == np.bool_:
+                k = len(items)
+                if a.shape!=tuple(shape[k:k+a.ndim]):
+                    raise IndexError("boolean index shape {} does not match volume dimensions {}".format(a.shape, tuple(shape[k:k+a.ndim])))
+                a = a.nonzero()
+            else:
+                a = (a,)
+            for b in a:
+                n = shape[len(items)]
+                if isinstance(b, np.ndarray):
+                    b = np.where(b<0, b+n, b)
+                    if b.size>0 and (b.min()<0 or b.max()>=n):
+                        raise IndexError("index out of bounds for dimension {} with size {}".format(len(items), n))
+                elif not isinstance(b, slice):
+                    if b<-n or b>=n:
+                        raise IndexError("index {} is out of bounds for dimension {} with size {}".format(b, len(items), n))
+                    b = b+n if b<0 else b
+                items+=[b]
+                key+=[b]
+        return items, key
+
+    def _index_plan(self, items):
+        """
+        internal function: plan hyperslab reads covering all voxels referenced by the index items.
+        Indices along each dimension are grouped into runs of consecutive values, one read per
+        combination of runs. Runs along a dimension are merged into their bounding box, when it is small
+        (see hyperslab_merge_ratio) or when the number of reads exceeds max_hyperslab_reads, starting with
+        the fastest varying dimensions; the needed planes are then picked in memory.
+        Memory used by merged reads is bounded by _bounded_blocks
+        :param items: per-dimension items, as returned by _parse_index
+        :return: (uniq, blocks) - uniq: sorted unique indices referenced along each dimension,
+                 blocks: list of (slab, dst, sel) - hyperslab to read, its position in the compact array
+                 of shape [len(u) for u in uniq] and per-dimension selection within the hyperslab (None for all)
+        """
+        import numpy as np
+        import itertools
+        _dims = self.representation_dims_()
+        ndims = self.ndim()
+        shape = [_dims[ndims-i-1].length for i in range(ndims)]
 
-        for i,a in enumerate(args):
+        uniq=[]
+        for a,n in zip(items, shape):
             if isinstance(a, slice):
-                if a.step is not None and a.step!=1:
-                    raise minc2_error()
-                slab+=[(a.start if a.start is not None  else 0,
-                        a.stop  if a.stop  is not None  else _dims[ndims-i-1].length )]
-            elif isinstance(a, int):
-                slab+=[a]
+                r = range(*a.indices(n))
+                uniq += [np.arange(min(r[0],r[-1]), max(r[0],r[-1])+1, abs(r.step)) if len(r)>0 else np.arange(0)]
+            elif isinstance(a, np.ndarray):
+                uniq += [np.unique(a)]
+            else:
+                uniq += [np.arange(a, a+1)]
+
+        if any(len(u)==0 for u in uniq):
+            return uniq, []
+
+        runs=[]
+        for u in uniq:
+            b = np.flatnonzero(np.diff(u)!=1)+1
+            runs += [list(zip(np.concatenate(([0], b)), np.concatenate((b, [len(u)]))))]
+
+        merged = [False]*ndims
+        for k in range(ndims):
+            if len(runs[k])>1 and uniq[k][-1]-uniq[k][0]+1 <= self.hyperslab_merge_ratio*len(uniq[k]):
+                runs[k] = [(0, len(uniq[k]))]
+                merged[k] = True
+
+        n_reads = 1
+        for r in runs:
+            n_reads *= len(r)
+        for k in reversed(range(ndims)):
+            if n_reads<=self.max_hyperslab_reads:
+                break
+            if len(runs[k])>1:
+                n_reads //= len(runs[k])
+                runs[k] = [(0, len(uniq[k]))]
+                merged[k] = True
+
+        blocks=[]
+        for combo in itertools.product(*runs):
+            slab = [ (int(uniq[k][p0]), int(uniq[k][p1-1])+1) for k,(p0,p1) in enumerate(combo) ]
+            dst  = tuple( slice(int(p0), int(p1)) for p0,p1 in combo )
+            sel  = [ uniq[k]-slab[k][0] if merged[k] else None for k in range(ndims) ]
+            blocks += [(slab, dst, sel)]
+        return uniq, blocks
+
+    @staticmethod
+    def _remap_key(key, uniq):
+        """
+        internal function: translate index key into index into compact array built by _index_plan
+        """
+        import numpy as np
+        ckey=[]
+        i=0
+        for a in key:
+            if a is None:
+                ckey+=[None]
+                continue
+            if isinstance(a, slice):
+                ckey+=[slice(None) if a.step is None or a.step>0 else slice(None, None, -1)]
+            elif isinstance(a, np.ndarray):
+                ckey+=[np.searchsorted(uniq[i], a)]
             else:
-                raise minc2_error("Unsupported dimension type:"+repr(a))
-        return slab
+                ckey+=[0]
+            i+=1
+        return tuple(ckey)
+
+    @staticmethod
+    def _select(block, sel):
+        """
+        internal function: pick planes listed in sel out of a merged hyperslab
+        """
+        import numpy as np
+        for k,s in enumerate(sel):
+            if s is None:
+                continue
+            d = np.diff(s)
+            if len(s)==1 or (d==d[0]).all():
+                block = block[(slice(None),)*k+(slice(s[0], s[-1]+1, s[1]-s[0] if len(s)>1 else 1),)]
+            else:
+                block = np.take(block, s, axis=k)
+        return block
+
+    def _bounded_blocks(self, blocks, itemsize):
+        """
+        internal function: split merged blocks larger than hyperslab_merge_bytes (and larger than twice
+        the part of them that is used) into single planes along the slowest merged dimension, recursively,
+        so that the size of a single read stays proportional to the size of the output
+        :param blocks: list of (slab, dst, sel), as returned by _index_plan
+        :param itemsize: size of a voxel in bytes
+        :return: generator of (slab, dst, sel)
+        """
+        for slab,dst,sel in blocks:
+            merged = [k for k,s in enumerate(sel) if s is not None]
+            box  = itemsize
+            used = itemsize
+            for (b0,b1),d in zip(slab, dst):
+                box  *= b1-b0
+                used *= d.stop-d.start
+            if not merged or box <= max(self.hyperslab_merge_bytes, 2*used):
+                yield slab,dst,sel
+                continue
+            k = merged[0]
+            planes=[]
+            for j,i in enumerate(sel[k]):
+                _slab = list(slab)
+                _slab[k] = (slab[k][0]+int(i), slab[k][0]+int(i)+1)
+                _dst = dst[:k]+(slice(dst[k].start+j, dst[k].start+j+1),)+dst[k+1:]
+                _sel = list(sel)
+                _sel[k] = None
+                planes += [(_slab, _dst, _sel)]
+            for b in self._bounded_blocks(planes, itemsize):
+                yield b
+
+    def _load_compact(self, uniq, blocks, dtype):
+        """
+        internal function: read all blocks into compact array
+        """
+        import numpy as np
+        out = np.empty([len(u) for u in uniq], dtype, 'C')
+        for slab,dst,sel in self._bounded_blocks(blocks, out.itemsize):
+            out[dst] = self._select(self.load_hyperslab(slab, dtype), sel)
+        return out
 
     def __getitem__(self,s):
         """
-        numpy-style interface for reading hyperslabs from volume
+        numpy-style interface for reading hyperslabs from volume.
+        Supports integers (including negative), slices with arbitrary steps, Ellipsis, None,
+        integer index arrays and boolean masks, with the same semantics as numpy.ndarray.
+        Only voxels referenced by the index are read, using as few hyperslab reads as possible,
+        i.e vol[:,[10,50,90],:] results in three reads
         :param s: slice information
         :return: numpy.ndarray
         """
-        idx=self._slices_to_slab(s)
-        return self.load_hyperslab(idx).squeeze()
+        return self._read_index(s, self.representation_dtype())
+
+    def _read_index(self, s, dtype):
+        """
+        internal function: implementation of __getitem__, reading voxels as dtype
+        """
+        import numpy as np
+        items, key = self._parse_index(s)
+
+        arrays = [a for a in items if isinstance(a, np.ndarray)]
+        if len(arrays)>1:
+            # several index arrays are broadcast together and select individual points,
+            # reading the outer product of their indices could be wasteful
+            outer = 1
+            for a in arrays:
+                outer *= len(np.unique(a))
+            if outer > 2*np.broadcast(*arrays).size:
+                return self._load_points(items, key, dtype)
+
+        uniq, blocks = self._index_plan(items)
+        out = self._load_compact(uniq, blocks, dtype)
+        return out[self._remap_key(key, uniq)]
+
+    def _load_points(self, items, key, dtype):
+        """
+        internal function: read voxels selected by several broadcast index arrays.
+        Points are grouped by their index along the slowest indexed dimension, for each group
+        only the outer product of the indices used within the group is read
+        """
+        import numpy as np
+        # when index arrays are present, integers are broadcast with them as well
+        adv = [j for j,a in enumerate(items) if not isinstance(a, slice)]
+        coords = np.broadcast_arrays(*[np.asarray(items[j]) for j in adv])
+        shape  = coords[0].shape
+        pts, inverse = np.unique(np.stack([c.ravel() for c in coords], axis=-1), axis=0, return_inverse=True)
+        basic = [j for j,a in enumerate(items) if isinstance(a, slice)]
+        flip  = tuple( slice(None) if items[j].step is None or items[j].step>0 else slice(None,None,-1) for j in basic )
+
+        part = None
+        for g in np.unique(pts[:,0]):
+            grp = pts[:,0]==g
+            sub = list(items)
+            for n,j in enumerate(adv):
+                sub[j] = pts[grp,n]
+            uniq, blocks = self._index_plan(sub)
+            r = np.transpose(self._load_compact(uniq, blocks, dtype), adv+basic)
+            r = r[tuple(np.searchsorted(uniq[j], pts[grp,n]) for n,j in enumerate(adv))]
+            r = r[(slice(None),)+flip]
+            if part is None:
+                part = np.empty((len(pts),)+r.shape[1:], dtype)
+            part[grp] = r
+        out = part[inverse.ravel()].reshape(shape+part.shape[1:])
+
+        # add new axes, in the order of slices and None entries
+        j = len(shape)
+        for a in key:
+            if a is None:
+                out = np.expand_dims(out, j)
+            if a is None or isinstance(a, slice):
+                j += 1
+        # numpy places broadcast dimensions in place of the advanced indices if they are adjacent,
+        # in front otherwise
+        pos = [j for j,a in enumerate(key) if a is not None and not isinstance(a, slice)]
+        if pos==list(range(pos[0], pos[-1]+1)):
+            p = sum(1 for a in key[:pos[0]] if a is None or isinstance(a, slice))
+            out = np.moveaxis(out, list(range(len(shape))), list(range(p, p+len(shape))))
+        return out
 
     def __setitem__(self, s, val):
         """
-        numpy-style interface for writing hyperslabs into volume
+        numpy-style interface for writing hyperslabs into volume, supports the same indices as __getitem__.
+        Contiguous hyperslabs are written directly, otherwise affected hyperslabs are read, modified and written back
         :param s: slice information
-        :param val:  numpy.ndarray
+        :param val:  numpy.ndarray or scalar
         :return:
         """
-        idx=self._slices_to_slab(s)
-        return self.save_hyperslab(val,idx)
+        import numpy as np
+        items, key = self._parse_index(s)
+        val = np.asarray(val)
+        if val.dtype.name not in minc2_file.__numpy_to_minc2:
+            val = val.astype(self.representation_dtype())
+
+        if all(not isinstance(a, np.ndarray) and (not isinstance(a, slice) or a.step in (None, 1)) for a in items):
+            _dims = self.representation_dims_()
+            ndims = self.ndim()
+            slab=[]
+            for i,a in enumerate(items):
+                slab += [a.indices(_dims[ndims-i-1].length)[:2] if isinstance(a, slice) else a]
+            count = [ max(b[1]-b[0], 0) if isinstance(b, tuple) else 1 for b in slab ]
+            if any(c==0 for c in count):
+                return
+            shape = []
+            it = iter(slab)
+            for a in key:
+                if a is None:
+                    shape += [1]
+                else:
+                    b = next(it)
+                    if isinstance(b, tuple):
+                        shape += [b[1]-b[0]]
+            buf = np.ascontiguousarray(np.broadcast_to(val, shape).reshape(count))
+            self.save_hyperslab(buf, slab)
+            return
+
+        uniq, blocks = self._index_plan(items)
+        if not blocks:
+            return
+        dtype = self.representation_dtype()
+        out = self._load_compact(uniq, blocks, dtype)
+        out[self._remap_key(key, uniq)] = val
+        for slab,dst,sel in self._bounded_blocks(blocks, out.itemsize):
+            if any(s is not None for s in sel):
+                buf = self.load_hyperslab(slab, dtype)
+                buf[np.ix_(*[np.arange(buf.shape[k]) if s is None else s for k,s in enumerate(sel)])] = out[dst]
+            else:
+                buf = np.ascontiguousarray(out[dst])
+            self.save_hyperslab(buf, slab)
+
+class minc2_lazy_array(object):
+    """
+    Array-like proxy of minc2_file, voxel data is read only when indexed
+    or converted to numpy.ndarray. Uses current dimension order of the file, i.e
+    call minc2_file.setup_standard_order before creating the proxy if needed
+    """
+    # default upper limit of memory used by a single block in map_blocks and reduce
+    block_bytes = 64*1024*1024
+
+    def __init__(self, volume, data_type=None):
+        """
+        :param volume: minc2_file opened for reading
+        :param data_type: numpy datatype of the data, default - representation data type
+        """
+        import numpy as np
+        self._volume = volume
+        if data_type is None:
+            data_type = volume.representation_dtype()
+        elif data_type in minc2_file.minc2_to_numpy:
+            data_type = minc2_file.minc2_to_numpy[data_type]
+        self.dtype = np.dtype(data_type)
+        if self.dtype.name not in minc2_file.numpy_to_minc2:
+            raise minc2_error("Unsupported data type:"+repr(data_type))
+        _dims = volume.representation_dims_()
+        self.shape = tuple(_dims[i].length for i in reversed(range(volume.ndim())))
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        import numpy as np
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size*self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return "minc2_lazy_array(shape={}, dtype={})".format(self.shape, self.dtype.name)
+
+    def __getitem__(self, s):
+        """
+        numpy-style indexing, see minc2_file.__getitem__ ,only voxels referenced by the index are read
+        :return: numpy.ndarray
+        """
+        return self._volume._read_index(s, self.dtype.name)
+
+    def __array__(self, dtype=None, copy=None):
+        """
+        read the whole volume
+        """
+        buf = self._volume.load_complete_volume(self.dtype.name)
+        return buf if dtype is None else buf.astype(dtype, copy=False)
+
+    def blocks(self, block_size=None):
+        """
+        Iterate over the volume in blocks along the first dimension
+        :param block_size: number of elements along the first dimension in a block,
+               default - fit into block_bytes
+        :return: generator of ((start,stop), numpy.ndarray)
+        """
+        if block_size is None:
+            block_size = max(1, self.block_bytes//max(1, self.nbytes//max(1, self.shape[0])))
+        for i in range(0, self.shape[0], block_size):
+            r = (i, min(i+block_size, self.shape[0]))
+            yield r, self._volume.load_hyperslab([r], self.dtype.name)
+
+    def map_blocks(self, func, block_size=None, dtype=None):
+        """
+        Apply function to each block of the volume, see @blocks,
+        and concatenate results along the first dimension
+        :param func: function receiving numpy.ndarray block, should return numpy.ndarray with
+               the same number of dimensions
+        :param block_size: number of elements along the first dimension in a block
+        :param dtype: datatype of the result, default - as returned by func
+        :return: numpy.ndarray
+        """
+        import numpy as np
+        out = [func(b) for _,b in self.blocks(block_size)]
+        out = np.concatenate(out, axis=0)
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+    def reduce(self, func, combine=None, block_size=None):
+        """
+        Reduce the volume block by block, see @blocks
+        :param func: numpy.ufunc (i.e numpy.add, numpy.maximum) or function receiving numpy.ndarray block
+               and returning partial result
+        :param combine: function combining two partial results, default - func for ufunc
+        :param block_size: number of elements along the first dimension in a block
+        :return: reduction result
+        """
+        import numpy as np
+        if isinstance(func, np.ufunc):
+            ufunc = func
+            func = lambda b: ufunc.reduce(b, axis=None)
+            if combine is None:
+                combine = ufunc
+        elif combine is None:
+            raise minc2_error("combine function is required")
+        result = None
+        for _,b in self.blocks(block_size):
+            r = func(b)
+            result = r if result is None else combine(result, r)
+        return result
+
+
+class minc2_read_plan(object):
+    """
+    Prepared hyperslab read of a fixed size and data type, only the offset changes between reads.
+    Geometry and data type are resolved once, and C arrays are reused, so that per-call overhead
+    is minimal. Not thread-safe: use a separate plan in each thread
+    """
+    def __init__(self, volume, count, data_type=None, tensor=False):
+        """
+        :param volume: minc2_file opened for reading
+        :param count: size of the hyperslab (numpy style), None entries mean the whole dimension
+        :param data_type: requested data type, by default representation data type
+        :param tensor: produce torch.Tensor instead of numpy.ndarray
+        """
+        import numpy as np
+        self._np = np
+        self._volume = volume
+        self._v = volume._v
+        shape = volume._representation_shape()
+        ndims = len(shape)
+        if len(count) != ndims:
+            raise minc2_error("Hyperslab should have {} dimensions".format(ndims))
+        self.shape = tuple(shape[i] if count[i] is None else int(count[i]) for i in range(ndims))
+        self._ndims = ndims
+        self._start = ffi.new("int[]", ndims)
+        self._count = ffi.new("int[]", ndims)
+        for i in range(ndims):
+            self._count[ndims-1-i] = self.shape[i]
+        self._tensor = tensor
+        if tensor:
+            if data_type is None:
+                data_type = volume.representation_dtype_tensor()
+            self.dtype, self._data_type = minc2_file._torch_type(data_type)
+            self._type_name = self.dtype().type()
+        else:
+            if data_type is None:
+                data_type = volume.representation_dtype()
+            self.dtype, self._data_type = minc2_file._numpy_type(data_type)
+
+    def read(self, start, out=None):
+        """
+        Read hyperslab
+        :param start: offset of the hyperslab (numpy style), one integer per dimension
+        :param out: optional output numpy.ndarray (or torch.Tensor) of matching shape and type
+        :return: numpy.ndarray or torch.Tensor
+        """
+        n = self._ndims
+        _start = self._start
+        for i in range(n):
+            _start[n-1-i] = start[i]
+        if self._tensor:
+            if out is None:
+                out = self.dtype(*self.shape)
+            elif tuple(out.shape) != self.shape or out.type() != self._type_name or not out.is_contiguous():
+                minc2_file._check_out_tensor(out, self.shape, self._type_name)
+            ptr = out.data_ptr()
+        else:
+            if out is None:
+                out = self._np.empty(self.shape, self.dtype)
+            elif type(out) is not self._np.ndarray or out.shape != self.shape or \
+                 out.dtype != self.dtype or not out.flags.c_contiguous:
+                out = minc2_file._check_out(out, self.shape, self.dtype)
+            ptr = out.ctypes.data
+        if lib.minc2_read_hyperslab(self._v, _start, self._count, ffi.cast("void *", ptr),
+                                    self._data_type) != lib.MINC2_SUCCESS:
+            raise minc2_error("Error reading hyperslab")
+        return out
+
+
+class minc2_stream_writer(object):
+    """
+    Out-of-core writer: accepts slabs in any order, tracks running range of values and
+    finalizes scaling information on close.
+    With slice scaling, range of every slice is stored as it is written, so slabs have to contain complete slices.
+    With integer storage and global scaling, voxel values depend on the range of the whole volume,
+    so written data is kept in a temporary file and converted on close.
+    Slabs can be written from several threads
+    """
+    #: maximum size of blocks copied from the temporary file on close
+    block_bytes = 64*1024*1024
+
+    def __init__(self, volume, spool=None, directory=None):
+        """
+        :param volume: minc2_file open for writing
+        :param spool: keep written data in a temporary file until close, default - when needed
+        :param directory: directory for the temporary file
+        """
+        import numpy as np
+        import threading
+        import tempfile
+        self._np = np
+        self._volume = volume
+        self.shape = tuple(volume._representation_shape())
+        self.dtype = np.dtype(volume.representation_dtype())
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+        _, self._slice_scaling = volume.get_scaling()
+        if spool is None:
+            spool = not self._slice_scaling and volume.store_dtype() not in ('float32', 'float64')
+        self._spool_file = None
+        self._spool = None
+        if spool:
+            self._spool_file = tempfile.TemporaryFile(prefix='minc2-stream-', dir=directory)
+            self._spool = np.memmap(self._spool_file, dtype=self.dtype, mode='w+', shape=self.shape)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._release()
+
+    def _update_range(self, buf, data_type):
+        """
+        internal function: update running range with values of the buffer
+        """
+        _min = ffi.new("double*", 0.0)
+        _max = ffi.new("double*", 0.0)
+        if lib.minc2_buffer_range(ffi.cast("void *", buf.ctypes.data), buf.size, data_type,
+                                  _min, _max) != lib.MINC2_SUCCESS:
+            raise minc2_error("Error calculating range")
+        if _min[0] != _min[0]: # no finite values
+            return
+        with self._lock:
+            self.min = _min[0] if self.min is None else min(self.min, _min[0])
+            self.max = _max[0] if self.max is None else max(self.max, _max[0])
+
+    def write(self, buf, start):
+        """
+        Write a slab
+        :param buf: numpy.ndarray, with the same number of dimensions as the volume
+        :param start: offset of the slab (numpy style), one integer per dimension
+        """
+        np = self._np
+        if self._volume is None:
+            raise minc2_error("Stream writer is closed")
+        buf = np.ascontiguousarray(buf)
+        ndims = len(self.shape)
+        if buf.ndim != ndims or len(start) != ndims:
+            raise minc2_error("Slab should have {} dimensions".format(ndims))
+        for i in range(ndims):
+            if start[i] < 0 or start[i]+buf.shape[i] > self.shape[i]:
+                raise minc2_error("Slab is outside of the volume")
+        _, data_type = minc2_file._numpy_type(buf.dtype.name)
+        self._update_range(buf, data_type)
+
+        if self._spool is not None:
+            self._spool[tuple(slice(start[i], start[i]+buf.shape[i]) for i in range(ndims))] = buf
+            return
+
+        slab_start = ffi.new("int[]", ndims)
+        slab_count = ffi.new("int[]", ndims)
+        for i in range(ndims):
+            slab_start[ndims-1-i] = start[i]
+            slab_count[ndims-1-i] = buf.shape[i]
+        with self._lock:
+            if lib.minc2_write_hyperslab(self._volume._v, slab_start, slab_count,
+                                         ffi.cast("void *", buf.ctypes.data), data_type) != lib.MINC2_SUCCESS:
+                raise minc2_error("Error writing hyperslab")
+
+    def close(self):
+        """
+        Finalize the volume: store the range of values and, if data was kept in a temporary file,
+        convert it into the volume. The volume itself stays open
+        """
+        if self._volume is None:
+            return
+        try:
+            vmin, vmax = (self.min, self.max) if self.min is not None else (0.0, 0.0)
+            if not self._slice_scaling:
+                self._volume.set_volume_range(vmin, vmax)
+            if self._spool is not None:
+                shape = self.shape
+                step = max(1, self.block_bytes//max(1, self._spool[0].nbytes)) if shape[0] > 0 else 1
+                for i in range(0, shape[0], step):
+                    j = min(i+step, shape[0])
+                    self._volume.save_hyperslab(self._np.ascontiguousarray(self._spool[i:j]), [(i, j)])
+        finally:
+            self._release()
+
+    def _release(self):
+        """
+        internal function: drop temporary file and detach from the volume
+        """
+        self._volume = None
+        if self._spool is not None:
+            del self._spool
+            self._spool = None
+            self._spool_file.close()
+            self._spool_file = None
+
+
+class _minc2_dask_reader(object):
+    """
+    internal class: picklable array-like description of the volume, used by minc2_file.to_dask.
+    Each read opens the file separately, so that chunks can be read in parallel threads and processes
+    """
+    def __init__(self, volume, data_type=None):
+        import numpy as np
+        self.path = volume._path
+        self.standard = volume._standard
+        if data_type is None:
+            data_type = volume.representation_dtype()
+        elif data_type in minc2_file.minc2_to_numpy:
+            data_type = minc2_file.minc2_to_numpy[data_type]
+        self.dtype = np.dtype(data_type)
+        if self.dtype.name not in minc2_file.numpy_to_minc2:
+            raise minc2_error("Unsupported data type:"+repr(data_type))
+        _dims = volume.representation_dims_()
+        self.shape = tuple(_dims[i].length for i in reversed(range(volume.ndim())))
+        self.ndim = len(self.shape)
+
+    def __dask_tokenize__(self):
+        import os
+        return (self.path, os.path.getmtime(self.path), self.standard, self.dtype.name)
+
+    def __getitem__(self, s):
+        v = minc2_file(self.path, standard=self.standard)
+        try:
+            return v._read_index(s, self.dtype.name)
+        finally:
+            v.close()
+
+
+def minc2_dask_stack(paths, chunks='auto', data_type=None, standard=False):
+    """
+    Stack several volumes with the same dimensions into a single dask array, see minc2_file.to_dask
+    :param paths: list of file paths
+    :param chunks: dask chunk specification for each volume, by default aligned with the HDF5 chunks of the first file
+    :param data_type: numpy datatype of the data, default - representation data type of the first file
+    :param standard: use standard dimension order ( see minc2_file.setup_standard_order)
+    :return: dask.array.Array, with the new first dimension enumerating files
+    """
+    import dask.array as da
+    arrays = []
+    for p in paths:
+        v = minc2_file(p, standard=standard)
+        try:
+            if arrays:
+                shape = tuple(d.length for d in reversed(v.representation_dims()))
+                if shape != arrays[0].shape:
+                    raise minc2_error("Volume {} has shape {}, expected {}".format(p, shape, arrays[0].shape))
+                # reuse chunking of the first volume
+                arrays += [v.to_dask(arrays[0].chunks, arrays[0].dtype)]
+            else:
+                arrays += [v.to_dask(chunks, data_type)]
+        finally:
+            v.close()
+    if not arrays:
+        raise minc2_error("No files to stack")
+    return da.stack(arrays, axis=0)
+
 
 class minc2_xfm:
     """
@@ -977,6 +2302,7 @@ class minc2_xfm:
         :param path: file path
         """
         self._v=ffi.gc(lib.minc2_xfm_allocate0(),lib.minc2_xfm_destroy)
+        self._copies=None
         if path is not None:
             self.open(path)
 
@@ -987,6 +2313,7 @@ class minc2_xfm:
         :return:
         """
         assert path is not None,"Provide xfm file"
+        self._copies=None
         assert lib.minc2_xfm_open(self._v,to_bytes(path)) == lib.MINC2_SUCCESS
 
     def save(self, path):
@@ -998,10 +2325,58 @@ class minc2_xfm:
         assert path is not None,"Provide xfm file"
         assert(lib.minc2_xfm_save(self._v,to_bytes(path)) == lib.MINC2_SUCCESS)
 
-    def transform_point(self, xyz_in):
+    def _is_linear(self):
+        """
+        internal function: check if transform consists only of linear parts
+        """
+        return all(self.get_n_type(i)==lib.MINC2_XFM_LINEAR for i in range(max(self.get_n_concat(),1)))
+
+    def _thread_copies(self, n):
+        """
+        internal function: transforms to be used by n worker threads.
+        Linear transforms are shared, non-linear transforms keep internal state (i.e grid volume cache),
+        so every thread gets it's own copy, copies are kept until the transform is changed
+        :return: list of n minc2_xfm objects
+        """
+        if self._is_linear():
+            return [self]*n
+        if self._copies is None:
+            self._copies=[]
+        while len(self._copies)<n-1:
+            c=minc2_xfm()
+            c.concat_xfm(self)
+            self._copies+=[c]
+        return [self]+self._copies[:n-1]
+
+    def _transform_vec(self, fn, xyz_in, threads):
+        """
+        internal function: apply vectorized transform function to array of points, optionally using multiple threads
+        """
+        import numpy as np
+        xyz_out=np.empty(xyz_in.shape,'float64','C')
+        n=xyz_in.shape[0]
+        if threads is not None and threads>1 and n>threads:
+            from concurrent.futures import ThreadPoolExecutor
+            bounds=[ (n*i)//threads for i in range(threads+1) ]
+            xfms=self._thread_copies(threads)
+
+            def _run(i):
+                return fn(xfms[i]._v, bounds[i+1]-bounds[i], 3,
+                          ffi.cast("double *", xyz_in[bounds[i]:bounds[i+1]].ctypes.data),
+                          ffi.cast("double *", xyz_out[bounds[i]:bounds[i+1]].ctypes.data))
+
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                r=list(executor.map(_run, range(threads)))
+            assert(all(i==lib.MINC2_SUCCESS for i in r))
+        else:
+            assert(fn(self._v, n, 3, ffi.cast("double *", xyz_in.ctypes.data), ffi.cast("double *", xyz_out.ctypes.data))==lib.MINC2_SUCCESS)
+        return xyz_out
+
+    def transform_point(self, xyz_in, threads=None):
         """
         Apply transformation to coordinates
         :param xyz_in:  either 1d array or 2d array
+        :param threads: number of threads to use for 2d array
         :return:  1d or 3d array
         """
         import numpy as np
@@ -1011,14 +2386,13 @@ class minc2_xfm:
             assert(lib.minc2_xfm_transform_point(self._v,ffi.cast("double *", _xyz_in.ctypes.data),ffi.cast("double *", xyz_out.ctypes.data))==lib.MINC2_SUCCESS)
             return xyz_out
         else:
-            xyz_out=np.empty(_xyz_in.shape,'float64','C')
-            assert(lib.minc2_xfm_transform_point_vec(self._v,_xyz_in.shape[0], 3, ffi.cast("double *", _xyz_in.ctypes.data), ffi.cast("double *", xyz_out.ctypes.data))==lib.MINC2_SUCCESS)
-            return xyz_out
+            return self._transform_vec(lib.minc2_xfm_transform_point_vec, _xyz_in, threads)
 
-    def inverse_transform_point(self,xyz_in):
+    def inverse_transform_point(self, xyz_in, threads=None):
         """
         Apply inverse transformation to coordinates
         :param xyz_in:  either 1d array or 2d array
+        :param threads: number of threads to use for 2d array
         :return:  1d or 3d array
         """
         import numpy as np
@@ -1028,15 +2402,70 @@ class minc2_xfm:
             assert(lib.minc2_xfm_inverse_transform_point(self._v,ffi.cast("double *", _xyz_in.ctypes.data),ffi.cast("double *", xyz_out.ctypes.data))==lib.MINC2_SUCCESS)
             return xyz_out
         else:
-            xyz_out=np.empty(_xyz_in.shape,'float64','C')
-            assert(lib.minc2_xfm_inverse_transform_point_vec(self._v,_xyz_in.shape[0], 3, ffi.cast("double *", _xyz_in.ctypes.data), ffi.cast("double *", xyz_out.ctypes.data))==lib.MINC2_SUCCESS)
-            return xyz_out
+            return self._transform_vec(lib.minc2_xfm_inverse_transform_point_vec, _xyz_in, threads)
+
+    def transform_grid(self, like, dtype='float32', displacement=True, inverse=False, out=None, path=None, threads=None):
+        """
+        Evaluate transformation on every voxel of a sampling lattice, one slice at a time,
+        without creating the list of coordinates for the whole lattice
+        :param like: minc2_file or list of minc2_dim describing the lattice, only spatial dimensions are used
+        :param dtype: output data type
+        :param displacement: produce displacements (transformed-original coordinates), otherwise transformed coordinates
+        :param inverse: apply inverse transformation
+        :param out: optional C-contiguous numpy.ndarray of shape [z,y,x,3] to write results into
+        :param path: write results into MINC file, with vector dimension fastest (as used by grid transforms), instead of array
+        :param threads: number of threads to use for transforming points
+        :return: numpy.ndarray of shape [z,y,x,3], or None when writing into file
+        """
+        import numpy as np
+        if isinstance(like, minc2_file):
+            like = like.store_dims()
+        _coord, _spatial = _lattice(like)
+        nx,ny,nz=[d.length for d in _spatial]
+        dtype=np.dtype(dtype)
+
+        grid=None
+        if path is not None:
+            if dtype.name not in ('float32','float64'):
+                raise minc2_error("Grid file should be stored as float32 or float64")
+            grid=minc2_file()
+            grid.define([minc2_dim(id=minc2_file.MINC2_DIM_VEC, length=3, start=0.0, step=1.0, have_dir_cos=False, dir_cos=None)]+
+                        _spatial, dtype.name, dtype.name)
+            grid.create(path)
+            buf=np.empty((1,ny,nx,3),dtype,'C')
+            vmin,vmax=np.inf,-np.inf
+        elif out is not None:
+            out=minc2_file._check_out(out, (nz,ny,nx,3), dtype)
+        else:
+            out=np.empty((nz,ny,nx,3),dtype,'C')
+
+        fn=self.inverse_transform_point if inverse else self.transform_point
+        plane=(_coord[1][:,None,:]+_coord[0][None,:,:]).reshape(-1,3)
+        for k in range(nz):
+            xyz=plane+_coord[2][k]
+            r=fn(xyz,threads=threads)
+            if displacement:
+                r-=xyz
+            r=r.reshape(ny,nx,3)
+            if grid is not None:
+                buf[0]=r
+                vmin,vmax=min(vmin,r.min()),max(vmax,r.max())
+                grid.save_hyperslab(buf,[k,None,None,None])
+            else:
+                out[k]=r
+
+        if grid is not None:
+            grid.set_volume_range(vmin,vmax)
+            grid.close()
+            return None
+        return out
 
     def invert(self):
         """
         invert transform
         :return:
         """
+        self._copies=None
         assert(lib.minc2_xfm_invert(self._v)==lib.MINC2_SUCCESS)
 
     def get_n_concat(self):
@@ -1114,6 +2543,7 @@ class minc2_xfm:
         :return:
         """
         import numpy as np
+        self._copies=None
         if isinstance(par,np.ndarray): # assume it's a matrix
             _mat=np.asarray(par,'float64','C')
             assert(lib.minc2_xfm_append_linear_transform(self._v,ffi.cast("double *", _mat.ctypes.data))==lib.MINC2_SUCCESS)
@@ -1142,6 +2572,7 @@ class minc2_xfm:
         :param inv:  inversion flag
         :return:
         """
+        self._copies=None
         assert(lib.minc2_xfm_append_grid_transform(self._v,to_bytes(grid_file),inv)==lib.MINC2_SUCCESS)
         return self
 
@@ -1151,6 +2582,7 @@ class minc2_xfm:
         :param another: another minc2_xfm object
         :return:
         """
+        self._copies=None
         assert(lib.minc2_xfm_concat_xfm(self._v,another._v)==lib.MINC2_SUCCESS)
 
 
@@ -1384,6 +2816,31 @@ class minc2_input_iterator:
         lib.minc2_iterator_get_values(self._i,ffi.cast("void *", self._val.ctypes.data))
         return self._val
 
+    def iter_blocks(self):
+        """
+        iterate over the remaining voxels one slice at a time, instead of one voxel at a time
+        :return: generator of ((start,stop), numpy.ndarray of shape [n_files, n_voxels]),
+                 start and stop are linear voxel indices in the order of iteration,
+                 i.e. into the volume flattened in C order
+        """
+        import numpy as np
+        _size   = ffi.new("int*",0)
+        _count  = ffi.new("int*",0)
+        _offset = ffi.new("long long*",0)
+        _end    = ffi.new("int*",0)
+        if lib.minc2_iterator_block_size(self._i,_size)!=lib.MINC2_SUCCESS:
+            raise minc2_error("Error getting iterator block size")
+        n = len(self._handles)
+
+        while not self._last:
+            buf = np.empty(n*_size[0], self._dtype, 'C')
+            if lib.minc2_iterator_get_block(self._i,ffi.cast("void *", buf.ctypes.data),_count,_offset)!=lib.MINC2_SUCCESS:
+                raise minc2_error("Error reading iterator block")
+            if lib.minc2_iterator_next_slice(self._i,_end)!=lib.MINC2_SUCCESS:
+                raise minc2_error("Error reading next iterator slice")
+            self._last=_end[0]!=0
+            yield (_offset[0], _offset[0]+_count[0]), buf[:n*_count[0]].reshape(n, _count[0])
+
     def __del__(self):
         self.close()
 
@@ -1469,7 +2926,7 @@ class minc2_output_iterator:
                 if slice_scaling: _slice_scaling=1
                 if global_scaling: _global_scaling=1
 
-                if lib.minc2_set_scaling(self._v,_global_scaling,_slice_scaling )!=lib.MINC2_SUCCESS:
+                if lib.minc2_set_scaling(h,_global_scaling,_slice_scaling )!=lib.MINC2_SUCCESS:
                     raise minc2_error()
 
             if lib.minc2_create(h, to_bytes(f) )!=lib.MINC2_SUCCESS:
@@ -1517,4 +2974,27 @@ class minc2_output_iterator:
         lib.minc2_iterator_put_values(self._i,ffi.cast("void *", self._val.ctypes.data))
         return v
 
+    def put_block(self, values):
+        """
+        write values for a block of voxels and advance, slices are written into files as soon as they are complete
+        :param values: array of shape [n_files, n_voxels] (or [n_voxels] for a single file), voxels in the order of iteration
+        :return: number of voxels written
+        """
+        import numpy as np
+        if self._last:
+            raise minc2_error("Iterator is at the end of the volume")
+        v = np.ascontiguousarray(values, dtype=self._dtype)
+        if v.ndim==1 and len(self._handles)==1:
+            v = v.reshape(1, -1)
+        if v.ndim!=2 or v.shape[0]!=len(self._handles):
+            raise minc2_error("Expected array of shape [{}, n_voxels], got {}".format(len(self._handles), v.shape))
+
+        _written = ffi.new("int*",0)
+        _end     = ffi.new("int*",0)
+        r = lib.minc2_iterator_put_block(self._i, ffi.cast("const void *", v.ctypes.data), v.shape[1], _written, _end)
+        self._last = _end[0]!=0
+        if r!=lib.MINC2_SUCCESS:
+            raise minc2_error("Error writing block: {} of {} voxels written".format(_written[0], v.shape[1]))
+        return _written[0]
+
 # kate: indent-width 4; replace-tabs on; remove-trailing-space on; hl python; show-tabs on
@@ -28,6 +28,10 @@ with open(os.path.join(source_path,"minc2-simple.c"),'r') as f:
     minc2_simple_src=f.read()
 with open(os.path.join(source_path,"minc2-matrix-ops.c"),'r') as f:
     minc2_simple_src+=f.read()
+with open(os.path.join(source_path,"minc2-resample.c"),'r') as f:
+    minc2_simple_src+=f.read()
+with open(os.path.join(source_path,"minc2-reduce.c"),'r') as f:
+    minc2_simple_src+=f.read()
 with open(os.path.join(source_path,"minc2-simple-int.h"),'r') as f:
   minc2_simple_defs+=f.read()
 
@@ -36,16 +40,64 @@ minc2_simple_defs+="""
 void free(void *ptr);
 """
 
+def find_openmp():
+  """
+  Find compiler and linker flags enabling OpenMP: a small extension module is built with each candidate
+  through cffi and loaded, like FindOpenMP in CMake tests the compiler.
+  MINC2_SIMPLE_OPENMP environment variable overrides the detection: 0 - build without OpenMP,
+  other value - flags used both for compiling and linking, i.e. MINC2_SIMPLE_OPENMP="-fopenmp"
+  """
+  import importlib.util
+  import shutil
+  import tempfile
+
+  flags=os.environ.get('MINC2_SIMPLE_OPENMP',"").strip()
+  if flags == "0":
+    return [],[]
+  elif flags:
+    return flags.split(),flags.split()
+
+  if platform == "win32":
+    candidates=[ (['/openmp'],[]) ]
+  else:
+    candidates=[ (['-fopenmp'],['-fopenmp']),                 # gcc, clang
+                 (['-Xpreprocessor','-fopenmp'],['-lomp']) ]  # Apple clang with libomp
+  tmp=tempfile.mkdtemp()
+  try:
+    for i,(compile_args,link_args) in enumerate(candidates):
+      name="_openmp_test{}".format(i)
+      test=cffi.FFI()
+      test.cdef("int openmp_threads(void);")
+      test.set_source(name,"#include <omp.h>\nint openmp_threads(void) { return omp_get_max_threads(); }\n",
+                      extra_compile_args=compile_args,extra_link_args=link_args)
+      try:
+        # loading the module makes sure that OpenMP runtime was linked
+        spec=importlib.util.spec_from_file_location(name,test.compile(tmpdir=tmp))
+        module=importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        if module.lib.openmp_threads()>0:
+          return compile_args,link_args
+      except (cffi.VerificationError,ImportError,OSError):
+        pass
+  finally:
+    shutil.rmtree(tmp,ignore_errors=True)
+  print("OpenMP not found, building without it")
+  return [],[]
+
 if platform == "linux" or platform == "linux2":
   _extra_link_args=['-Wl,-rpath={}'.format(os.path.join(minc_prefix,"lib"))]
 elif platform == "darwin":
   _extra_link_args=['-Xlinker','-rpath','-Xlinker',os.path.join(minc_prefix,"lib")]
 
+_openmp_compile_args,_openmp_link_args=find_openmp()
+_extra_compile_args+=_openmp_compile_args
+_extra_link_args+=_openmp_link_args
+
 ffibuilder.set_source("minc2_simple._simple",
     minc2_simple_src,
     # The important thing is to include libc in the list of libraries we're
     # linking against:
-    libraries=["minc2","c"],
+    libraries=["minc2","hdf5","c"],
     include_dirs=[os.path.join(minc_prefix,"include"),source_path],
     library_dirs=[os.path.join(minc_prefix,"lib")],
     extra_compile_args=_extra_compile_args,
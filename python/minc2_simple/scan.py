@@ -0,0 +1,206 @@
+from __future__ import print_function
+
+import multiprocessing
+
+from .minc2_simple import minc2_file,minc2_error
+from .cache        import get_header_cache
+from .utils        import to_unicode
+
+
+# columns describing volume, in addition to requested attributes
+scan_columns = ['path', 'error', 'ndim', 'shape', 'store_dtype', 'representation_dtype',
+                'global_scaling', 'slice_scaling', 'volume_min', 'volume_max', 'valid_min', 'valid_max',
+                'store_dims', 'representation_dims']
+
+# columns which require query of the scaling information, which is skipped in header-only mode,
+# filled only if any of them is listed in attributes
+scan_scaling_columns = ['representation_dtype', 'global_scaling', 'slice_scaling',
+                        'volume_min', 'volume_max', 'valid_min', 'valid_max']
+
+
+def _attributes_from_metadata(metadata, attributes):
+    """
+    internal function: extract attributes in format group:attribute from metadata dictionary
+    """
+    r = {}
+    for a in attributes:
+        group, name = a.split(':', 1)
+        r[a] = metadata.get(group, {}).get(name)
+    return r
+
+
+def _scan_one(path, attributes, standard, with_metadata=False, scaling=False):
+    """
+    internal function: read header information of a single file
+    :param with_metadata: also read complete metadata, stored under 'metadata' key
+    :param scaling: also read scaling information (see scan_scaling_columns)
+    :return: dict with one entry per column
+    """
+    v = minc2_file(path, header_only=True)
+    try:
+        if standard:
+            v.setup_standard_order()
+        r = {}
+        r['ndim'] = v.ndim()
+        r['store_dims'] = v.store_dims()
+        r['representation_dims'] = v.representation_dims()
+        r['shape'] = tuple(d.length for d in reversed(r['representation_dims']))
+        r['store_dtype'] = v.store_dtype()
+        if scaling:
+            r['representation_dtype'] = v.representation_dtype()
+            r['global_scaling'], r['slice_scaling'] = v.get_scaling()
+            r['volume_min'], r['volume_max'] = v.volume_range()
+            r['valid_min'], r['valid_max'] = v.valid_range()
+        if with_metadata:
+            # bypass the cache, it belongs to the parent process
+            r['metadata'] = v._read_metadata()
+            r.update(_attributes_from_metadata(r['metadata'], attributes))
+            return r
+        for a in attributes:
+            group, name = a.split(':', 1)
+            try:
+                r[a] = v.read_attribute(group, name)
+            except minc2_error:
+                r[a] = None
+        return r
+    finally:
+        v.close()
+
+
+def _scan_chunk(paths, attributes, standard, with_metadata=False, scaling=False):
+    """
+    internal function: read header information of several files, executed by a worker process
+    :return: list of (record, error message)
+    """
+    out = []
+    for p in paths:
+        try:
+            out += [(_scan_one(p, attributes, standard, with_metadata, scaling), None)]
+        except Exception as e:
+            out += [(None, "{}: {}".format(type(e).__name__, to_unicode(str(e))))]
+    return out
+
+
+def scan_headers(paths, attributes=None, workers=None, chunk_size=64, standard=False,
+                 progress=None, errors='collect', as_dataframe=False, cache=None):
+    """
+    Read header information of many minc files in parallel, files are opened in header-only mode.
+    Files found in the header cache are not opened at all
+    :param paths: list of file paths
+    :param attributes: list of attributes to read, in format group:attribute, i.e. 'dicom_0x0008:el_0x0020'
+                       missing attributes are reported as None. Can also include names of scan_scaling_columns,
+                       which are filled only when requested, because reading them cancels the savings of header-only mode
+    :param workers: number of worker processes, default - number of CPUs, 1 or 0 - scan in the current process
+    :param chunk_size: number of files processed by a worker in one task
+    :param standard: report representation dimensions in standard order ( see minc2_file.setup_standard_order)
+    :param progress: optional callback progress(done,total), called every time a chunk is finished
+    :param errors: 'collect' - store error message in the 'error' column and continue, 'raise' - raise minc2_error
+    :param as_dataframe: return pandas.DataFrame instead of dictionary
+    :param cache: minc2_header_cache to use, default - the cache enabled with set_header_cache, False - don't use cache.
+                  When cache is used, complete metadata of scanned files is stored in it
+    :return: dict of numpy arrays, one entry per column (see scan_columns), plus one column per requested attribute,
+             numeric columns of failed files and columns that were not requested are set to -1 or NaN, other columns to None
+    """
+    import numpy as np
+    if errors not in ('collect', 'raise'):
+        raise minc2_error("Unsupported errors mode:"+repr(errors))
+    paths = [to_unicode(p) for p in paths]
+    attributes = list(attributes) if attributes is not None else []
+    for a in attributes:
+        if ':' not in a and a not in scan_scaling_columns:
+            raise minc2_error("Unsupported attribute:"+repr(a))
+    scaling = any(a in scan_scaling_columns for a in attributes)
+    attributes = [a for a in attributes if ':' in a]
+    n = len(paths)
+
+    columns = {
+        'path':                 np.empty(n, dtype=object),
+        'error':                np.full(n, None, dtype=object),
+        'ndim':                 np.full(n, -1, dtype=np.int32),
+        'shape':                np.full(n, None, dtype=object),
+        'store_dtype':          np.full(n, None, dtype=object),
+        'representation_dtype': np.full(n, None, dtype=object),
+        'global_scaling':       np.zeros(n, dtype=bool),
+        'slice_scaling':        np.zeros(n, dtype=bool),
+        'volume_min':           np.full(n, np.nan),
+        'volume_max':           np.full(n, np.nan),
+        'valid_min':            np.full(n, np.nan),
+        'valid_max':            np.full(n, np.nan),
+        'store_dims':           np.full(n, None, dtype=object),
+        'representation_dims':  np.full(n, None, dtype=object),
+    }
+    columns['path'][:] = paths
+    for a in attributes:
+        columns[a] = np.full(n, None, dtype=object)
+
+    if cache is None:
+        cache = get_header_cache()
+    use_cache = cache is not None and cache is not False
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    def _store(index, results):
+        for i,(r,e) in zip(index, results):
+            if e is not None:
+                if errors == 'raise':
+                    raise minc2_error("Error scanning {}: {}".format(paths[i], e))
+                columns['error'][i] = e
+            else:
+                if use_cache:
+                    h = {k: r[k] for k in scan_columns if k in r}
+                    h['standard'] = standard
+                    cache.put(paths[i], h, r.pop('metadata'))
+                for k,val in r.items():
+                    columns[k][i] = val
+
+    def _scan():
+        todo = []
+        for i in range(n):
+            if use_cache:
+                h = cache.get_header(paths[i])
+                if h is not None and h['standard'] == standard and (not scaling or 'volume_min' in h):
+                    m = cache.get_metadata(paths[i]) if attributes else {}
+                    if m is not None:
+                        for k in scan_columns[2:]:
+                            if scaling or k not in scan_scaling_columns:
+                                columns[k][i] = h[k]
+                        for k,val in _attributes_from_metadata(m, attributes).items():
+                            columns[k][i] = val
+                        continue
+            todo += [i]
+
+        done = n-len(todo)
+        if progress is not None and done > 0:
+            progress(done, n)
+
+        chunks = [todo[i:i+chunk_size] for i in range(0, len(todo), chunk_size)]
+
+        if workers <= 1 or len(chunks) <= 1:
+            for index in chunks:
+                _store(index, _scan_chunk([paths[i] for i in index], attributes, standard, use_cache, scaling))
+                done += len(index)
+                if progress is not None:
+                    progress(done, n)
+        else:
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+            with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+                futures = {executor.submit(_scan_chunk, [paths[i] for i in index], attributes, standard, use_cache, scaling): index
+                           for index in chunks}
+                for f in as_completed(futures):
+                    index = futures[f]
+                    _store(index, f.result())
+                    done += len(index)
+                    if progress is not None:
+                        progress(done, n)
+
+    if use_cache:
+        # all cache updates of the scan are done in one transaction
+        with cache.batch():
+            _scan()
+    else:
+        _scan()
+
+    if as_dataframe:
+        import pandas as pd
+        return pd.DataFrame({k: columns[k] for k in scan_columns+attributes})
+    return columns
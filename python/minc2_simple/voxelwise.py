@@ -0,0 +1,319 @@
+from __future__ import print_function
+
+import six
+
+from ._simple      import lib
+from .minc2_simple import minc2_file,minc2_error,minc2_input_iterator,minc2_output_iterator
+
+
+# statistics supported by voxelwise_stats, in addition to percentiles ('p5', 'p97.5' ...)
+voxelwise_stats_names = ['count', 'mean', 'var', 'std', 'min', 'max', 'median', 'tstat']
+
+
+def _parse_stats(stats):
+    """
+    internal function: validate names of statistics
+    :return: list of percentiles (None for other statistics)
+    """
+    q = []
+    for s in stats:
+        if s in voxelwise_stats_names:
+            q += [50.0 if s == 'median' else None]
+            continue
+        try:
+            if not s.startswith('p'):
+                raise ValueError()
+            p = float(s[1:])
+            if not 0.0 <= p <= 100.0:
+                raise ValueError()
+        except ValueError:
+            raise minc2_error("Unsupported statistic:"+repr(s))
+        q += [p]
+    return q
+
+
+def _block_stats(values, stats, percentiles, mu, ddof):
+    """
+    internal function: calculate statistics for a block of voxels
+    :param values: numpy.ndarray [n_files, n_voxels]
+    :return: numpy.ndarray [n_stats, n_voxels]
+    """
+    import numpy as np
+    import warnings
+    nv = values.shape[1]
+    n    = np.zeros(nv)
+    mean = np.zeros(nv)
+    m2   = np.zeros(nv)
+    vmin = np.full(nv, np.inf)
+    vmax = np.full(nv, -np.inf)
+
+    # Welford update, one file at a time, non-finite values are ignored
+    for x in values:
+        ok = np.isfinite(x)
+        n += ok
+        delta = np.where(ok, x-mean, 0.0)
+        mean += delta/np.maximum(n, 1.0)
+        m2 += delta*np.where(ok, x-mean, 0.0)
+        vmin = np.where(ok & (x < vmin), x, vmin)
+        vmax = np.where(ok & (x > vmax), x, vmax)
+
+    out = np.empty((len(stats), nv))
+    finite = None
+    with np.errstate(invalid='ignore', divide='ignore'):
+        empty = n == 0
+        for i,(s,q) in enumerate(zip(stats, percentiles)):
+            if q is not None:
+                if finite is None:
+                    finite = np.where(np.isfinite(values), values, np.nan)
+                with warnings.catch_warnings():
+                    # all-NaN voxels
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    out[i] = np.nanpercentile(finite, q, axis=0)
+            elif s == 'count':
+                out[i] = n
+            elif s == 'mean':
+                out[i] = np.where(empty, np.nan, mean)
+            elif s in ('var', 'std'):
+                v = np.where(n > ddof, m2/(n-ddof), np.nan)
+                out[i] = np.sqrt(v) if s == 'std' else v
+            elif s == 'min':
+                out[i] = np.where(empty, np.nan, vmin)
+            elif s == 'max':
+                out[i] = np.where(empty, np.nan, vmax)
+            elif s == 'tstat':
+                # one sample t-test against mu
+                se = np.sqrt(m2/(n-1)/n)
+                out[i] = np.where(n > 1, (mean-mu)/se, np.nan)
+    return out
+
+
+def _check_aligned(files):
+    """
+    internal function: make sure all files have the same dimensions
+    """
+    dims = None
+    for f in files:
+        v = minc2_file(f, header_only=True)
+        try:
+            d = [(i.id, i.length) for i in v.store_dims()]
+        finally:
+            v.close()
+        if dims is None:
+            dims = d
+        elif d != dims:
+            raise minc2_error("Dimensions of {} don't match {}".format(f, files[0]))
+
+
+def voxelwise_stats(files, stats=('mean', 'std'), mask=None, out_prefix=None, threads=1,
+                    mu=0.0, ddof=0, fill=0.0, store_type=None):
+    """
+    Calculate voxelwise statistics across many co-registered volumes, reading one slice of all volumes at a time,
+    so that memory use is bounded by slice size times number of files.
+    Mean and variance are accumulated with Welford updates, non-finite values are ignored
+    :param files: list of input file names, all with the same dimensions
+    :param stats: list of statistics: 'count','mean','var','std','min','max','median','tstat' (one sample t-statistic
+                  against mu) or percentiles in format 'pNN', i.e 'p5','p97.5'
+    :param mask: optional mask file, voxels with mask values not above 0.5 are set to fill
+    :param out_prefix: output files are named <out_prefix>_<stat>.mnc
+    :param threads: number of threads used to calculate statistics of each slice
+    :param mu: expected mean for 'tstat'
+    :param ddof: delta degrees of freedom of 'var' and 'std', as in numpy.var
+    :param fill: value of voxels outside of the mask
+    :param store_type: storage data type of the output files, default - float32
+    :return: dictionary stat -> output file name
+    """
+    import numpy as np
+    if out_prefix is None:
+        raise minc2_error("out_prefix is required")
+    if isinstance(stats, six.string_types):
+        stats = [stats]
+    stats = list(stats)
+    percentiles = _parse_stats(stats)
+    files = list(files)
+    if not files:
+        raise minc2_error("No input files")
+    inputs = files+([mask] if mask is not None else [])
+    _check_aligned(inputs)
+
+    outputs = ["{}_{}.mnc".format(out_prefix, s) for s in stats]
+    reference = minc2_file(files[0], header_only=True)
+    if store_type is None:
+        store_type = lib.MINC2_FLOAT
+    elif not isinstance(store_type, int):
+        store_type = minc2_file.numpy_to_minc2[np.dtype(store_type).name]
+    try:
+        out_it = minc2_output_iterator(outputs, reference=reference, data_type=lib.MINC2_DOUBLE, store_type=store_type)
+    finally:
+        reference.close()
+    in_it = minc2_input_iterator(inputs, data_type=lib.MINC2_DOUBLE)
+
+    executor = None
+    if threads is not None and threads > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=threads)
+
+    nf = len(files)
+    try:
+        for (start, stop), block in in_it.iter_blocks():
+            out = np.full((len(stats), stop-start), fill)
+            if mask is not None:
+                sel = np.nonzero(block[nf] > 0.5)[0]
+                values = block[:nf, sel]
+            else:
+                sel = slice(None)
+                values = block
+            if values.shape[1] > 0:
+                if executor is not None and values.shape[1] >= threads:
+                    bounds = np.linspace(0, values.shape[1], threads+1).astype(int)
+                    res = list(executor.map(lambda i: _block_stats(values[:, bounds[i]:bounds[i+1]], stats, percentiles, mu, ddof),
+                                            range(threads)))
+                    out[:, sel] = np.concatenate(res, axis=1)
+                else:
+                    out[:, sel] = _block_stats(values, stats, percentiles, mu, ddof)
+            out_it.put_block(out)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        in_it.close()
+        out_it.close()
+
+    return dict(zip(stats, outputs))
+
+
+def _map_block(func, values, n_outputs, vectorized):
+    """
+    internal function: apply func to a block of voxels, executed by a worker process
+    :param values: numpy.ndarray [n_inputs, n_voxels]
+    :return: numpy.ndarray [n_outputs, n_voxels]
+    """
+    import numpy as np
+    if vectorized:
+        out = np.asarray(func(values), dtype=np.float64).reshape(n_outputs, values.shape[1])
+    else:
+        out = np.empty((n_outputs, values.shape[1]))
+        for j in range(values.shape[1]):
+            out[:, j] = func(values[:, j])
+    return out
+
+
+def _iter_chunks(blocks, size):
+    """
+    internal function: regroup blocks of voxels [n, n_voxels] into chunks of size voxels
+    """
+    import numpy as np
+    pending = []
+    count = 0
+    for b in blocks:
+        pending += [b]
+        count += b.shape[1]
+        while count >= size:
+            buf = np.concatenate(pending, axis=1) if len(pending) > 1 else pending[0]
+            yield buf[:, :size]
+            pending = [buf[:, size:]]
+            count -= size
+    if count > 0:
+        yield np.concatenate(pending, axis=1)
+
+
+def map_voxels(func, inputs, outputs, mask=None, block=65536, workers=None, vectorized=False,
+               fill=0.0, store_type=None, max_pending=None):
+    """
+    Apply a function to every voxel of several co-registered volumes, producing several output volumes.
+    Voxels are dispatched to a pool of worker processes in blocks, results are written in order
+    :param func: function, must be picklable (i.e. defined at module level). With vectorized=False it is called
+                 for every voxel with numpy.ndarray of n_inputs values and should return n_outputs values,
+                 with vectorized=True it is called with numpy.ndarray [n_inputs, n_voxels] and should return [n_outputs, n_voxels]
+    :param inputs: list of input file names, all with the same dimensions
+    :param outputs: list of output file names
+    :param mask: optional mask file, func is not called for voxels with mask values not above 0.5, they are set to fill
+    :param block: number of voxels sent to a worker at once
+    :param workers: number of worker processes, default - number of CPUs, 1 or 0 - run in the current process
+    :param vectorized: func works with blocks of voxels
+    :param fill: value of voxels outside of the mask
+    :param store_type: storage data type of the output files, default - float32
+    :param max_pending: maximum number of blocks being processed at once, default - twice the number of workers
+    :return: list of output file names
+    """
+    import numpy as np
+    import multiprocessing
+    import collections
+    inputs = list(inputs)
+    if isinstance(outputs, six.string_types):
+        outputs = [outputs]
+    outputs = list(outputs)
+    if not inputs or not outputs:
+        raise minc2_error("No input or output files")
+    if block < 1:
+        raise minc2_error("Block size should be positive")
+    _check_aligned(inputs+([mask] if mask is not None else []))
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if max_pending is None:
+        max_pending = 2*max(workers, 1)
+    if store_type is None:
+        store_type = lib.MINC2_FLOAT
+    elif not isinstance(store_type, int):
+        store_type = minc2_file.numpy_to_minc2[np.dtype(store_type).name]
+
+    reference = minc2_file(inputs[0], header_only=True)
+    try:
+        out_it = minc2_output_iterator(outputs, reference=reference, data_type=lib.MINC2_DOUBLE, store_type=store_type)
+    finally:
+        reference.close()
+    in_it = minc2_input_iterator(inputs+([mask] if mask is not None else []), data_type=lib.MINC2_DOUBLE)
+
+    ni = len(inputs)
+    no = len(outputs)
+    executor = None
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers)
+
+    def _write(nv, sel, result):
+        out = np.full((no, nv), fill)
+        if result is not None:
+            out[:, sel] = result
+        out_it.put_block(out)
+
+    try:
+        pending = collections.deque()
+        for values in _iter_chunks((b for _, b in in_it.iter_blocks()), block):
+            nv = values.shape[1]
+            if mask is not None:
+                sel = np.nonzero(values[ni] > 0.5)[0]
+                values = values[:ni, sel]
+            else:
+                sel = slice(None)
+
+            if values.shape[1] == 0:
+                # completely masked out block
+                result = None
+            elif executor is None:
+                result = _map_block(func, values, no, vectorized)
+            else:
+                result = executor.submit(_map_block, func, np.ascontiguousarray(values), no, vectorized)
+            pending.append((nv, sel, result))
+
+            # write completed blocks in order
+            while pending and (len(pending) > max_pending or executor is None or
+                               pending[0][2] is None or pending[0][2].done()):
+                nv, sel, result = pending.popleft()
+                if result is not None and executor is not None:
+                    result = result.result()
+                _write(nv, sel, result)
+
+        while pending:
+            nv, sel, result = pending.popleft()
+            if result is not None and executor is not None:
+                result = result.result()
+            _write(nv, sel, result)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        in_it.close()
+        out_it.close()
+
+    return outputs
+
+# kate: indent-width 4; replace-tabs on; remove-trailing-space on; hl python; show-tabs on
@@ -173,6 +173,67 @@ class minc2_file_io_numpy(unittest.TestCase):
         output = float(pipe.read())
         pipe.close()
         self.assertAlmostEqual(a, output, 8)
+    def testThreadedLoad(self):
+        """ensure that multi-threaded load gives the same result as the single-threaded one"""
+        v = minc2_file(inputFile_short)
+        a = v.load_complete_volume('float64')
+        b = v.load_complete_volume('float64', threads=4)
+        v.setup_standard_order()
+        c = v.load_complete_volume('float32')
+        d = v.load_complete_volume('float32', threads=3)
+        v.close()
+        self.assertEqual(N.average((a-b)**2),0.0)
+        self.assertEqual(N.average((c-d)**2),0.0)
+    def testLoadMmap(self):
+        """ensure that memory-mapped volume (or the fallback) is the same as loaded volume"""
+        import warnings
+        v = minc2_file(inputFile_float)
+        dims = v.store_dims()
+        data = v.load_complete_volume('float32')
+        v.close()
+
+        v2 = minc2_file()
+        v2.define(dims, 'float32', 'float32')
+        v2.create(outputFilename)
+        v2.save_complete_volume(data)
+        v2.close()
+
+        v3 = minc2_file(outputFilename)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            a = v3.load_mmap()
+        b = v3.load_complete_volume()
+        offset, reason = v3.mmap_status('float64')
+        v3.setup_standard_order()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            c = v3.load_mmap()
+        d = v3.load_complete_volume()
+        self.assertEqual(N.average((a-b)**2),0.0)
+        self.assertEqual(N.average((c-d)**2),0.0)
+        # different data type can't be mapped
+        self.assertIsNone(offset)
+        self.assertRaises(minc2_error, v3.load_mmap, 'float64', False)
+        v3.close()
+    def testLoadOut(self):
+        """ensure that reading into caller-supplied buffer gives the same result"""
+        v = minc2_file(inputFile_short)
+        v.setup_standard_order()
+        a = v.load_complete_volume('float32')
+        out = N.empty(a.shape, N.float32)
+        b = v.load_complete_volume(out=out)
+        raw = bytearray(a.nbytes)
+        c = v.load_complete_volume('float32', out=raw)
+        slab = N.empty((1,)+a.shape[1:], N.float64)
+        d = v.load_hyperslab([10,None,None], out=slab)
+        self.assertRaises(minc2_error, v.load_hyperslab, [10,None,None], 'float32', slab)
+        self.assertRaises(minc2_error, v.load_complete_volume, 'float32', None, out[:, :, ::2])
+        v.close()
+        self.assertIs(b, out)
+        self.assertIs(d, slab)
+        self.assertEqual(N.average((a-b)**2),0.0)
+        self.assertEqual(N.average((a-c)**2),0.0)
+        self.assertEqual(N.average((a[10]-d[0])**2),0.0)
     def testDims(self):
         """Check data dimensions are correct"""
         v = minc2_file(inputFile_double) 
@@ -287,6 +348,19 @@ try:
             output = float(pipe.read())
             pipe.close()
             self.assertAlmostEqual(a, output, 8)
+        def testLoadOut(self):
+            """ensure that reading into caller-supplied tensor gives the same result"""
+            v = minc2_file(inputFile_double)
+            v.setup_standard_order()
+            a = v.load_complete_volume_tensor('torch.DoubleTensor')
+            out = torch.empty(a.shape, dtype=torch.float64)
+            b = v.load_complete_volume_tensor(out=out)
+            slab = torch.empty((1,)+tuple(a.shape[1:]), dtype=torch.float64)
+            c = v.load_hyperslab_t([10,None,None], out=slab)
+            v.close()
+            self.assertIs(b, out)
+            self.assertEqual(((a-b)**2).mean().item(),0.0)
+            self.assertEqual(((a[10]-c[0])**2).mean().item(),0.0)
 except ImportError:
     pass
 
@@ -326,6 +400,288 @@ class TestWriteFileDataTypes(unittest.TestCase):
         """ensure that a volume created by volumeFromDescription as unsigned int is written out as such"""
         # TODO
         pass
+    def testWriteValueRange(self):
+        """ensure that known range of values is used instead of the range of the data"""
+        v = minc2_file(inputFile_ushort)
+        dims = v.store_dims()
+        v.close()
+        data = N.random.rand(dims[2].length, dims[1].length, dims[0].length).astype(N.float32)
+        data[0, 0, 0] = N.nan
+
+        v2 = minc2_file()
+        v2.define(dims, 'uint16', 'float32')
+        v2.create(outputFilename)
+        v2.save_complete_volume(data, value_range=(-1.0, 2.0))
+        v2.close()
+
+        v3 = minc2_file(outputFilename)
+        vmin, vmax = v3.volume_range()
+        self.assertAlmostEqual(vmin, -1.0, 6)
+        self.assertAlmostEqual(vmax, 2.0, 6)
+        b = v3.load_complete_volume('float32')
+        v3.close()
+        self.assertLess(N.max(N.abs(data[0, 1:]-b[0, 1:])), 3.0/65535.0*2)
+
+        # range of the data, ignoring non-finite values
+        v2 = minc2_file()
+        v2.define(dims, 'uint16', 'float32')
+        v2.create(outputFilename)
+        v2.save_complete_volume(data)
+        v2.close()
+        v3 = minc2_file(outputFilename)
+        vmin, vmax = v3.volume_range()
+        v3.close()
+        self.assertAlmostEqual(vmin, N.nanmin(data), 6)
+        self.assertAlmostEqual(vmax, N.nanmax(data), 6)
+
+class minc2_file_metadata(unittest.TestCase):
+    """test reading metadata"""
+    def testMetadata(self):
+        """metadata should contain the same values as individual attributes"""
+        v = minc2_file(input3DdirectionCosines)
+        m = v.metadata()
+        self.assertIn('history', m[''])
+        self.assertIn('minc_version', m[''])
+        for g in m:
+            for a in m[g]:
+                val = v.read_attribute(g, a)
+                if isinstance(val, N.ndarray):
+                    self.assertEqual(val.dtype, m[g][a].dtype)
+                    self.assertEqual(list(val), list(m[g][a]))
+                else:
+                    self.assertEqual(val, m[g][a])
+        v.close()
+
+    def testWriteMetadata(self):
+        """metadata written to a new file should be read back"""
+        v = minc2_file(inputFile_float)
+        o = minc2_file()
+        o.imitate(v, path=newFilename)
+        o.write_attribute('test', 'str', 'Hello world')
+        o.write_attribute('test', 'num', N.array([1.0,2.0,3.0]))
+        o.save_complete_volume(v.load_complete_volume())
+        o.close()
+        v.close()
+        m = minc2_file(newFilename).metadata()
+        self.assertEqual(m['test']['str'], 'Hello world')
+        self.assertEqual(list(m['test']['num']), [1.0,2.0,3.0])
+
+
+class minc2_file_read_plan(unittest.TestCase):
+    """test prepared hyperslab reads"""
+    def testReadPlan(self):
+        """read plan should give the same data as load_hyperslab"""
+        v = minc2_file(inputFile_ushort)
+        v.setup_standard_order()
+        plan = v.read_plan((5,None,7), 'float64')
+        out = N.empty((5,150,7))
+        for start in [(0,0,0),(10,0,20),(95,0,118)]:
+            a = v.load_hyperslab([(start[0],start[0]+5),None,(start[2],start[2]+7)], 'float64')
+            self.assertEqual(N.average((plan.read(start)-a)**2), 0.0)
+            self.assertIs(plan.read(start, out=out), out)
+            self.assertEqual(N.average((out-a)**2), 0.0)
+        self.assertRaises(minc2_error, plan.read, (0,0,0), N.empty((5,150,7),N.float32))
+        v.close()
+
+
+class minc2_file_header_only(unittest.TestCase):
+    """test opening files in header-only mode"""
+    def testHeaderOnly(self):
+        """header-only open should give the same information and data as normal open"""
+        for f in (inputFile_byte, inputFile_float, inputFile_double, input3DdirectionCosines):
+            v = minc2_file(f)
+            h = minc2_file(f, header_only=True)
+            self.assertEqual(h.store_dtype(), v.store_dtype())
+            for a,b in zip(h.store_dims(), v.store_dims()):
+                self.assertEqual(a.id, b.id)
+                self.assertEqual(a.length, b.length)
+                self.assertEqual(a.start, b.start)
+                self.assertEqual(a.step, b.step)
+            self.assertEqual(h.get_scaling(), v.get_scaling())
+            self.assertEqual(h.representation_dtype(), v.representation_dtype())
+            self.assertEqual(N.average((h.data-v.data)**2), 0.0)
+            h.close()
+            v.close()
+
+    def testHeaderOnlyData(self):
+        """data should be readable in header-only mode without querying data type first"""
+        v = minc2_file(inputFile_short, header_only=True)
+        a = v.load_complete_volume('float64')
+        v.close()
+        pipe = os.popen("mincstats -mean -quiet %s" % inputFile_short, "r")
+        output = float(pipe.read())
+        pipe.close()
+        self.assertAlmostEqual(N.average(a), output, 8)
+
+
+class minc2_file_slice_scaling(unittest.TestCase):
+    """test writing volumes with slice scaling"""
+    def _check(self, a, b):
+        # error of every slice should be within its quantization step
+        for i in range(a.shape[0]):
+            step = (N.max(a[i])-N.min(a[i]))/65535.0
+            self.assertLessEqual(N.max(N.abs(a[i]-b[i])), step)
+
+    def testSaveCompleteVolume(self):
+        """complete volume with slice scaling should preserve every slice range"""
+        v = minc2_file(inputFile_ushort)
+        dims = v.store_dims()
+        v.close()
+        # slices with very different ranges
+        data = N.random.rand(dims[2].length, dims[1].length, dims[0].length)
+        data *= N.logspace(-3, 3, dims[2].length).reshape(-1, 1, 1)
+
+        v2 = minc2_file()
+        v2.define(dims, 'uint16', 'float64', slice_scaling=True)
+        v2.create(outputFilename)
+        v2.save_complete_volume(data)
+        v2.close()
+
+        v3 = minc2_file(outputFilename)
+        self.assertEqual(v3.get_scaling(), (False, True))
+        self._check(data, v3.load_complete_volume('float64'))
+        v3.close()
+
+    def testSaveHyperslab(self):
+        """hyperslabs with slice scaling should preserve every slice range"""
+        v = minc2_file(inputFile_ushort)
+        dims = v.store_dims()
+        v.close()
+        data = N.random.rand(dims[2].length, dims[1].length, dims[0].length)
+        data *= N.logspace(-3, 3, dims[2].length).reshape(-1, 1, 1)
+
+        v2 = minc2_file()
+        v2.define(dims, 'uint16', 'float64', slice_scaling=True)
+        v2.create(outputFilename)
+        for i in range(0, dims[2].length, 10):
+            j = min(i+10, dims[2].length)
+            v2.save_hyperslab(data[i:j], [(i, j), None, None])
+        # partial slices can't be scaled
+        with self.assertRaises(minc2_error):
+            v2.save_hyperslab(N.ascontiguousarray(data[0:1, 0:10, :]), [0, (0, 10), None])
+        v2.close()
+
+        v3 = minc2_file(outputFilename)
+        self._check(data, v3.load_complete_volume('float64'))
+        v3.close()
+
+
+class minc2_file_stream_writer(unittest.TestCase):
+    """test streaming writer"""
+    def _write(self, slice_scaling):
+        v = minc2_file(inputFile_ushort)
+        dims = v.store_dims()
+        v.close()
+        data = N.random.rand(dims[2].length, dims[1].length, dims[0].length)*100.0-20.0
+
+        v2 = minc2_file()
+        v2.define(dims, 'uint16', 'float64', slice_scaling=slice_scaling)
+        v2.create(outputFilename)
+        with v2.open_stream_writer() as w:
+            # reverse order
+            for i in reversed(range(0, data.shape[0], 7)):
+                w.write(data[i:i+7], (i, 0, 0))
+        v2.close()
+        self.assertAlmostEqual(w.min, N.min(data))
+        self.assertAlmostEqual(w.max, N.max(data))
+
+        v3 = minc2_file(outputFilename)
+        b = v3.load_complete_volume('float64')
+        v3.close()
+        self.assertLess(N.max(N.abs(data-b)), 120.0/65535.0)
+
+    def testGlobalScaling(self):
+        """slabs written in any order should be scaled with the range of the whole volume"""
+        self._write(False)
+
+    def testSliceScaling(self):
+        """slabs written with slice scaling should preserve values"""
+        self._write(True)
+
+
+class minc2_file_reduce(unittest.TestCase):
+    """test out-of-core statistics"""
+    def testReduce(self):
+        """statistics should match numpy, for the whole volume and along an axis"""
+        v = minc2_file(inputFile_short)
+        v.setup_standard_order()
+        a = v.load_complete_volume('float64')
+        r = v.reduce(['count', 'sum', 'mean', 'std', 'min', 'max', 'argmax'], buffer_bytes=1024*1024)
+        self.assertEqual(r['count'], a.size)
+        self.assertAlmostEqual(r['sum']/a.size, N.sum(a)/a.size, 8)
+        self.assertAlmostEqual(r['mean'], N.mean(a), 8)
+        self.assertAlmostEqual(r['std'], N.std(a), 8)
+        self.assertEqual(r['min'], N.min(a))
+        self.assertEqual(r['max'], N.max(a))
+        self.assertEqual(r['argmax'], N.argmax(a))
+
+        for axis in (0, 1, (0, 2)):
+            self.assertLess(N.max(N.abs(v.reduce('var', axis=axis)-N.var(a, axis=axis))), 1e-8)
+        self.assertTrue(N.all(v.reduce('argmin', axis=1) == N.argmin(a, axis=1)))
+
+        hist, edges = v.reduce('histogram', bins=100)
+        _hist, _edges = N.histogram(a, bins=100, range=v.volume_range())
+        self.assertEqual(N.sum(hist), a.size)
+        self.assertLessEqual(N.max(N.abs(hist-_hist)), 2)
+        v.close()
+
+    def testReduceMask(self):
+        """only voxels inside the mask should be used"""
+        v = minc2_file(inputFile_short)
+        a = v.load_complete_volume('float64')
+        mask = a > N.median(a)
+        self.assertAlmostEqual(v.reduce('mean', mask=mask), N.mean(a[mask]), 8)
+        self.assertEqual(v.reduce('count', mask=N.zeros(a.shape)), 0)
+        self.assertTrue(N.isnan(v.reduce('max', mask=N.zeros(a.shape))))
+        v.close()
+
+    def testReduceHistogramRange(self):
+        """empty histogram range should be widened like in numpy, invalid range should raise exception"""
+        v = minc2_file(inputFile_short)
+        a = v.load_complete_volume('float64')
+        x = a.flat[0]
+        hist, edges = v.reduce('histogram', bins=10, hist_range=(x, x))
+        _hist, _edges = N.histogram(a, bins=10, range=(x, x))
+        self.assertEqual(N.sum(hist), N.sum(a == x))
+        self.assertLess(N.max(N.abs(edges-_edges)), 1e-8)
+        with self.assertRaises(minc2_error):
+            v.reduce('histogram', hist_range=(1.0, 0.0))
+        with self.assertRaises(minc2_error):
+            v.reduce('histogram', hist_range=(0.0, N.inf))
+        v.close()
+
+
+class minc2_file_storage(unittest.TestCase):
+    """test HDF5 chunking and compression settings"""
+    def testChunksCompression(self):
+        """requested compression should be stored in the file, data should be preserved"""
+        v = minc2_file(inputFile_short)
+        dims = v.store_dims()
+        a = v.load_complete_volume('float64')
+        v.close()
+
+        v2 = minc2_file()
+        v2.define(dims, 'int16', 'float64', chunks=(5, 8, 8), compression=4)
+        v2.create(outputFilename)
+        v2.save_complete_volume(a)
+        v2.close()
+
+        v3 = minc2_file(outputFilename)
+        info = v3.storage_info()
+        b = v3.load_complete_volume('float64')
+        v3.close()
+        self.assertEqual(info['compression'], 4)
+        self.assertEqual(info['chunks'], (5, 8, 8))
+        self.assertFalse(info['shuffle'])
+        self.assertLess(N.max(N.abs(a-b)), 1e-3)
+
+    def testShuffle(self):
+        """shuffle filter is not available"""
+        v = minc2_file(inputFile_short)
+        with self.assertRaises(minc2_error):
+            minc2_file().define(v.store_dims(), 'int16', 'float64', shuffle=True)
+        v.close()
+
 
 class minc2_file_hyperslabs_numpy(unittest.TestCase):
     """test getting and setting of hyperslabs"""
@@ -375,7 +731,80 @@ class minc2_file_hyperslabs_numpy(unittest.TestCase):
         self.assertEqual(N.average((sliceFromData_x-hyperslab_x)**2),0.0)
         self.assertEqual(N.average((sliceFromData_y-hyperslab_y)**2),0.0)
         self.assertEqual(N.average((sliceFromData_z-hyperslab_z)**2),0.0)
-        
+
+    def testSlicingStrided(self):
+        """decimated volume slice should be same as decimated data array"""
+        v = minc2_file(inputFile_ushort)
+        v.setup_standard_order()
+        data = v.data
+        for s in [ (slice(None,None,2),slice(None,None,2),slice(None,None,2)),
+                   (slice(None,None,-3),slice(10,20),slice(None,None,-1)),
+                   (10,slice(1,None,4),slice(None)) ]:
+            self.assertEqual(N.average((data[s]-v[s])**2),0.0)
+        v.close()
+
+    def testSlicingStridedReadSize(self):
+        """strided slices should not read blocks much larger than the result"""
+        v = minc2_file(inputFile_ushort)
+        v.setup_standard_order()
+        data = v.data
+        v.hyperslab_merge_bytes = 4096
+        reads = []
+        load_hyperslab = v.load_hyperslab
+        def _load_hyperslab(slab, data_type=None, out=None):
+            b = load_hyperslab(slab, data_type, out)
+            reads.append(b.nbytes)
+            return b
+        v.load_hyperslab = _load_hyperslab
+        for s in [ (slice(None,None,2),slice(None,None,2),slice(None,None,2)),
+                   (slice(None,None,8),slice(None,None,-3),slice(1,None,5)),
+                   (slice(None,None,2),[1,5,9,13],Ellipsis) ]:
+            del reads[:]
+            r = v[s]
+            self.assertEqual(N.average((data[s]-r)**2),0.0)
+            self.assertLessEqual(max(reads), max(v.hyperslab_merge_bytes, 2*r.nbytes))
+        v.close()
+
+    def testSlicingFancy(self):
+        """index arrays, masks, negative indices, Ellipsis and None should follow numpy semantics"""
+        v = minc2_file(inputFile_ushort)
+        v.setup_standard_order()
+        data = v.data
+        mask = data>N.average(data)
+        for s in [ (slice(None),[10,50,90],slice(None)),
+                   (-1,Ellipsis),
+                   (Ellipsis,None,-10),
+                   ([1,5,2],slice(None),[3,3,7]),
+                   (mask,),
+                   (slice(None),mask[10]) ]:
+            self.assertEqual(data[s].shape,v[s].shape)
+            self.assertEqual(N.average((data[s]-v[s])**2),0.0)
+        v.close()
+
+    def testSetFancyFloat(self):
+        """volume setting with index arrays should change underlying volume (float)"""
+        v  = minc2_file(inputFile_ushort)
+        dims = v.store_dims()
+        v.setup_standard_order()
+        data = v.data.astype(N.float32)
+        v.close()
+
+        v2 = minc2_file()
+        v2.define(dims,'float32','float32')
+        v2.create(outputFilename)
+        v2.setup_standard_order()
+        v2[...] = data
+        v2[:,[10,50,90],:] = 0.0
+        v2[-1,::2,::3] = -1.0
+        data[:,[10,50,90],:] = 0.0
+        data[-1,::2,::3] = -1.0
+        v2.close()
+
+        v3  = minc2_file(outputFilename)
+        v3.setup_standard_order()
+        self.assertEqual(N.average((data-v3.data)**2),0.0)
+        v3.close()
+
     def testSetHyperslabFloat(self):
         """setting hyperslab should change underlying volume (float)"""
         
@@ -673,5 +1102,117 @@ class testWorlToVoxel(unittest.TestCase):
             for k in range(3):
                 self.assertAlmostEqual(from_file[k], ijk[i,k] , 8)
 
+    def testAffineVec(self):
+        """vectorized conversions should agree with point by point conversions"""
+        v = minc2_file(input3DdirectionCosines)
+        v.setup_standard_order()
+
+        ijk=N.random.uniform(-10.0, 150.0, (1000,3))
+        xyz=v.voxel_to_world(ijk)
+        xyz_t=v.voxel_to_world(ijk, threads=4)
+        ijk2=v.world_to_voxel(xyz, threads=4)
+        for i in range(0,1000,97):
+            p=v.voxel_to_world(ijk[i])
+            for k in range(3):
+                self.assertAlmostEqual(p[k], xyz[i,k], 8)
+        self.assertAlmostEqual(N.max(N.abs(xyz-xyz_t)), 0.0, 8)
+        self.assertAlmostEqual(N.max(N.abs(ijk-ijk2)), 0.0, 8)
+        self.assertAlmostEqual(N.max(N.abs(N.dot(v.voxel_to_world_affine,v.world_to_voxel_affine)-N.eye(4))), 0.0, 8)
+
+class testLazyArray(unittest.TestCase):
+    """test lazy array proxy"""
+
+    def testLazyArray(self):
+        """lazy array should give the same data as complete volume"""
+        v = minc2_file(inputFile_short)
+        v.setup_standard_order()
+        data = v.load_complete_volume('float64')
+        a = v.as_lazy_array('float64')
+        self.assertEqual(a.shape, data.shape)
+        self.assertEqual(a.dtype, N.dtype('float64'))
+        self.assertEqual(N.average((a[10:20,::3,-1]-data[10:20,::3,-1])**2), 0.0)
+        self.assertEqual(N.average((N.asarray(a)-data)**2), 0.0)
+        a.block_bytes = data[0].nbytes*7
+        self.assertEqual(N.average((a.map_blocks(lambda b: b*2)-data*2)**2), 0.0)
+        self.assertAlmostEqual(a.reduce(N.add), N.sum(data), 3)
+        self.assertEqual(a.reduce(N.maximum, block_size=3), N.max(data))
+        v.close()
+
+
+try:
+    import dask.array # this is going to work only if dask is present
+    from minc2_simple import minc2_dask_stack
+
+    class testDask(unittest.TestCase):
+        """test dask arrays"""
+
+        def testToDask(self):
+            """dask array should give the same data as complete volume"""
+            v = minc2_file(inputFile_short)
+            v.setup_standard_order()
+            data = v.load_complete_volume('float64')
+            d = v.to_dask(data_type='float64')
+            self.assertEqual(d.shape, data.shape)
+            chunks = v.storage_chunks()
+            if chunks is not None:
+                # dask chunks should be multiples of the file chunks
+                for c,dc in zip(chunks, d.chunks):
+                    for i in dc[:-1]:
+                        self.assertEqual(i % c, 0)
+            v.close()
+            self.assertEqual(N.average((d[10:20,::3,-1].compute()-data[10:20,::3,-1])**2), 0.0)
+            self.assertAlmostEqual(float(d.sum().compute()), N.sum(data), 3)
+            d = minc2_file(inputFile_short).to_dask(chunks=(7,-1,-1), data_type='float64')
+            self.assertEqual(N.average((d.compute(scheduler='threads')-data)**2), 0.0)
+
+        def testDaskStack(self):
+            """stacked volumes should be the same as individual volumes"""
+            s = minc2_dask_stack([inputFile_float,inputFile_double], data_type='float64', standard=True)
+            self.assertEqual(s.shape[0], 2)
+            m = s.mean(axis=0).compute()
+            a = minc2_file(inputFile_float, standard=True).load_complete_volume('float64')
+            b = minc2_file(inputFile_double, standard=True).load_complete_volume('float64')
+            self.assertAlmostEqual(N.max(N.abs(m-(a+b)/2)), 0.0, 6)
+
+except ImportError:
+    pass
+
+
+class testResample(unittest.TestCase):
+    """test volume resampling"""
+
+    def testResampleIdentity(self):
+        """resampling volume on it's own sampling grid should not change it"""
+        v = minc2_file(inputFile_float)
+        v.setup_standard_order()
+        data = v.load_complete_volume('float32')
+        for order in ('nearest','linear','cubic'):
+            r = v.resample(v, order=order, threads=2)
+            self.assertEqual(r.shape, data.shape)
+            self.assertAlmostEqual(N.max(N.abs(r-data)), 0.0, 5)
+
+        v.resample(v, order='nearest', path=outputFilename, store_type='float32')
+        v.close()
+        v2 = minc2_file(outputFilename)
+        v2.setup_standard_order()
+        self.assertEqual(N.average((v2.data-data)**2), 0.0)
+        v2.close()
+
+    def testResampleShift(self):
+        """resampling with translation by one voxel should shift the volume"""
+        v = minc2_file(inputFile_float)
+        v.setup_standard_order()
+        data = v.load_complete_volume('float32')
+        step = v.representation_dims()[0].step
+        shift = N.eye(4)
+        shift[0,3] = step
+        xfm = minc2_xfm()
+        xfm.append_linear_transform(shift)
+        r = v.resample(v, xfm=xfm, order='linear', fill=-1.0)
+        v.close()
+        self.assertAlmostEqual(N.max(N.abs(r[:,:,1:]-data[:,:,:-1])), 0.0, 5)
+        self.assertEqual(N.max(N.abs(r[:,:,0]+1.0)), 0.0)
+
+
 if __name__ == "__main__":
     unittest.main()
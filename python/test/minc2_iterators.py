@@ -6,7 +6,7 @@ import os
 import subprocess
 import tempfile
 
-from minc2_simple import minc2_input_iterator,minc2_output_iterator,minc2_file
+from minc2_simple import minc2_input_iterator,minc2_output_iterator,minc2_file,minc2_error
 
 def setUpModule():
     global outputFilename
@@ -55,6 +55,43 @@ class minc2_iterators(unittest.TestCase):
         # make sure we passed all voxels
         self.assertEqual(cnt,dim_x*dim_y*dim_z)
 
+    def testInputBlocks(self):
+        """block iteration should cover the same voxels as voxel iteration"""
+        inp1=minc2_input_iterator(files=inputFile_float)
+        inp2=minc2_input_iterator(files=outputAVG)
+        avg=minc2_file(outputAVG).data.ravel()
+        cnt=0
+
+        for (r1,b1),(r2,b2) in zip(inp1.iter_blocks(),inp2.iter_blocks()):
+            self.assertEqual(r1,(cnt,cnt+b1.shape[1]))
+            self.assertEqual(r1,r2)
+            self.assertEqual(b1.shape,(len(inputFile_float),r1[1]-r1[0]))
+            self.assertAlmostEqual(np.max(np.abs(np.mean(b1,axis=0)-b2[0])),0.0,6)
+            self.assertAlmostEqual(np.max(np.abs(avg[r2[0]:r2[1]]-b2[0])),0.0,6)
+            cnt+=b1.shape[1]
+        self.assertEqual(cnt,dim_x*dim_y*dim_z)
+
+    def testOutputBlocks(self):
+        """block writing should produce the same files as voxel writing"""
+        inp=minc2_input_iterator(files=outputAVG)
+        out=minc2_output_iterator(files=outputFilename,reference=outputAVG,store_type=minc2_file.MINC2_FLOAT)
+        cnt=0
+        for r,b in inp.iter_blocks():
+            # write each slice in two uneven parts
+            h=b.shape[1]//3
+            cnt+=out.put_block(np.repeat(b[:,:h],len(outputFilename),axis=0))
+            cnt+=out.put_block(np.repeat(b[:,h:],len(outputFilename),axis=0))
+        self.assertEqual(cnt,dim_x*dim_y*dim_z)
+        self.assertRaises(minc2_error,out.put_block,np.zeros((len(outputFilename),1)))
+        inp.close()
+        out.close()
+
+        for f in outputFilename:
+            pipe = os.popen("minccmp -q -rmse %s %s" % (f,outputAVG), "r")
+            output = float(pipe.read())
+            pipe.close()
+            self.assertEqual(output, 0)
+
     def testOutput(self):
         """ensure byte data is read as float by default"""
         inp=minc2_input_iterator(files=outputAVG)
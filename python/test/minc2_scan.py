@@ -0,0 +1,136 @@
+import unittest
+import numpy as np
+import os
+import subprocess
+import tempfile
+import shutil
+
+from minc2_simple import minc2_file,minc2_error,scan_headers
+from minc2_simple import minc2_header_cache,set_header_cache
+
+def setUpModule():
+    global inputFiles,garbageFile
+
+    inputFiles=[]
+    for i,t in enumerate(['-obyte','-oshort','-ofloat','-odouble']):
+        f=tempfile.NamedTemporaryFile(prefix="test-", suffix=".mnc").name
+        subprocess.check_call(['rawtominc', f, t, '-input', '/dev/urandom', str(10+i), '15', '12'])
+        inputFiles+=[f]
+
+    garbageFile=tempfile.NamedTemporaryFile(prefix="test-garbage-", suffix=".mnc").name
+    with open(garbageFile,'w') as f:
+        f.write("not a minc file")
+
+
+def tearDownModule():
+    for f in inputFiles:
+        os.remove(f)
+    os.remove(garbageFile)
+
+
+class minc2_scan(unittest.TestCase):
+    """test bulk header scanner"""
+    def checkScan(self, workers):
+        files=inputFiles+[garbageFile]+inputFiles
+        progress=[]
+        r=scan_headers(files, attributes=[':history',':missing_attribute','volume_min'], workers=workers, chunk_size=2,
+                       progress=lambda done,total: progress.append((done,total)))
+
+        self.assertEqual(len(r['path']),len(files))
+        self.assertEqual(max(progress),(len(files),len(files)))
+
+        for i,f in enumerate(files):
+            if f==garbageFile:
+                self.assertIsNotNone(r['error'][i])
+                self.assertEqual(r['ndim'][i],-1)
+                continue
+            self.assertIsNone(r['error'][i])
+            v=minc2_file(f)
+            self.assertEqual(r['ndim'][i],v.ndim())
+            self.assertEqual(r['shape'][i],v.data.shape)
+            self.assertEqual(r['store_dtype'][i],v.store_dtype())
+            self.assertEqual(r['representation_dtype'][i],v.representation_dtype())
+            self.assertEqual((r['volume_min'][i],r['volume_max'][i]),v.volume_range())
+            self.assertEqual(r[':history'][i],v.read_attribute('','history'))
+            self.assertIsNone(r[':missing_attribute'][i])
+            v.close()
+
+    def testScanSerial(self):
+        """scanning in the current process"""
+        self.checkScan(1)
+
+    def testScanParallel(self):
+        """scanning with a process pool"""
+        self.checkScan(3)
+
+    def testScanWithoutScaling(self):
+        """scaling information should be filled only when requested"""
+        r=scan_headers(inputFiles, workers=1)
+        for i,f in enumerate(inputFiles):
+            v=minc2_file(f)
+            self.assertEqual(r['shape'][i],v.data.shape)
+            v.close()
+        self.assertTrue(np.all(np.isnan(r['volume_min'])))
+        self.assertTrue(all(t is None for t in r['representation_dtype']))
+        self.assertRaises(minc2_error, scan_headers, inputFiles, attributes=['no_such_column'], workers=1)
+
+    def testScanRaise(self):
+        """errors='raise' should stop on the first bad file"""
+        self.assertRaises(minc2_error, scan_headers, inputFiles+[garbageFile], workers=1, errors='raise')
+
+class minc2_cache(unittest.TestCase):
+    """test persistent header cache"""
+    def setUp(self):
+        self.cache_dir=tempfile.mkdtemp(prefix="test-cache-")
+
+    def tearDown(self):
+        set_header_cache(None)
+        shutil.rmtree(self.cache_dir)
+
+    def testScanCache(self):
+        """second scan should be served from the cache"""
+        cache=minc2_header_cache(self.cache_dir)
+        r1=scan_headers(inputFiles, attributes=[':history','volume_min'], workers=1, cache=cache)
+        self.assertEqual(cache.stats()['entries'], len(inputFiles))
+        self.assertEqual(cache.hits, 0)
+
+        r2=scan_headers(inputFiles, attributes=[':history','volume_min'], workers=1, cache=cache)
+        self.assertEqual(cache.hits, 2*len(inputFiles)) # header and metadata
+        for k in ['shape','store_dtype','volume_min','volume_max',':history']:
+            self.assertEqual(list(r1[k]), list(r2[k]))
+
+        # modified file should not be taken from the cache
+        st=os.stat(inputFiles[0])
+        os.utime(inputFiles[0], (st.st_atime, st.st_mtime+10))
+        hits=cache.hits
+        scan_headers(inputFiles, workers=1, cache=cache)
+        self.assertEqual(cache.hits-hits, len(inputFiles)-1)
+
+    def testEviction(self):
+        """cache should keep at most max_entries files"""
+        cache=minc2_header_cache(self.cache_dir, max_entries=2)
+        scan_headers(inputFiles, workers=1, cache=cache)
+        self.assertEqual(len(cache), 2)
+
+    def testSingleTransaction(self):
+        """scan should update the cache in a single transaction"""
+        cache=minc2_header_cache(self.cache_dir, max_entries=2)
+        statements=[]
+        cache._db.set_trace_callback(statements.append)
+        scan_headers(inputFiles, workers=1, cache=cache)
+        scan_headers(inputFiles, workers=1, cache=cache)
+        self.assertEqual(sum(s.startswith('COMMIT') for s in statements), 2)
+        self.assertEqual(sum('COUNT' in s for s in statements), 2)
+
+    def testMetadataCache(self):
+        """metadata should be the same with and without cache"""
+        m=minc2_file(inputFiles[0]).metadata()
+        cache=minc2_header_cache(self.cache_dir)
+        set_header_cache(cache)
+        self.assertEqual(minc2_file(inputFiles[0]).metadata()[''], m[''])
+        self.assertEqual(minc2_file(inputFiles[0]).metadata()[''], m[''])
+        self.assertEqual(cache.stats()['hits'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
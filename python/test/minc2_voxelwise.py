@@ -0,0 +1,133 @@
+import unittest
+import numpy as np
+import os
+import subprocess
+import tempfile
+import shutil
+
+from minc2_simple import minc2_file,minc2_error,voxelwise_stats,map_voxels
+
+def setUpModule():
+    global inputFiles,maskFile,otherFile,outputDir
+
+    inputFiles=[]
+    for i in range(7):
+        f=tempfile.NamedTemporaryFile(prefix="test-", suffix=".mnc").name
+        subprocess.check_call(['rawtominc', f, '-oshort', '-input', '/dev/urandom', '10', '15', '12'])
+        inputFiles+=[f]
+
+    maskFile=tempfile.NamedTemporaryFile(prefix="test-mask-", suffix=".mnc").name
+    subprocess.check_call(['rawtominc', maskFile, '-obyte', '-input', '/dev/urandom', '10', '15', '12'])
+
+    otherFile=tempfile.NamedTemporaryFile(prefix="test-other-", suffix=".mnc").name
+    subprocess.check_call(['rawtominc', otherFile, '-oshort', '-input', '/dev/urandom', '11', '15', '12'])
+
+    outputDir=tempfile.mkdtemp(prefix="test-voxelwise-")
+
+
+def tearDownModule():
+    for f in inputFiles+[maskFile,otherFile]:
+        os.remove(f)
+    shutil.rmtree(outputDir)
+
+
+def load(f):
+    v=minc2_file(f)
+    a=v.load_complete_volume('float64')
+    v.close()
+    return a
+
+
+class minc2_voxelwise_stats(unittest.TestCase):
+    """test voxelwise statistics across files"""
+    def checkStats(self, threads):
+        data=np.stack([load(f) for f in inputFiles])
+        mask=load(maskFile)>0.5
+        stats=['count','mean','std','min','max','median','p90','tstat']
+        out=voxelwise_stats(inputFiles, stats, mask=maskFile, out_prefix=os.path.join(outputDir,'stats'),
+                            threads=threads, mu=0.5, store_type='float64')
+
+        expected={'count':  np.full(data.shape[1:], len(inputFiles)),
+                  'mean':   np.mean(data,axis=0),
+                  'std':    np.std(data,axis=0),
+                  'min':    np.min(data,axis=0),
+                  'max':    np.max(data,axis=0),
+                  'median': np.median(data,axis=0),
+                  'p90':    np.percentile(data,90,axis=0),
+                  'tstat':  (np.mean(data,axis=0)-0.5)/(np.std(data,axis=0,ddof=1)/np.sqrt(len(inputFiles)))}
+        for s in stats:
+            r=load(out[s])
+            self.assertLess(np.max(np.abs(r[mask]-expected[s][mask])),1e-6,s)
+            self.assertTrue(np.all(r[~mask]==0.0),s)
+
+    def testStatsSerial(self):
+        """statistics computed in the current thread"""
+        self.checkStats(1)
+
+    def testStatsThreaded(self):
+        """statistics computed in several threads"""
+        self.checkStats(3)
+
+    def testErrors(self):
+        """unsupported statistics and misaligned files should raise exception"""
+        with self.assertRaises(minc2_error):
+            voxelwise_stats(inputFiles, ['mode'], out_prefix=os.path.join(outputDir,'bad'))
+        with self.assertRaises(minc2_error):
+            voxelwise_stats(inputFiles+[otherFile], ['mean'], out_prefix=os.path.join(outputDir,'bad'))
+
+
+def voxel_mean_range(v):
+    """per-voxel function for map_voxels"""
+    return (np.mean(v), np.max(v)-np.min(v))
+
+def block_mean_range(v):
+    """vectorized function for map_voxels"""
+    return np.stack([np.mean(v,axis=0), np.max(v,axis=0)-np.min(v,axis=0)])
+
+def fail(v):
+    """function that should never be called"""
+    raise RuntimeError("function called for masked voxels")
+
+
+class minc2_map_voxels(unittest.TestCase):
+    """test parallel map over voxels"""
+    def checkMap(self, func, vectorized, workers):
+        data=np.stack([load(f) for f in inputFiles])
+        mask=load(maskFile)>0.5
+        outputs=[os.path.join(outputDir,'map_mean.mnc'),os.path.join(outputDir,'map_range.mnc')]
+        map_voxels(func, inputFiles, outputs, mask=maskFile, block=100, workers=workers,
+                   vectorized=vectorized, store_type='float64')
+        mean=load(outputs[0])
+        rng=load(outputs[1])
+        self.assertLess(np.max(np.abs(mean[mask]-np.mean(data,axis=0)[mask])),1e-6)
+        self.assertLess(np.max(np.abs(rng[mask]-np.ptp(data,axis=0)[mask])),1e-6)
+        self.assertTrue(np.all(mean[~mask]==0.0))
+
+    def testMapSerial(self):
+        """per-voxel function in the current process"""
+        self.checkMap(voxel_mean_range, False, 1)
+
+    def testMapParallel(self):
+        """per-voxel function in worker processes"""
+        self.checkMap(voxel_mean_range, False, 2)
+
+    def testMapVectorized(self):
+        """vectorized function in worker processes"""
+        self.checkMap(block_mean_range, True, 2)
+
+    def testMaskedOut(self):
+        """function should not be called for masked out voxels"""
+        v=minc2_file(maskFile)
+        empty=os.path.join(outputDir,'empty_mask.mnc')
+        out=minc2_file()
+        out.imitate(maskFile, path=empty)
+        out.save_complete_volume(np.zeros(v.data.shape), value_range=(0.0, 1.0))
+        out.close()
+        v.close()
+        output=os.path.join(outputDir,'map_empty.mnc')
+        map_voxels(fail, inputFiles, [output], mask=empty, block=100, workers=2)
+        self.assertTrue(np.all(load(output)==0.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,10 +6,10 @@ import os
 import subprocess
 import tempfile
 
-from minc2_simple import minc2_file,minc2_xfm,minc2_error
+from minc2_simple import minc2_file,minc2_xfm,minc2_error,minc2_dim
 
 def setUpModule():
-    global outputXfmFilename1,outputXfmFilename2,outputXfmFilename3
+    global outputXfmFilename1,outputXfmFilename2,outputXfmFilename3,outputGridFilename
     
      # testing for applying transformations to coordinates:
     outputXfmFilename1 = tempfile.NamedTemporaryFile(prefix="test-xfm-1", suffix=".xfm").name
@@ -20,12 +20,24 @@ def setUpModule():
     subprocess.check_call(["param2xfm", "-center", '-23.98', '0.46', '9.5', "-translation", '0.0', '-46', '89.3', "-scales", '10', '7.33', '84', outputXfmFilename2])
     subprocess.check_call(["xfmconcat", outputXfmFilename1, outputXfmFilename2, outputXfmFilename3])
 
+    # small random nonlinear displacement field
+    outputGridFilename = tempfile.NamedTemporaryFile(prefix="test-grid-", suffix=".mnc").name
+    dims=[minc2_dim(id=minc2_file.MINC2_DIM_VEC,length=3,start=0.0,step=1.0,have_dir_cos=False,dir_cos=None)]+\
+         [minc2_dim(id=i,length=11,start=-50.0,step=10.0,have_dir_cos=False,dir_cos=None)
+          for i in (minc2_file.MINC2_DIM_X,minc2_file.MINC2_DIM_Y,minc2_file.MINC2_DIM_Z)]
+    g=minc2_file()
+    g.define(dims,'float32','float32')
+    g.create(outputGridFilename)
+    g.save_complete_volume(N.random.uniform(-2.0,2.0,(11,11,11,3)).astype(N.float32))
+    g.close()
+
 
 def tearDownModule():
    
     os.remove(outputXfmFilename1)
     os.remove(outputXfmFilename2)
     os.remove(outputXfmFilename3)
+    os.remove(outputGridFilename)
    
 class testXfmsAppliedToCoordinates(unittest.TestCase):
     """test that xfm files can be used to transform x,y,z coordinates"""
@@ -63,6 +75,41 @@ class testXfmsAppliedToCoordinates(unittest.TestCase):
         self.assertAlmostEqual(out[0], -119.559994975925, 8)
         self.assertAlmostEqual(out[1], -2.72634880128239, 8)
         self.assertAlmostEqual(out[2], 0.0509524723840147, 8)
+
+    def testThreadedTransform(self):
+        """multi-threaded transformation of many points should give the same result"""
+        pts=N.random.uniform(-40.0,40.0,(1000,3))
+        _xfm=minc2_xfm(outputXfmFilename3)
+        self.assertAlmostEqual(N.max(N.abs(_xfm.transform_point(pts)-_xfm.transform_point(pts,threads=4))),0.0,8)
+
+        _grid=minc2_xfm(outputXfmFilename1)
+        _grid.append_grid_transform(outputGridFilename)
+        a=_grid.transform_point(pts)
+        b=_grid.transform_point(pts,threads=4)
+        c=_grid.inverse_transform_point(a,threads=3)
+        d=_grid.inverse_transform_point(a)
+        self.assertAlmostEqual(N.max(N.abs(a-b)),0.0,8)
+        self.assertAlmostEqual(N.max(N.abs(c-d)),0.0,8)
+
+    def testTransformGrid(self):
+        """dense displacement field should match displacements of lattice coordinates"""
+        dims=[minc2_dim(id=i,length=n,start=-20.0,step=4.0,have_dir_cos=False,dir_cos=None)
+              for i,n in ((minc2_file.MINC2_DIM_X,6),(minc2_file.MINC2_DIM_Y,7),(minc2_file.MINC2_DIM_Z,5))]
+        _xfm=minc2_xfm(outputXfmFilename1)
+        g=_xfm.transform_grid(dims,dtype='float64')
+
+        z,y,x=N.meshgrid(N.arange(5)*4.0-20.0,N.arange(7)*4.0-20.0,N.arange(6)*4.0-20.0,indexing='ij')
+        xyz=N.column_stack((N.ravel(x),N.ravel(y),N.ravel(z)))
+        ref=(_xfm.transform_point(xyz)-xyz).reshape(5,7,6,3)
+        self.assertEqual(g.shape,(5,7,6,3))
+        self.assertAlmostEqual(N.max(N.abs(g-ref)),0.0,8)
+
+        gridFilename=tempfile.NamedTemporaryFile(prefix="test-grid-out-", suffix=".mnc").name
+        _xfm.transform_grid(dims,dtype='float64',path=gridFilename)
+        v=minc2_file(gridFilename)
+        self.assertAlmostEqual(N.max(N.abs(v.data-ref)),0.0,8)
+        v.close()
+        os.remove(gridFilename)
     
         
         
@@ -0,0 +1,163 @@
+/* ----------------------------- MNI Header -----------------------------------
+@NAME       : minc2-reduce.c
+@DESCRIPTION: Statistics of a volume, computed slab by slab with bounded memory
+@METHOD     : Contains routines :
+                 minc2_reduce
+*/
+
+#include <math.h>
+#include <stdlib.h>
+#include "minc2-simple.h"
+
+int minc2_reduce(minc2_file_handle h,minc2_file_handle mask,const unsigned char *mask_buffer,
+                 const int *keep,size_t buffer_size,struct minc2_reduction *r)
+{
+  int     ndims=0,mask_ndims=0;
+  struct  minc2_dimension *dims,*mask_dims;
+  int    *start,*count,*pos;
+  size_t *ostride;
+  size_t  n_out=1,slice_size=1,block,i;
+  double *buffer,*mask_values=NULL;
+  double  hist_scale=0.0;
+  int     d,s,z;
+  int     err=MINC2_SUCCESS;
+
+  if(minc2_ndim(h,&ndims)!=MINC2_SUCCESS ||
+     minc2_get_representation_dimensions(h,&dims)!=MINC2_SUCCESS)
+    return MINC2_ERROR;
+
+  if(mask)
+  {
+    if(minc2_ndim(mask,&mask_ndims)!=MINC2_SUCCESS ||
+       minc2_get_representation_dimensions(mask,&mask_dims)!=MINC2_SUCCESS ||
+       mask_ndims!=ndims)
+      return MINC2_ERROR;
+    for(d=0;d<ndims;d++)
+      if(mask_dims[d].length!=dims[d].length)
+        return MINC2_ERROR;
+  }
+
+  /*running mean needs count, m2 needs mean, arg* need values*/
+  if( (r->mean && !r->count) || (r->m2 && !r->mean) ||
+      (r->argmin && !r->min) || (r->argmax && !r->max) )
+    return MINC2_ERROR;
+
+  if(r->hist)
+  {
+    if(r->bins<1 || !isfinite(r->hist_min) || !isfinite(r->hist_max) || !(r->hist_max>r->hist_min))
+      return MINC2_ERROR;
+    hist_scale=r->bins/(r->hist_max-r->hist_min);
+  }
+
+  start  =(int*)calloc(ndims,sizeof(int));
+  count  =(int*)calloc(ndims,sizeof(int));
+  pos    =(int*)calloc(ndims,sizeof(int));
+  ostride=(size_t*)calloc(ndims,sizeof(size_t));
+
+  s=ndims-1; /*slabs are formed along the slowest dimension*/
+  for(d=0;d<ndims;d++)
+  {
+    ostride[d]=keep[d]?n_out:0;
+    if(keep[d]) n_out*=dims[d].length;
+    if(d<s) slice_size*=dims[d].length;
+    count[d]=dims[d].length;
+  }
+
+  block=buffer_size/slice_size;
+  if(block<1) block=1;
+  if(block>(size_t)dims[s].length) block=dims[s].length;
+
+  buffer=(double*)malloc(block*slice_size*sizeof(double));
+  if(mask)
+    mask_values=(double*)malloc(block*slice_size*sizeof(double));
+
+  for(i=0;i<n_out;i++)
+  {
+    if(r->count)  r->count[i]=0.0;
+    if(r->mean)   r->mean[i]=0.0;
+    if(r->m2)     r->m2[i]=0.0;
+    if(r->min)    r->min[i]=HUGE_VAL;
+    if(r->max)    r->max[i]=-HUGE_VAL;
+    if(r->argmin) r->argmin[i]=-1;
+    if(r->argmax) r->argmax[i]=-1;
+  }
+  if(r->hist)
+    for(d=0;d<r->bins;d++)
+      r->hist[d]=0.0;
+
+  for(z=0;z<dims[s].length;z+=block)
+  {
+    size_t n,o;
+    size_t flat=(size_t)z*slice_size;
+
+    start[s]=z;
+    count[s]=(z+block)>(size_t)dims[s].length?dims[s].length-z:(int)block;
+    n=(size_t)count[s]*slice_size;
+
+    if(minc2_read_hyperslab(h,start,count,buffer,MINC2_DOUBLE)!=MINC2_SUCCESS ||
+       (mask && minc2_read_hyperslab(mask,start,count,mask_values,MINC2_DOUBLE)!=MINC2_SUCCESS))
+    {
+      err=MINC2_ERROR;
+      break;
+    }
+
+    for(d=0;d<ndims;d++)
+      pos[d]=0;
+    pos[s]=z;
+    o=(size_t)z*ostride[s];
+
+    for(i=0;i<n;i++,flat++)
+    {
+      double v=buffer[i];
+
+      if( isfinite(v) &&
+          (!mask_values || mask_values[i]>0.5) &&
+          (!mask_buffer || mask_buffer[flat]) )
+      {
+        if(r->count) r->count[o]+=1.0;
+        if(r->mean)
+        {
+          /*Welford update*/
+          double delta=v-r->mean[o];
+          r->mean[o]+=delta/r->count[o];
+          if(r->m2) r->m2[o]+=delta*(v-r->mean[o]);
+        }
+        if(r->min && v<r->min[o])
+        {
+          r->min[o]=v;
+          if(r->argmin) r->argmin[o]=(long long)flat;
+        }
+        if(r->max && v>r->max[o])
+        {
+          r->max[o]=v;
+          if(r->argmax) r->argmax[o]=(long long)flat;
+        }
+        if(r->hist && v>=r->hist_min && v<=r->hist_max)
+        {
+          int b=(int)((v-r->hist_min)*hist_scale);
+          if(b>=r->bins) b=r->bins-1; /*last bin includes upper edge*/
+          r->hist[b]+=1.0;
+        }
+      }
+
+      /*advance position and output index*/
+      for(d=0;d<ndims;d++)
+      {
+        o+=ostride[d];
+        if(++pos[d]<dims[d].length) break;
+        o-=ostride[d]*dims[d].length;
+        pos[d]=0;
+      }
+    }
+  }
+
+  free(buffer);
+  free(mask_values);
+  free(start);
+  free(count);
+  free(pos);
+  free(ostride);
+  return err;
+}
+
+/* kate: indent-mode cstyle; indent-width 2; replace-tabs on; remove-trailing-spaces modified; hl c*/
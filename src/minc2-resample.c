@@ -0,0 +1,99 @@
+/* ----------------------------- MNI Header -----------------------------------
+@NAME       : minc2-resample.c
+@DESCRIPTION: Interpolation of 3D volumes kept in memory, used for resampling
+@METHOD     : Contains routines :
+                 minc2_interpolate_volume
+*/
+
+#include <math.h>
+#include <stddef.h>
+#include "minc2-simple.h"
+
+/*volume element, with coordinates clamped to the volume*/
+static inline float _minc2_voxel(const float *src,const int *dims,int i,int j,int k)
+{
+  if(i<0) i=0; else if(i>=dims[0]) i=dims[0]-1;
+  if(j<0) j=0; else if(j>=dims[1]) j=dims[1]-1;
+  if(k<0) k=0; else if(k>=dims[2]) k=dims[2]-1;
+  return src[((size_t)i*dims[1]+j)*dims[2]+k];
+}
+
+/*Keys cubic convolution kernel weights, a=-0.5*/
+static inline void _minc2_cubic_weights(double f,double *w)
+{
+  double f2=f*f,f3=f2*f;
+  w[0]=-0.5*f3+f2-0.5*f;
+  w[1]= 1.5*f3-2.5*f2+1.0;
+  w[2]=-1.5*f3+2.0*f2+0.5*f;
+  w[3]= 0.5*f3-0.5*f2;
+}
+
+int minc2_interpolate_volume(const float *src,const int *dims,int n,const double *ijk,float *out,int order,double fill)
+{
+  int p;
+
+  if(order!=MINC2_RESAMPLE_NEAREST && order!=MINC2_RESAMPLE_LINEAR && order!=MINC2_RESAMPLE_CUBIC)
+    return MINC2_ERROR;
+
+  for(p=0;p<n;p++)
+  {
+    const double *c=&ijk[p*3];
+    int a;
+    int inside=1;
+
+    /*voxel centers are at integer coordinates, voxel i covers [i-0.5,i+0.5)*/
+    for(a=0;a<3;a++)
+      if(!(c[a]>=-0.5 && c[a]<dims[a]-0.5)) inside=0;
+
+    if(!inside)
+    {
+      out[p]=(float)fill;
+      continue;
+    }
+
+    if(order==MINC2_RESAMPLE_NEAREST)
+    {
+      out[p]=_minc2_voxel(src,dims,(int)floor(c[0]+0.5),(int)floor(c[1]+0.5),(int)floor(c[2]+0.5));
+    }
+    else if(order==MINC2_RESAMPLE_LINEAR)
+    {
+      int i=(int)floor(c[0]),j=(int)floor(c[1]),k=(int)floor(c[2]);
+      double fi=c[0]-i,fj=c[1]-j,fk=c[2]-k;
+
+      double v00=_minc2_voxel(src,dims,i,  j,  k)*(1.0-fk)+_minc2_voxel(src,dims,i,  j,  k+1)*fk;
+      double v01=_minc2_voxel(src,dims,i,  j+1,k)*(1.0-fk)+_minc2_voxel(src,dims,i,  j+1,k+1)*fk;
+      double v10=_minc2_voxel(src,dims,i+1,j,  k)*(1.0-fk)+_minc2_voxel(src,dims,i+1,j,  k+1)*fk;
+      double v11=_minc2_voxel(src,dims,i+1,j+1,k)*(1.0-fk)+_minc2_voxel(src,dims,i+1,j+1,k+1)*fk;
+
+      out[p]=(float)( (v00*(1.0-fj)+v01*fj)*(1.0-fi) + (v10*(1.0-fj)+v11*fj)*fi );
+    }
+    else /*cubic*/
+    {
+      int i=(int)floor(c[0]),j=(int)floor(c[1]),k=(int)floor(c[2]);
+      double wi[4],wj[4],wk[4];
+      double v=0.0;
+      int ii,jj,kk;
+
+      _minc2_cubic_weights(c[0]-i,wi);
+      _minc2_cubic_weights(c[1]-j,wj);
+      _minc2_cubic_weights(c[2]-k,wk);
+
+      for(ii=0;ii<4;ii++)
+      {
+        double vj=0.0;
+        for(jj=0;jj<4;jj++)
+        {
+          double vk=0.0;
+          for(kk=0;kk<4;kk++)
+            vk+=wk[kk]*_minc2_voxel(src,dims,i+ii-1,j+jj-1,k+kk-1);
+          vj+=wj[jj]*vk;
+        }
+        v+=wi[ii]*vj;
+      }
+      out[p]=(float)v;
+    }
+  }
+  return MINC2_SUCCESS;
+}
+
+/* kate: indent-mode cstyle; indent-width 2; replace-tabs on; remove-trailing-spaces modified; hl c*/
@@ -49,6 +49,38 @@ enum  minc2_xfm {
 };
 
 
+/**
+ * flags for minc2_open_flags
+ */
+enum  minc2_open_flags {
+  MINC2_OPEN_DEFAULT=0,      /**< query all volume information on open */
+  MINC2_OPEN_HEADER_ONLY=1   /**< query only dimensions and storage type, scaling and volume range are queried on first use */
+};
+
+/**
+ * result of the image layout query, see minc2_get_image_offset
+ */
+enum  minc2_mmap_status {
+  MINC2_MMAP_OK=0,           /**< image is stored contiguously and can be memory-mapped */
+  MINC2_MMAP_NOT_OPEN,       /**< file is not open, or path is unknown */
+  MINC2_MMAP_HDF5_ERROR,     /**< image dataset could not be inspected */
+  MINC2_MMAP_NOT_CONTIGUOUS, /**< image is stored in chunks */
+  MINC2_MMAP_FILTERED,       /**< image is compressed (or uses other filters) */
+  MINC2_MMAP_NOT_ALLOCATED,  /**< image storage is not allocated yet */
+  MINC2_MMAP_BYTE_ORDER      /**< image byte order is not native */
+};
+
+
+/**
+ * interpolation order, used by minc2_interpolate_volume
+ */
+enum  minc2_resample_order {
+  MINC2_RESAMPLE_NEAREST=0,  /**< nearest neighbour */
+  MINC2_RESAMPLE_LINEAR,     /**< trilinear */
+  MINC2_RESAMPLE_CUBIC       /**< tricubic, Keys convolution kernel */
+};
+
+
 /**
  * minc2 dimension information
  */
@@ -63,6 +95,25 @@ struct minc2_dimension
   double dir_cos[3];     /**< direction cosines*/
 };
 
+/**
+ * output of minc2_reduce, arrays have one element per output position
+ * (product of lengths of kept dimensions), any of them can be NULL
+ */
+struct minc2_reduction
+{
+  double    *count;      /**< number of used voxels */
+  double    *mean;       /**< mean value */
+  double    *m2;         /**< sum of squared differences from the mean, var=m2/count */
+  double    *min;        /**< minimum value */
+  double    *max;        /**< maximum value */
+  long long *argmin;     /**< flat index (in representation order, slowest dimension first) of the minimum, -1 if none */
+  long long *argmax;     /**< flat index of the maximum, -1 if none */
+  int        bins;       /**< number of histogram bins */
+  double     hist_min;   /**< lower edge of the first histogram bin */
+  double     hist_max;   /**< upper edge of the last histogram bin */
+  double    *hist;       /**< histogram of all used voxels, bins elements */
+};
+
 /**
  *
  */
@@ -151,6 +202,11 @@ int minc2_destroy(minc2_file_handle h);
  */
 int minc2_open(minc2_file_handle h,const char * path);
 
+/**
+ * open existing file, flags is a combination of minc2_open_flags
+ */
+int minc2_open_flags(minc2_file_handle h,const char * path,int flags);
+
 
 /**
  * define a new minc2 volume, using provided storage dimension information and storage data type
@@ -188,6 +244,46 @@ int minc2_data_type(minc2_file_handle h,int *_type);
  */
 int minc2_storage_data_type(minc2_file_handle h,int *_type);
 
+/**
+ * query real value range of the volume
+ */
+int minc2_get_volume_range(minc2_file_handle h,double *value_min,double *value_max);
+
+/**
+ * query valid range of voxel values, as stored on disk
+ */
+int minc2_get_valid_range(minc2_file_handle h,double *value_min,double *value_max);
+
+/**
+ * query scaling flags
+ */
+int minc2_get_scaling(minc2_file_handle h,int *use_global_scaling,int *use_slice_scaling);
+
+/**
+ * check if HDF5 library was built thread-safe, i.e it is safe to read different files from several threads,
+ * returns 1 if thread-safe, 0 otherwise
+ */
+int minc2_hdf5_threadsafe(void);
+
+/**
+ * query file offset of the image data, succeeds only if the image is stored contiguously,
+ * without filters and in native byte order, status is set to one of minc2_mmap_status values
+ */
+int minc2_get_image_offset(minc2_file_handle h,long long *offset,int *status);
+
+/**
+ * query HDF5 chunk sizes of the image, in the same order as store dimensions,
+ * all sizes are set to 0 if the image is not stored in chunks
+ */
+int minc2_get_chunking(minc2_file_handle h,int *chunk);
+
+/**
+ * query HDF5 filters of the image
+ * compression receives zlib compression level, -1 if the image is not compressed
+ * shuffle is set to 1 if shuffle filter is used
+ */
+int minc2_get_storage_filters(minc2_file_handle h,int *compression,int *shuffle);
+
 /**
  * query number of slice dimensions 
  */
@@ -231,12 +327,31 @@ int minc2_load_complete_volume(minc2_file_handle h,void *buffer,int representati
  */
 int minc2_save_complete_volume(minc2_file_handle h,const void *buffer,int representation_type);
 
+/**
+ * Save complete volume, using known range of values instead of calculating it from the buffer
+ * range is ignored when slice scaling is used
+ */
+int minc2_save_complete_volume_range(minc2_file_handle h,const void *buffer,int representation_type,double value_min,double value_max);
+
+/**
+ * Calculate range of finite values in the buffer
+ * if there are no finite values, min and max are set to NaN
+ */
+int minc2_buffer_range(const void *buffer,size_t buffer_length,int representation_type,double *buffer_min,double *buffer_max);
+
 /**
  * Specify flags to use scaling
  * this have to be set before minc2_create
  */
 int minc2_set_scaling(minc2_file_handle h,int use_global_scaling,int use_slice_scaling);
 
+/**
+ * Specify storage options, this have to be set after minc2_define and before minc2_create
+ * chunks: HDF5 chunk sizes, in the same order as store dimensions, or NULL for libminc default
+ * compression: zlib compression level, 0 - no compression, -1 - default (MINC_COMPRESS environment variable)
+ */
+int minc2_set_storage(minc2_file_handle h,const int *chunks,int compression);
+
 /**
  * Specify volume range, only when using hyperslab writing
  * Implies no slice scaling 
@@ -318,6 +433,21 @@ int minc2_get_attribute_length(minc2_file_handle h,const char* group,const char*
  */
 int minc2_read_attribute(minc2_file_handle h,const char* group,const char* attr,void *buf,int buf_size);
 
+/**
+ * read all attributes of all groups at once into a newly allocated buffer,
+ * which should be freed with minc2_free_metadata_dump. Buffer contains sequence of records:
+ * four ints (group name length, attribute name length, minc2 data type, number of elements),
+ * followed by group name and attribute name (without terminating zeros) and attribute value.
+ * Records with attribute name length -1 mark start of a group and have no name and value.
+ * Attributes history, ident and minc_version of the root group are reported in group ""
+ */
+int minc2_metadata_dump(minc2_file_handle h,void **buffer,size_t *buffer_size);
+
+/**
+ * free buffer allocated by minc2_metadata_dump
+ */
+int minc2_free_metadata_dump(void *buffer);
+
 /**
  * write attribute
  */
@@ -528,6 +658,52 @@ int minc2_iterator_next(minc2_file_iterator_handle h);
 int minc2_iterator_get_values(minc2_file_iterator_handle h,void *val);
 int minc2_iterator_put_values(minc2_file_iterator_handle h,const void *val);
 
+/**
+ * Number of voxels in one slice (block) of the iterator, per file
+ */
+int minc2_iterator_block_size(minc2_file_iterator_handle h,int *size);
+
+/**
+ * Get values from the current voxel to the end of the current slice, for all files
+ * val should have space for fnum*block_size elements, values are stored file by file: [fnum][count]
+ * count receives number of voxels per file, offset - linear index of the current voxel
+ */
+int minc2_iterator_get_block(minc2_file_iterator_handle h,void *val,int *count,long long *offset);
+
+/**
+ * Advance input iterator to the beginning of the next slice and read it,
+ * end is set to 1 at the end of the volume, returns MINC2_ERROR if the slice could not be read
+ */
+int minc2_iterator_next_slice(minc2_file_iterator_handle h,int *end);
+
+/**
+ * Put values for count voxels starting from the current one, for all files, into output iterator
+ * val is stored file by file: [fnum][count], slices are written as soon as they are filled
+ * written receives number of voxels stored, end is set to 1 when the whole volume was written
+ */
+int minc2_iterator_put_block(minc2_file_iterator_handle h,const void *val,int count,int *written,int *end);
+
+
+/**
+ * Interpolate 3D volume, stored in memory, at given voxel coordinates
+ * src: volume in C order, dims[0] is the slowest dimension
+ * ijk: n points, with coordinates along dims[0],dims[1],dims[2]
+ * order: interpolation order, see enum minc2_resample_order
+ * points outside of the volume get fill value
+ */
+int minc2_interpolate_volume(const float *src,const int *dims,int n,const double *ijk,float *out,int order,double fill);
+
+/**
+ * Calculate statistics of the volume, reading it slab by slab
+ * mask: optional mask volume with the same dimensions, voxels with values above 0.5 are used, or NULL
+ * mask_buffer: optional mask in memory, in representation order, voxels with non-zero values are used, or NULL
+ * keep: one flag per dimension (representation order, fastest first), kept dimensions are not reduced
+ * buffer_size: maximum number of voxels read at once, at least one slice of the slowest dimension is read
+ * non-finite values are ignored
+ */
+int minc2_reduce(minc2_file_handle h,minc2_file_handle mask,const unsigned char *mask_buffer,
+                 const int *keep,size_t buffer_size,struct minc2_reduction *r);
+
 
 /**
  * Tags io
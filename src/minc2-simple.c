@@ -1,6 +1,7 @@
 #include "minc2.h"
 #include "minc_config.h"
 #include <volume_io.h>
+#include <hdf5.h>
 
 #include "minc2-simple.h"
 #include <stdlib.h>
@@ -51,6 +52,7 @@ VIO_BOOL extract2_parameters_from_matrix(VIO_Transform *trans,
  */
 struct minc2_file {
   mihandle_t vol;
+  char          *path;        /*file path, as used to open or create the file*/
 
   int            ndims;
   int            store_type;  /*how data is stored in minc2 file*/
@@ -71,6 +73,12 @@ struct minc2_file {
   miboolean_t    global_scaling_flag;
   
   miboolean_t    using_apparent_order;
+
+  int            deferred_scaling; /*scaling information was not queried yet, see MINC2_OPEN_HEADER_ONLY*/
+
+  int           *storage_chunks;   /*requested chunk sizes in store order, NULL - libminc default*/
+  int            compression_set;  /*compression was specified with minc2_set_storage*/
+  int            compression;      /*requested zlib compression level*/
   
   /*internal temporary data*/
   misize_t      *tmp_start;
@@ -138,27 +146,145 @@ int minc2_free(minc2_file_handle h)
   if(!h)
     return MINC2_SUCCESS;
   _minc2_cleanup_dimensions(h);
+  if(h->path) free(h->path);
+  if(h->storage_chunks) free(h->storage_chunks);
   free(h);
   return MINC2_SUCCESS;
 }
 
 
-int minc2_open(minc2_file_handle h, const char * path)
+/**
+ * query scaling information and volume range, setup representation data type
+ */
+static int _minc2_query_scaling(minc2_file_handle h)
 {
   /*voxel valid range*/
   double valid_min,valid_max;
   
   /*real volume range, only awailable when slice scaling is off*/
   double volume_min=0.0,volume_max=1.0;
+
+  if ( miget_slice_scaling_flag(h->vol, &h->slice_scaling_flag) < 0 ) {
+    MI_LOG_ERROR(MI2_MSG_GENERIC,"Can't get slice scaling ");
+    return MINC2_ERROR;
+  }
+  if(miget_volume_valid_range(h->vol,&valid_max,&valid_min) < 0 ) {
+    MI_LOG_ERROR(MI2_MSG_GENERIC,"Can't get valid range");
+    return MINC2_ERROR;
+  }
+
+  if( !h->slice_scaling_flag )
+  {
+    if( miget_volume_range(h->vol,&volume_max,&volume_min) < 0 ) {
+      MI_LOG_ERROR(MI2_MSG_GENERIC,"Can't get volume range");
+      return MINC2_ERROR;
+    }
+
+    h->global_scaling_flag= !(volume_min == valid_min && volume_max == valid_max);
+  }
+
+  /* set the file data type*/
+  if(h->slice_scaling_flag || h->global_scaling_flag)
+  {
+    switch ( h->store_type )
+    {
+      case MI_TYPE_FLOAT:
+        h->data_type=MINC2_FLOAT;
+        break;
+      case MI_TYPE_DOUBLE:
+        h->data_type=MINC2_DOUBLE;
+        break;
+      case MI_TYPE_FCOMPLEX:
+        h->data_type=MINC2_FCOMPLEX;
+        break;
+      case MI_TYPE_DCOMPLEX:
+        h->data_type=MINC2_DCOMPLEX;
+        break;
+      default:
+        h->data_type=MINC2_FLOAT;
+        break;
+    } 
+  }
+  else /*not using normalization*/
+  {
+    switch ( h->store_type )
+    {
+      case MI_TYPE_BYTE:
+        h->data_type=MINC2_BYTE;
+        break;
+      case MI_TYPE_UBYTE:
+        h->data_type=MINC2_UBYTE;
+        break;
+      case MI_TYPE_SHORT:
+        h->data_type=MINC2_SHORT;
+        break;
+      case MI_TYPE_USHORT:
+        h->data_type=MINC2_USHORT;
+        break;
+      case MI_TYPE_INT:
+        h->data_type=MINC2_INT;
+        break;
+      case MI_TYPE_UINT:
+        h->data_type=MINC2_UINT;
+        break;
+      case MI_TYPE_FLOAT:
+        h->data_type=MINC2_FLOAT;
+        break;
+      case MI_TYPE_DOUBLE:
+        h->data_type=MINC2_DOUBLE;
+        break;
+      case MI_TYPE_SCOMPLEX:
+        h->data_type=MINC2_SCOMPLEX;
+        break;
+      case MI_TYPE_ICOMPLEX:
+        h->data_type=MINC2_ICOMPLEX;
+        break;
+      case MI_TYPE_FCOMPLEX:
+        h->data_type=MINC2_FCOMPLEX;
+        break;
+      case MI_TYPE_DCOMPLEX:
+        h->data_type=MINC2_DCOMPLEX;
+        break;
+      default:
+        MI_LOG_ERROR(MI2_MSG_GENERIC,"Unsupported file data type");
+        return MINC2_ERROR;
+    } 
+  }
+
+  return MINC2_SUCCESS;
+}
+
+/**
+ * finish opening file in MINC2_OPEN_HEADER_ONLY mode
+ */
+static int _minc2_check_scaling(minc2_file_handle h)
+{
+  if(!h->deferred_scaling)
+    return MINC2_SUCCESS;
+  h->deferred_scaling=0;
+  return _minc2_query_scaling(h);
+}
+
+
+int minc2_open(minc2_file_handle h, const char * path)
+{
+  return minc2_open_flags(h,path,MINC2_OPEN_DEFAULT);
+}
+
+int minc2_open_flags(minc2_file_handle h, const char * path,int flags)
+{
   miclass_t volume_data_class;
   mitype_t  store_type;
   int n_dims;
   int i;
 
+  h->deferred_scaling=0;
+
   if ( miopen_volume(path, MI2_OPEN_READ, &h->vol) < 0 ) {
     MI_LOG_ERROR(MI2_MSG_GENERIC,"Can't open minc file");
     return MINC2_ERROR;
   }
+  h->path=strdup(path);
   
   if ( miget_volume_dimension_count(h->vol, MI_DIMCLASS_ANY, MI_DIMATTR_ALL, &n_dims)<0) {
     MI_LOG_ERROR(MI2_MSG_GENERIC,"Can't get dimension count");
@@ -198,25 +324,6 @@ int minc2_open(minc2_file_handle h, const char * path)
   
   h->store_type=_mitype_to_minc2_type(store_type);
   
-  if ( miget_slice_scaling_flag(h->vol, &h->slice_scaling_flag) < 0 ) {
-    MI_LOG_ERROR(MI2_MSG_GENERIC,"Can't get slice scaling ");
-    return MINC2_ERROR;
-  }
-  if(miget_volume_valid_range(h->vol,&valid_max,&valid_min) < 0 ) {
-    MI_LOG_ERROR(MI2_MSG_GENERIC,"Can't get valid range");
-    return MINC2_ERROR;
-  }
-
-  if( !h->slice_scaling_flag )
-  {
-    if( miget_volume_range(h->vol,&volume_max,&volume_min) < 0 ) {
-      MI_LOG_ERROR(MI2_MSG_GENERIC,"Can't get volume range");
-      return MINC2_ERROR;
-    }
-
-    h->global_scaling_flag= !(volume_min == valid_min && volume_max == valid_max);
-  }
-
   /*get dimension information*/
   for (i = 0; i < h->ndims; i++ )
   {
@@ -303,72 +410,12 @@ int minc2_open(minc2_file_handle h, const char * path)
     return MINC2_ERROR;  
   }
 
-  /* set the file data type*/
-  if(h->slice_scaling_flag || h->global_scaling_flag)
-  {
-    switch ( h->store_type )
-    {
-      case MI_TYPE_FLOAT:
-        h->data_type=MINC2_FLOAT;
-        break;
-      case MI_TYPE_DOUBLE:
-        h->data_type=MINC2_DOUBLE;
-        break;
-      case MI_TYPE_FCOMPLEX:
-        h->data_type=MINC2_FCOMPLEX;
-        break;
-      case MI_TYPE_DCOMPLEX:
-        h->data_type=MINC2_DCOMPLEX;
-        break;
-      default:
-        h->data_type=MINC2_FLOAT;
-        break;
-    } 
-  }
-  else /*not using normalization*/
+  if(flags&MINC2_OPEN_HEADER_ONLY)
   {
-    switch ( h->store_type )
-    {
-      case MI_TYPE_BYTE:
-        h->data_type=MINC2_BYTE;
-        break;
-      case MI_TYPE_UBYTE:
-        h->data_type=MINC2_UBYTE;
-        break;
-      case MI_TYPE_SHORT:
-        h->data_type=MINC2_SHORT;
-        break;
-      case MI_TYPE_USHORT:
-        h->data_type=MINC2_USHORT;
-        break;
-      case MI_TYPE_INT:
-        h->data_type=MINC2_INT;
-        break;
-      case MI_TYPE_UINT:
-        h->data_type=MINC2_UINT;
-        break;
-      case MI_TYPE_FLOAT:
-        h->data_type=MINC2_FLOAT;
-        break;
-      case MI_TYPE_DOUBLE:
-        h->data_type=MINC2_DOUBLE;
-        break;
-      case MI_TYPE_SCOMPLEX:
-        h->data_type=MINC2_SCOMPLEX;
-        break;
-      case MI_TYPE_ICOMPLEX:
-        h->data_type=MINC2_ICOMPLEX;
-        break;
-      case MI_TYPE_FCOMPLEX:
-        h->data_type=MINC2_FCOMPLEX;
-        break;
-      case MI_TYPE_DCOMPLEX:
-        h->data_type=MINC2_DCOMPLEX;
-        break;
-      default:
-        MI_LOG_ERROR(MI2_MSG_GENERIC,"Unsupported file data type");
-        return MINC2_ERROR;
-    } 
+    /*scaling and data type are queried on first use*/
+    h->deferred_scaling=1;
+  } else if(_minc2_query_scaling(h)!=MINC2_SUCCESS) {
+    return MINC2_ERROR;
   }
 
   switch ( volume_data_class )
@@ -402,6 +449,8 @@ int minc2_open(minc2_file_handle h, const char * path)
 
 int minc2_slice_ndim(minc2_file_handle h,int *slice_ndim)
 {
+  if(_minc2_check_scaling(h)!=MINC2_SUCCESS)
+    return MINC2_ERROR;
   if(h->slice_scaling_flag)
   {
     if( miget_slice_dimension_count(h->vol,MI_DIMCLASS_ANY, MI_DIMATTR_ALL, slice_ndim)<0)
@@ -494,6 +543,9 @@ int minc2_close(minc2_file_handle h)
       return MINC2_ERROR;
     
     h->vol=0;
+    if(h->path) free(h->path);
+    h->path=NULL;
+    h->deferred_scaling=0;
     
     return _minc2_cleanup_dimensions(h);
   } else {
@@ -535,6 +587,9 @@ int minc2_load_complete_volume( minc2_file_handle h,void *buffer,int representat
   int i;
   int err=MINC2_SUCCESS;
 
+  if(_minc2_check_scaling(h)!=MINC2_SUCCESS)
+    return MINC2_ERROR;
+
   if(h->using_apparent_order)
   {
     /*need to specify dimensions in apparent order, with minc2 convention that fasted dimensions are last*/
@@ -561,36 +616,260 @@ int minc2_load_complete_volume( minc2_file_handle h,void *buffer,int representat
   return err;
 }
 
+/*placeholder for the check of integer values*/
+#define _ANY_VALUE(v) 1
+
+/*buffers smaller than this are scanned by a single thread*/
+#define _MINC2_PARALLEL_SCAN_LENGTH 262144
+
+/*OpenMP directives, ignored when compiled without OpenMP*/
+#ifdef _OPENMP
+#define _MINC2_OMP(directive) _Pragma(directive)
+#else
+#define _MINC2_OMP(directive)
+#endif
+
+/*true only for finite values, can be vectorized unlike isfinite*/
+#define _FINITE_VALUE(v) ((v)-(v)==0)
+
+/*
+ range of finite values of a buffer, computed in the native type.
+ The loop has no branches: non-finite values are replaced by neutral elements,
+ so that it can be vectorized, and it is split between threads for large buffers.
+*/
 #define \
-_GET_BUFFER_MIN_MAX(type_out,buffer,buffer_length,buffer_min,buffer_max) \
+_GET_BUFFER_MIN_MAX_FUNC(name,type_out,check,type_min,type_max) \
+static void name(const void *buffer,size_t buffer_length,double *buffer_min,double *buffer_max) \
+{ \
+  const type_out *_buffer = (const type_out *)buffer; \
+  type_out _min=type_max,_max=type_min; \
+  long _i; \
+  _MINC2_OMP("omp parallel for simd if(buffer_length>_MINC2_PARALLEL_SCAN_LENGTH) reduction(min:_min) reduction(max:_max)") \
+  for(_i=0;_i<(long)buffer_length;_i++) \
   { \
-    size_t _i;\
-    const type_out *_buffer = (const type_out *)buffer; \
-    buffer_min=buffer_max=_buffer[0]; \
-    for(_i=0;_i<buffer_length;_i++,_buffer++)\
-    {\
-      if( *_buffer > buffer_max ) buffer_max=*_buffer; \
-      if( *_buffer < buffer_min ) buffer_min=*_buffer; \
-    }\
+    type_out _v=_buffer[_i]; \
+    type_out _lo=check(_v)?_v:type_max; \
+    type_out _hi=check(_v)?_v:type_min; \
+    _min=_lo<_min?_lo:_min; \
+    _max=_hi>_max?_hi:_max; \
+  } \
+  *buffer_min=(double)_min; \
+  *buffer_max=(double)_max; \
+}
+
+_GET_BUFFER_MIN_MAX_FUNC(_minc2_buffer_range_ubyte, unsigned char, _ANY_VALUE,   0,         UCHAR_MAX)
+_GET_BUFFER_MIN_MAX_FUNC(_minc2_buffer_range_byte,  signed char,   _ANY_VALUE,   SCHAR_MIN, SCHAR_MAX)
+_GET_BUFFER_MIN_MAX_FUNC(_minc2_buffer_range_ushort,unsigned short,_ANY_VALUE,   0,         USHRT_MAX)
+_GET_BUFFER_MIN_MAX_FUNC(_minc2_buffer_range_short, short,         _ANY_VALUE,   SHRT_MIN,  SHRT_MAX)
+_GET_BUFFER_MIN_MAX_FUNC(_minc2_buffer_range_uint,  unsigned int,  _ANY_VALUE,   0,         UINT_MAX)
+_GET_BUFFER_MIN_MAX_FUNC(_minc2_buffer_range_int,   int,           _ANY_VALUE,   INT_MIN,   INT_MAX)
+_GET_BUFFER_MIN_MAX_FUNC(_minc2_buffer_range_float, float,         _FINITE_VALUE,-HUGE_VALF,HUGE_VALF)
+_GET_BUFFER_MIN_MAX_FUNC(_minc2_buffer_range_double,double,        _FINITE_VALUE,-HUGE_VAL, HUGE_VAL)
+
+int minc2_buffer_range(const void *buffer,size_t buffer_length,int representation_type,double *buffer_min,double *buffer_max)
+{
+  switch(representation_type )
+  {
+    case MINC2_UBYTE:
+      _minc2_buffer_range_ubyte(buffer,buffer_length,buffer_min,buffer_max);
+      break;
+    case MINC2_BYTE:
+      _minc2_buffer_range_byte(buffer,buffer_length,buffer_min,buffer_max);
+      break;
+    case MINC2_USHORT:
+      _minc2_buffer_range_ushort(buffer,buffer_length,buffer_min,buffer_max);
+      break;
+    case MINC2_SHORT:
+      _minc2_buffer_range_short(buffer,buffer_length,buffer_min,buffer_max);
+      break;
+    case MINC2_UINT:
+      _minc2_buffer_range_uint(buffer,buffer_length,buffer_min,buffer_max);
+      break;
+    case MINC2_INT:
+      _minc2_buffer_range_int(buffer,buffer_length,buffer_min,buffer_max);
+      break;
+    case MINC2_FLOAT:
+      _minc2_buffer_range_float(buffer,buffer_length,buffer_min,buffer_max);
+      break;
+    case MINC2_DOUBLE:
+      _minc2_buffer_range_double(buffer,buffer_length,buffer_min,buffer_max);
+      break;
+    default:
+      MI_LOG_ERROR(MI2_MSG_GENERIC,"Unsupported volume data type");
+      return MINC2_ERROR;
+  }
+  if(buffer_length==0 || *buffer_min>*buffer_max)
+  {
+    /*no finite values*/
+    *buffer_min=*buffer_max=NAN;
   }
+  return MINC2_SUCCESS;
+}
 
+/*range of a strided row of values, used for slice scaling*/
 #define \
-_GET_BUFFER_MIN_MAX_PROT(type_out,buffer,buffer_length,buffer_min,buffer_max) \
+_GET_ROW_MIN_MAX(type_out,check,buffer,offset,step,length,row_min,row_max) \
   { \
-    size_t _i;\
-    const type_out *_buffer = (const type_out *)buffer; \
-    buffer_min=buffer_max=FP_NAN; \
-    for(_i=0;_i<buffer_length;_i++,_buffer++)\
+    size_t _k;\
+    const type_out *_buffer = (const type_out *)buffer + offset; \
+    for(_k=0;_k<length;_k++)\
     {\
-      if( isfinite(*_buffer) ) {\
-      if( *_buffer > buffer_max || !isfinite(buffer_max) ) buffer_max=*_buffer; \
-      if( *_buffer < buffer_min || !isfinite(buffer_min) ) buffer_min=*_buffer; \
-      } \
+      double _v=(double)_buffer[_k*step];\
+      double _lo=check(_v)?_v:HUGE_VAL;\
+      double _hi=check(_v)?_v:-HUGE_VAL;\
+      row_min = _lo<row_min ? _lo : row_min; \
+      row_max = _hi>row_max ? _hi : row_max; \
     }\
   }
 
 
-int minc2_save_complete_volume( minc2_file_handle h,const void *buffer,int representation_type)
+/**
+ * calculate value range of every slice of the hyperslab and store it in the file,
+ * used when slice scaling is enabled. Slices are formed by the fastest dimensions in the file order,
+ * hyperslab should contain complete slices.
+ * start and count are in representation order, fastest dimension first
+ */
+static int _minc2_set_buffer_slice_ranges(minc2_file_handle h,const int *start,const int *count,const void *buffer,int representation_type)
+{
+  int     slice_ndim=0;
+  size_t  stride[MI2_MAX_VAR_DIMS];
+  int     outer[MI2_MAX_VAR_DIMS],n_outer=0; /*dimensions enumerating slices*/
+  int     inner[MI2_MAX_VAR_DIMS],n_inner=0; /*dimensions within a slice*/
+  size_t  n_slices=1,n_rows=1;
+  double *slice_min,*slice_max;
+  int     i,j;
+  long    s;
+  int     err=MINC2_SUCCESS;
+
+  if(h->ndims>MI2_MAX_VAR_DIMS || minc2_slice_ndim(h,&slice_ndim)!=MINC2_SUCCESS)
+    return MINC2_ERROR;
+
+  switch(representation_type)
+  {
+    case MINC2_UBYTE: case MINC2_BYTE: case MINC2_USHORT: case MINC2_SHORT:
+    case MINC2_UINT:  case MINC2_INT:  case MINC2_FLOAT:  case MINC2_DOUBLE:
+      break;
+    default:
+      MI_LOG_ERROR(MI2_MSG_GENERIC,"Unsupported volume data type");
+      return MINC2_ERROR;
+  }
+
+  for(i=0;i<h->ndims;i++)
+  {
+    int is_slice=0;
+    for(j=0;j<slice_ndim;j++)
+      if(h->representation_dims[i].id==h->store_dims[j].id)
+        is_slice=1;
+
+    stride[i]= i==0 ? 1 : stride[i-1]*count[i-1];
+
+    if(is_slice)
+    {
+      if(start[i]!=0 || count[i]!=h->representation_dims[i].length)
+      {
+        MI_LOG_ERROR(MI2_MSG_GENERIC,"Hyperslab should contain complete slices when slice scaling is used");
+        return MINC2_ERROR;
+      }
+      if(n_inner>0) n_rows*=count[i];
+      inner[n_inner++]=i;
+    } else {
+      n_slices*=count[i];
+      outer[n_outer++]=i;
+    }
+  }
+
+  slice_min=(double*)malloc(n_slices*sizeof(double));
+  slice_max=(double*)malloc(n_slices*sizeof(double));
+
+  /*slices are independent, scan them in parallel*/
+  _MINC2_OMP("omp parallel for schedule(dynamic)")
+  for(s=0;s<(long)n_slices;s++)
+  {
+    size_t base=0,r=(size_t)s,row;
+    double _min=HUGE_VAL,_max=-HUGE_VAL;
+    int    k;
+
+    for(k=0;k<n_outer;k++)
+    {
+      base+=(r%count[outer[k]])*stride[outer[k]];
+      r/=count[outer[k]];
+    }
+
+    for(row=0;row<n_rows;row++)
+    {
+      size_t offset=base,q=row;
+      size_t step=stride[inner[0]],length=count[inner[0]];
+
+      for(k=1;k<n_inner;k++)
+      {
+        offset+=(q%count[inner[k]])*stride[inner[k]];
+        q/=count[inner[k]];
+      }
+
+      switch(representation_type)
+      {
+        case MINC2_UBYTE:
+          _GET_ROW_MIN_MAX(unsigned char,_ANY_VALUE,buffer,offset,step,length,_min,_max);
+          break;
+        case MINC2_BYTE:
+          _GET_ROW_MIN_MAX(char,_ANY_VALUE,buffer,offset,step,length,_min,_max);
+          break;
+        case MINC2_USHORT:
+          _GET_ROW_MIN_MAX(unsigned short,_ANY_VALUE,buffer,offset,step,length,_min,_max);
+          break;
+        case MINC2_SHORT:
+          _GET_ROW_MIN_MAX(short,_ANY_VALUE,buffer,offset,step,length,_min,_max);
+          break;
+        case MINC2_UINT:
+          _GET_ROW_MIN_MAX(unsigned int,_ANY_VALUE,buffer,offset,step,length,_min,_max);
+          break;
+        case MINC2_INT:
+          _GET_ROW_MIN_MAX(int,_ANY_VALUE,buffer,offset,step,length,_min,_max);
+          break;
+        case MINC2_FLOAT:
+          _GET_ROW_MIN_MAX(float,_FINITE_VALUE,buffer,offset,step,length,_min,_max);
+          break;
+        case MINC2_DOUBLE:
+          _GET_ROW_MIN_MAX(double,_FINITE_VALUE,buffer,offset,step,length,_min,_max);
+          break;
+      }
+    }
+    slice_min[s]=_min;
+    slice_max[s]=_max;
+  }
+
+  /*HDF5 is not thread safe, store ranges sequentially*/
+  for(s=0;s<(long)n_slices && err==MINC2_SUCCESS;s++)
+  {
+    int    slice_start[MI2_MAX_VAR_DIMS];
+    size_t r=(size_t)s;
+
+    for(i=0;i<h->ndims;i++)
+      slice_start[i]=start[i];
+    for(j=0;j<n_outer;j++)
+    {
+      slice_start[outer[j]]+=r%count[outer[j]];
+      r/=count[outer[j]];
+    }
+
+    if(!(slice_min[s]<=slice_max[s])) /*no finite values*/
+      slice_min[s]=slice_max[s]=0.0;
+    if(slice_min[s]==slice_max[s])    /*constant slice, avoid empty range*/
+      slice_max[s]=slice_min[s]+1.0;
+
+    err=minc2_set_slice_range(h,slice_start,slice_min[s],slice_max[s]);
+  }
+
+  free(slice_min);
+  free(slice_max);
+  return err;
+}
+
+
+/**
+ * save complete volume, if value_range is NULL the range is calculated from the buffer
+ */
+static int _minc2_save_complete_volume( minc2_file_handle h,const void *buffer,int representation_type,const double *value_range)
 {
   mitype_t buffer_type=MI_TYPE_UBYTE;
   /*mitype_t file_store_type=MI_TYPE_UBYTE;*/
@@ -600,13 +879,6 @@ int minc2_save_complete_volume( minc2_file_handle h,const void *buffer,int repre
   size_t   buffer_length=1;
   double   buffer_min,buffer_max;
 
-  if(h->slice_scaling_flag)
-  {
-    /*currently not supported*/
-    MI_LOG_ERROR(MI2_MSG_GENERIC,"Slice scaling in minc2_save_complete_volume is not supported yet");
-    return MINC2_ERROR;
-  }
-
   if(h->using_apparent_order)
   {
     /*need to specify dimensions in apparent order, with minc2 convention that fasted dimensions are last*/
@@ -626,36 +898,36 @@ int minc2_save_complete_volume( minc2_file_handle h,const void *buffer,int repre
     }
   }
   buffer_type=_minc2_type_to_mitype(representation_type);
-  switch(representation_type )
+
+  if(h->slice_scaling_flag)
   {
-    case MINC2_UBYTE:
-      _GET_BUFFER_MIN_MAX(unsigned char,buffer,buffer_length,buffer_min,buffer_max);
-      break;
-    case MINC2_BYTE:
-      _GET_BUFFER_MIN_MAX(char,buffer, buffer_length,buffer_min,buffer_max);
-      break;
-    case MINC2_USHORT:
-      _GET_BUFFER_MIN_MAX(unsigned short,buffer,buffer_length,buffer_min,buffer_max);
-      break;
-    case MINC2_SHORT:
-      _GET_BUFFER_MIN_MAX(short,buffer,buffer_length,buffer_min,buffer_max);
-      break;
-    case MINC2_UINT:
-      _GET_BUFFER_MIN_MAX(unsigned int,buffer,buffer_length,buffer_min,buffer_max);
-      break;
-    case MINC2_INT:
-      _GET_BUFFER_MIN_MAX(int,buffer,buffer_length,buffer_min,buffer_max);
-      break;
-    case MINC2_FLOAT:
-      _GET_BUFFER_MIN_MAX_PROT(float,buffer,buffer_length,buffer_min,buffer_max);
-      break;
-    case MINC2_DOUBLE:
-      _GET_BUFFER_MIN_MAX_PROT(double,buffer,buffer_length,buffer_min,buffer_max);
-      break;
-    default:
-      MI_LOG_ERROR(MI2_MSG_GENERIC,"Unsupported volume data type");
+    int *start=(int*)calloc(h->ndims,sizeof(int));
+    int *count=(int*)calloc(h->ndims,sizeof(int));
+    for ( i = 0; i < h->ndims ; i++ )
+      count[i]=h->representation_dims[i].length;
+
+    err=_minc2_set_buffer_slice_ranges(h,start,count,buffer,representation_type);
+    free(start);
+    free(count);
+    if(err!=MINC2_SUCCESS)
+      return MINC2_ERROR;
+
+    if ( miset_real_value_hyperslab(h->vol, buffer_type, h->tmp_start, h->tmp_count, (void*)buffer ) < 0 )
+      return MINC2_ERROR;
+    return MINC2_SUCCESS;
+  }
+
+  if(value_range)
+  {
+    buffer_min=value_range[0];
+    buffer_max=value_range[1];
+  } else {
+    if(minc2_buffer_range(buffer,buffer_length,representation_type,&buffer_min,&buffer_max)!=MINC2_SUCCESS)
       return MINC2_ERROR;
+    if(isnan(buffer_min)) /*no finite values*/
+      buffer_min=buffer_max=0.0;
   }
+
   if(minc2_set_volume_range(h,buffer_min,buffer_max)!=MINC2_SUCCESS)
     return MINC2_ERROR;
 
@@ -667,6 +939,19 @@ int minc2_save_complete_volume( minc2_file_handle h,const void *buffer,int repre
   return err;  
 }
 
+int minc2_save_complete_volume( minc2_file_handle h,const void *buffer,int representation_type)
+{
+  return _minc2_save_complete_volume(h,buffer,representation_type,NULL);
+}
+
+int minc2_save_complete_volume_range( minc2_file_handle h,const void *buffer,int representation_type,double value_min,double value_max)
+{
+  double value_range[2];
+  value_range[0]=value_min;
+  value_range[1]=value_max;
+  return _minc2_save_complete_volume(h,buffer,representation_type,value_range);
+}
+
 int minc2_set_scaling(minc2_file_handle h,int use_global_scaling,int use_slice_scaling)
 {
   int err=MINC2_SUCCESS;
@@ -677,10 +962,53 @@ int minc2_set_scaling(minc2_file_handle h,int use_global_scaling,int use_slice_s
 
   h->global_scaling_flag=use_global_scaling;
   h->slice_scaling_flag=use_slice_scaling;
+  h->deferred_scaling=0;
 
   return err;
 }
 
+int minc2_set_storage(minc2_file_handle h,const int *chunks,int compression)
+{
+  int i;
+
+  if(compression<-1 || compression>9)
+  {
+    MI_LOG_ERROR(MI2_MSG_GENERIC,"Unsupported compression level %d",compression);
+    return MINC2_ERROR;
+  }
+
+  if(h->storage_chunks)
+  {
+    free(h->storage_chunks);
+    h->storage_chunks=NULL;
+  }
+
+  if(chunks)
+  {
+    if(!h->ndims)
+    {
+      MI_LOG_ERROR(MI2_MSG_GENERIC,"Dimensions undefined");
+      return MINC2_ERROR;
+    }
+    h->storage_chunks=(int*)calloc(h->ndims,sizeof(int));
+    for(i=0;i<h->ndims;i++)
+    {
+      if(chunks[i]<1)
+      {
+        MI_LOG_ERROR(MI2_MSG_GENERIC,"Chunk sizes should be positive");
+        free(h->storage_chunks);
+        h->storage_chunks=NULL;
+        return MINC2_ERROR;
+      }
+      /*chunks can't be larger than the volume*/
+      h->storage_chunks[i]=chunks[i]<h->store_dims[i].length?chunks[i]:h->store_dims[i].length;
+    }
+  }
+  h->compression_set=compression>=0;
+  h->compression=compression;
+  return MINC2_SUCCESS;
+}
+
 
 int minc2_set_volume_range(minc2_file_handle h,
                            double value_min,
@@ -688,7 +1016,12 @@ int minc2_set_volume_range(minc2_file_handle h,
 {
   int err=MINC2_SUCCESS;
   
-  if( !h->global_scaling_flag )
+  if( h->slice_scaling_flag )
+  {
+    /*volume range is defined by slice ranges, valid range is the range of the storage type*/
+    return MINC2_SUCCESS;
+  }
+  else if( !h->global_scaling_flag )
   {
     
     if(miset_volume_valid_range( h->vol, value_max, value_min)<0) err=MINC2_ERROR;
@@ -715,7 +1048,10 @@ int minc2_set_slice_range(minc2_file_handle h,int *start,double value_min,double
 }
 
 
-int minc2_write_hyperslab(minc2_file_handle h,int *start,int *count,const void* buffer,int representation_type)
+/**
+ * write hyperslab, without updating slice ranges
+ */
+static int _minc2_write_hyperslab(minc2_file_handle h,int *start,int *count,const void* buffer,int representation_type)
 {
   mitype_t buffer_type=_minc2_type_to_mitype(representation_type);
   int i;
@@ -733,7 +1069,16 @@ int minc2_write_hyperslab(minc2_file_handle h,int *start,int *count,const void*
   else
     err=MINC2_SUCCESS;
 
-  return err;
+  return err;
+}
+
+int minc2_write_hyperslab(minc2_file_handle h,int *start,int *count,const void* buffer,int representation_type)
+{
+  if(h->slice_scaling_flag &&
+     _minc2_set_buffer_slice_ranges(h,start,count,buffer,representation_type)!=MINC2_SUCCESS)
+    return MINC2_ERROR;
+
+  return _minc2_write_hyperslab(h,start,count,buffer,representation_type);
 }
 
 int minc2_read_hyperslab(minc2_file_handle h, int *start, int *count, void* buffer, int representation_type)
@@ -742,6 +1087,9 @@ int minc2_read_hyperslab(minc2_file_handle h, int *start, int *count, void* buff
   int i;
   int err=MINC2_SUCCESS;
 
+  if(_minc2_check_scaling(h)!=MINC2_SUCCESS)
+    return MINC2_ERROR;
+
   /*need to specify dimensions with minc2 convention that fasted dimensions are last*/
   for ( i = 0; i < h->ndims ; i++ )
   {
@@ -759,6 +1107,8 @@ int minc2_read_hyperslab(minc2_file_handle h, int *start, int *count, void* buff
 
 int minc2_data_type(minc2_file_handle h,int *_type)
 {
+  if(_minc2_check_scaling(h)!=MINC2_SUCCESS)
+    return MINC2_ERROR;
   if(h->data_type>0)
   {
     *_type=h->data_type;
@@ -771,7 +1121,7 @@ int minc2_data_type(minc2_file_handle h,int *_type)
 
 int minc2_storage_data_type(minc2_file_handle h,int *_type)
 {
-  if(h->data_type>0)
+  if(h->data_type>0 || h->deferred_scaling)
   {
     *_type=(int)h->store_type;
     return MINC2_SUCCESS;
@@ -781,6 +1131,230 @@ int minc2_storage_data_type(minc2_file_handle h,int *_type)
   }
 }
 
+int minc2_get_volume_range(minc2_file_handle h,double *value_min,double *value_max)
+{
+  if(!h->vol)
+    return MINC2_ERROR;
+  if(miget_volume_range(h->vol,value_max,value_min)<0)
+    return MINC2_ERROR;
+  return MINC2_SUCCESS;
+}
+
+int minc2_get_valid_range(minc2_file_handle h,double *value_min,double *value_max)
+{
+  if(!h->vol)
+    return MINC2_ERROR;
+  if(miget_volume_valid_range(h->vol,value_max,value_min)<0)
+    return MINC2_ERROR;
+  return MINC2_SUCCESS;
+}
+
+int minc2_get_scaling(minc2_file_handle h,int *use_global_scaling,int *use_slice_scaling)
+{
+  if(_minc2_check_scaling(h)!=MINC2_SUCCESS)
+    return MINC2_ERROR;
+  *use_global_scaling=h->global_scaling_flag;
+  *use_slice_scaling=h->slice_scaling_flag;
+  return MINC2_SUCCESS;
+}
+
+int minc2_hdf5_threadsafe(void)
+{
+  hbool_t ts=0;
+  if(H5is_library_threadsafe(&ts)<0)
+    return 0;
+  return ts?1:0;
+}
+
+/**
+ * find HDF5 file id of the file already opened by libminc
+ */
+static hid_t _minc2_find_hdf5_file(const char *path)
+{
+  ssize_t n,i;
+  hid_t *ids;
+  hid_t found=-1;
+  char name[4096];
+
+  n=H5Fget_obj_count(H5F_OBJ_ALL,H5F_OBJ_FILE);
+  if(n<=0)
+    return -1;
+
+  ids=(hid_t*)calloc(n,sizeof(hid_t));
+  n=H5Fget_obj_ids(H5F_OBJ_ALL,H5F_OBJ_FILE,n,ids);
+
+  for(i=0;i<n && found<0;i++)
+  {
+    if(H5Fget_name(ids[i],name,sizeof(name))>0 && !strcmp(name,path))
+      found=ids[i];
+  }
+  free(ids);
+  return found;
+}
+
+/**
+ * open HDF5 image dataset of the file opened by libminc,
+ * file_id have to be closed with H5Fclose if own_file is set
+ */
+static hid_t _minc2_open_image_dataset(minc2_file_handle h,hid_t *file_id,int *own_file)
+{
+  hid_t dset_id=-1;
+
+  /*HDF5 allows only one set of access properties for an open file, reuse it*/
+  *own_file=0;
+  *file_id=_minc2_find_hdf5_file(h->path);
+  if(*file_id<0)
+  {
+    H5E_BEGIN_TRY {
+      *file_id=H5Fopen(h->path,H5F_ACC_RDONLY,H5P_DEFAULT);
+    } H5E_END_TRY;
+    *own_file=1;
+  }
+  if(*file_id<0)
+    return -1;
+
+  H5E_BEGIN_TRY {
+    dset_id=H5Dopen2(*file_id,"/minc-2.0/image/0/image",H5P_DEFAULT);
+  } H5E_END_TRY;
+  return dset_id;
+}
+
+int minc2_get_image_offset(minc2_file_handle h,long long *offset,int *status)
+{
+  hid_t file_id,dset_id,dcpl_id,type_id;
+  int   own_file=0;
+  haddr_t addr;
+
+  *offset=-1;
+  if(!h->vol || !h->path)
+  {
+    *status=MINC2_MMAP_NOT_OPEN;
+    return MINC2_ERROR;
+  }
+
+  dset_id=_minc2_open_image_dataset(h,&file_id,&own_file);
+
+  if(dset_id<0)
+  {
+    *status=MINC2_MMAP_HDF5_ERROR;
+  } else {
+    dcpl_id=H5Dget_create_plist(dset_id);
+
+    if(H5Pget_layout(dcpl_id)!=H5D_CONTIGUOUS)
+    {
+      *status=H5Pget_nfilters(dcpl_id)>0?MINC2_MMAP_FILTERED:MINC2_MMAP_NOT_CONTIGUOUS;
+    } else if((addr=H5Dget_offset(dset_id))==HADDR_UNDEF) {
+      *status=MINC2_MMAP_NOT_ALLOCATED;
+    } else {
+      type_id=H5Dget_type(dset_id);
+      if(H5Tget_order(type_id)!=H5Tget_order(H5T_NATIVE_INT))
+      {
+        *status=MINC2_MMAP_BYTE_ORDER;
+      } else {
+        *status=MINC2_MMAP_OK;
+        *offset=(long long)addr;
+      }
+      H5Tclose(type_id);
+    }
+    H5Pclose(dcpl_id);
+    H5Dclose(dset_id);
+  }
+
+  if(own_file && file_id>=0)
+    H5Fclose(file_id);
+
+  return *status==MINC2_MMAP_OK?MINC2_SUCCESS:MINC2_ERROR;
+}
+
+int minc2_get_chunking(minc2_file_handle h,int *chunk)
+{
+  hid_t file_id,dset_id,dcpl_id;
+  int   own_file=0;
+  int   i;
+  int   ret=MINC2_SUCCESS;
+  hsize_t *hdims;
+
+  if(!h->vol || !h->path)
+    return MINC2_ERROR;
+
+  for(i=0;i<h->ndims;i++)
+    chunk[i]=0;
+
+  dset_id=_minc2_open_image_dataset(h,&file_id,&own_file);
+  if(dset_id<0)
+  {
+    ret=MINC2_ERROR;
+  } else {
+    dcpl_id=H5Dget_create_plist(dset_id);
+
+    if(H5Pget_layout(dcpl_id)==H5D_CHUNKED)
+    {
+      hdims=(hsize_t*)calloc(h->ndims,sizeof(hsize_t));
+      if(H5Pget_chunk(dcpl_id,h->ndims,hdims)!=h->ndims)
+      {
+        MI_LOG_ERROR(MI2_MSG_GENERIC,"Unexpected number of chunk dimensions");
+        ret=MINC2_ERROR;
+      } else {
+        /*HDF5 dimensions are in file order, slowest first*/
+        for(i=0;i<h->ndims;i++)
+          chunk[h->ndims-i-1]=(int)hdims[i];
+      }
+      free(hdims);
+    }
+    H5Pclose(dcpl_id);
+    H5Dclose(dset_id);
+  }
+
+  if(own_file && file_id>=0)
+    H5Fclose(file_id);
+
+  return ret;
+}
+
+int minc2_get_storage_filters(minc2_file_handle h,int *compression,int *shuffle)
+{
+  hid_t file_id,dset_id,dcpl_id;
+  int   own_file=0;
+  int   i,n;
+  int   ret=MINC2_SUCCESS;
+
+  if(!h->vol || !h->path)
+    return MINC2_ERROR;
+
+  *compression=-1;
+  *shuffle=0;
+
+  dset_id=_minc2_open_image_dataset(h,&file_id,&own_file);
+  if(dset_id<0)
+  {
+    ret=MINC2_ERROR;
+  } else {
+    dcpl_id=H5Dget_create_plist(dset_id);
+    n=H5Pget_nfilters(dcpl_id);
+
+    for(i=0;i<n;i++)
+    {
+      unsigned int flags;
+      size_t       cd_nelmts=1;
+      unsigned int cd_values[1]={0};
+      char         name[64];
+      H5Z_filter_t filter=H5Pget_filter2(dcpl_id,(unsigned)i,&flags,&cd_nelmts,cd_values,sizeof(name),name,NULL);
+
+      if(filter==H5Z_FILTER_DEFLATE)
+        *compression=cd_nelmts>0?(int)cd_values[0]:0;
+      else if(filter==H5Z_FILTER_SHUFFLE)
+        *shuffle=1;
+    }
+    H5Pclose(dcpl_id);
+    H5Dclose(dset_id);
+  }
+
+  if(own_file && file_id>=0)
+    H5Fclose(file_id);
+
+  return ret;
+}
+
 int minc2_get_representation_dimensions(minc2_file_handle h,struct minc2_dimension **dims)
 {
   if(!h->representation_dims)
@@ -938,6 +1512,7 @@ int minc2_create(minc2_file_handle h,const char * path)
   int err=MINC2_SUCCESS;
   /**/
   mivolumeprops_t hprops;
+  int compression=0;
   
   if( minew_volume_props(&hprops) < 0)
   {
@@ -945,8 +1520,13 @@ int minc2_create(minc2_file_handle h,const char * path)
     return MINC2_ERROR;
   }
   
-  /*TODO: move it to volume definition*/
-  if(miget_cfg_present(MICFG_COMPRESS) && miget_cfg_int(MICFG_COMPRESS)>0  )
+  /*use default from the environment, unless specified with minc2_set_storage*/
+  if(h->compression_set)
+    compression=h->compression;
+  else if(miget_cfg_present(MICFG_COMPRESS))
+    compression=miget_cfg_int(MICFG_COMPRESS);
+
+  if(compression>0)
   {
     if(miset_props_compression_type(hprops, MI_COMPRESS_ZLIB)<0)
     {
@@ -954,7 +1534,7 @@ int minc2_create(minc2_file_handle h,const char * path)
       return MINC2_ERROR;
     }
 
-    if(miset_props_zlib_compression(hprops,miget_cfg_int(MICFG_COMPRESS))<0)
+    if(miset_props_zlib_compression(hprops,compression)<0)
     {
       MI_LOG_ERROR(MI2_MSG_GENERIC,"Can't set compression");
       return MINC2_ERROR;
@@ -969,12 +1549,30 @@ int minc2_create(minc2_file_handle h,const char * path)
     }
   }
 
+  if(h->storage_chunks)
+  {
+    /*block edges are in file order, slowest dimension first*/
+    int  i;
+    int *edge_lengths=(int*)calloc(h->ndims,sizeof(int));
+    for(i=0;i<h->ndims;i++)
+      edge_lengths[h->ndims-i-1]=h->storage_chunks[i];
+
+    if(miset_props_blocking(hprops,h->ndims,edge_lengths)<0)
+    {
+      MI_LOG_ERROR(MI2_MSG_GENERIC,"Can't set chunking");
+      free(edge_lengths);
+      return MINC2_ERROR;
+    }
+    free(edge_lengths);
+  }
+
   if ( micreate_volume ( path, h->ndims, h->file_dims, h->store_type,
                          MI_CLASS_REAL, hprops, &h->vol )<0 ) /*change MI_CLASS_REAL to something else?*/
   {
     MI_LOG_ERROR(MI2_MSG_GENERIC,"Couldn't open file %s",path);
     return MINC2_ERROR;
   }
+  h->path=strdup(path);
 
   /*have to set slice scaling flag before image is allocated*/
   if ( miset_slice_scaling_flag(h->vol, h->slice_scaling_flag )<0 )
@@ -1073,7 +1671,7 @@ int minc2_voxel_to_world_vec(minc2_file_handle h, int n,int stride, const double
 
   for(i=0;i<n;i++ ) {
     const double* in_voxel=&voxel[i*stride];
-    double *out_world=&voxel[i*stride];
+    double *out_world=&world[i*stride];
 
     ret =  ret || minc2_voxel_to_world(h, in_voxel, out_world);
   }
@@ -1434,6 +2032,131 @@ int minc2_read_attribute(minc2_file_handle h,const char* group,const char* attr,
   return MINC2_ERROR;
 }
 
+/**
+ * append data to the dynamically allocated buffer, if data is NULL - only reserve space
+ */
+static int _minc2_dump_append(char **buf,size_t *size,size_t *allocated,const void *data,size_t length)
+{
+  if(*size+length>*allocated)
+  {
+    size_t new_size=*allocated?*allocated:4096;
+    char *tmp;
+    while(new_size<*size+length)
+      new_size*=2;
+    if(!(tmp=(char*)realloc(*buf,new_size)))
+    {
+      MI_LOG_ERROR(MI2_MSG_GENERIC,"Can't allocate memory for metadata");
+      return MINC2_ERROR;
+    }
+    *buf=tmp;
+    *allocated=new_size;
+  }
+  if(data)
+    memcpy(*buf+*size,data,length);
+  *size+=length;
+  return MINC2_SUCCESS;
+}
+
+/**
+ * append single attribute record to the metadata dump
+ */
+static int _minc2_dump_attribute(minc2_file_handle h,const char *group,const char *attr,char **buf,size_t *size,size_t *allocated)
+{
+  mitype_t att_data_type;
+  size_t   att_length;
+  size_t   value_size;
+  int      record[4];
+
+  if(miget_attr_type(h->vol,group,attr,&att_data_type)!=MI_NOERROR ||
+     miget_attr_length(h->vol,group,attr,&att_length)!=MI_NOERROR)
+    return MINC2_ERROR;
+
+  record[0]=(int)strlen(group);
+  record[1]=(int)strlen(attr);
+  record[2]=_mitype_to_minc2_type(att_data_type);
+  record[3]=(int)att_length;
+  value_size=att_length*_minc2_type_size(record[2]);
+
+  if(_minc2_dump_append(buf,size,allocated,record,sizeof(record))!=MINC2_SUCCESS ||
+     _minc2_dump_append(buf,size,allocated,group,record[0])!=MINC2_SUCCESS ||
+     _minc2_dump_append(buf,size,allocated,attr,record[1])!=MINC2_SUCCESS ||
+     _minc2_dump_append(buf,size,allocated,NULL,value_size)!=MINC2_SUCCESS )
+    return MINC2_ERROR;
+
+  /*read value directly into the reserved space*/
+  if(miget_attr_values(h->vol,att_data_type,group,attr,att_length,*buf+*size-value_size)!=MI_NOERROR)
+  {
+    MI_LOG_ERROR(MI2_MSG_GENERIC,"Can't read attribute %s:%s",group,attr);
+    return MINC2_ERROR;
+  }
+  return MINC2_SUCCESS;
+}
+
+int minc2_metadata_dump(minc2_file_handle h,void **buffer,size_t *buffer_size)
+{
+  /*attributes of the root group, not listed by the group iterator*/
+  static const char *root_attributes[]={"history","ident","minc_version",NULL};
+  struct minc2_info_iterator group_it,attr_it;
+  char   *buf=NULL;
+  size_t size=0,allocated=0;
+  int    err=MINC2_SUCCESS;
+  int    i;
+
+  *buffer=NULL;
+  *buffer_size=0;
+  if(!h->vol)
+    return MINC2_ERROR;
+
+  memset(&group_it,0,sizeof(group_it));
+  memset(&attr_it,0,sizeof(attr_it));
+
+  if(minc2_start_group_iterator(h,&group_it)!=MINC2_SUCCESS)
+    return MINC2_ERROR;
+
+  while(err==MINC2_SUCCESS && minc2_iterator_group_next(&group_it)==MINC2_SUCCESS)
+  {
+    /*group record, so that empty groups are preserved*/
+    int record[4]={0,-1,MINC2_UNKNOWN,0};
+    record[0]=(int)strlen(group_it.group_name);
+
+    if(_minc2_dump_append(&buf,&size,&allocated,record,sizeof(record))!=MINC2_SUCCESS ||
+       _minc2_dump_append(&buf,&size,&allocated,group_it.group_name,record[0])!=MINC2_SUCCESS ||
+       minc2_start_attribute_iterator(h,group_it.group_name,&attr_it)!=MINC2_SUCCESS)
+    {
+      err=MINC2_ERROR;
+      break;
+    }
+
+    while(err==MINC2_SUCCESS && minc2_iterator_attribute_next(&attr_it)==MINC2_SUCCESS)
+      err=_minc2_dump_attribute(h,group_it.group_name,attr_it.attr_name,&buf,&size,&allocated);
+
+    minc2_stop_info_iterator(&attr_it);
+  }
+  minc2_stop_info_iterator(&group_it);
+
+  for(i=0;err==MINC2_SUCCESS && root_attributes[i];i++)
+  {
+    mitype_t att_data_type;
+    if(miget_attr_type(h->vol,"",root_attributes[i],&att_data_type)==MI_NOERROR)
+      err=_minc2_dump_attribute(h,"",root_attributes[i],&buf,&size,&allocated);
+  }
+
+  if(err!=MINC2_SUCCESS)
+  {
+    free(buf);
+    return MINC2_ERROR;
+  }
+  *buffer=buf;
+  *buffer_size=size;
+  return MINC2_SUCCESS;
+}
+
+int minc2_free_metadata_dump(void *buffer)
+{
+  free(buffer);
+  return MINC2_SUCCESS;
+}
+
 int minc2_write_attribute(minc2_file_handle h,const char* group,const char* attr,const void *buf,int buf_size,int minc2_type)
 {
   mitype_t    att_data_type=_minc2_type_to_mitype(minc2_type);
@@ -1887,6 +2610,7 @@ int minc2_iterator_free(minc2_file_iterator_handle h)
   if(h->_index) free(h->_index);
   if(h->_start) free(h->_start);
   if(h->_end)   free(h->_end);
+  if(h->_count) free(h->_count);
   if(h->_buffer)free(h->_buffer);
 
   if(h->_min)   free(h->_min);
@@ -1977,42 +2701,16 @@ static int minc2_iterator_flush(minc2_file_iterator_handle h)
     if(h->_output_mode)
     {
       double buffer_min,buffer_max;
-      switch(h->_data_type )
-      {
-        case MINC2_UBYTE:
-          _GET_BUFFER_MIN_MAX(unsigned char,f_buffer,h->_buffer_size,buffer_min,buffer_max);
-          break;
-        case MINC2_BYTE:
-          _GET_BUFFER_MIN_MAX(char,f_buffer, h->_buffer_size,buffer_min,buffer_max);
-          break;
-        case MINC2_USHORT:
-          _GET_BUFFER_MIN_MAX(unsigned short,f_buffer,h->_buffer_size,buffer_min,buffer_max);
-          break;
-        case MINC2_SHORT:
-          _GET_BUFFER_MIN_MAX(short,f_buffer,h->_buffer_size,buffer_min,buffer_max);
-          break;
-        case MINC2_UINT:
-          _GET_BUFFER_MIN_MAX(unsigned int,f_buffer,h->_buffer_size,buffer_min,buffer_max);
-          break;
-        case MINC2_INT:
-          _GET_BUFFER_MIN_MAX(int,f_buffer,h->_buffer_size,buffer_min,buffer_max);
-          break;
-        case MINC2_FLOAT:
-          _GET_BUFFER_MIN_MAX_PROT(float,f_buffer,h->_buffer_size,buffer_min,buffer_max);
-          break;
-        case MINC2_DOUBLE:
-          _GET_BUFFER_MIN_MAX_PROT(double,f_buffer,h->_buffer_size,buffer_min,buffer_max);
-          break;
-        default:
-          MI_LOG_ERROR(MI2_MSG_GENERIC,"Unsupported volume data type");
-          return MINC2_ERROR;
-      }
+      if(minc2_buffer_range(f_buffer,h->_buffer_size,h->_data_type,&buffer_min,&buffer_max)!=MINC2_SUCCESS)
+        return MINC2_ERROR;
 
       if( h->_minc_file[f]->slice_scaling_flag )
-        if ( minc2_set_slice_range(h->_minc_file[f],h->_index,buffer_min,buffer_max)!=MINC2_SUCCESS )
+        if ( minc2_set_slice_range(h->_minc_file[f],h->_index,
+                                   isnan(buffer_min)?0.0:buffer_min,
+                                   isnan(buffer_max)?0.0:buffer_max)!=MINC2_SUCCESS )
           return MINC2_ERROR;
 
-      r=minc2_write_hyperslab(h->_minc_file[f], h->_index,h->_count, f_buffer, h->_data_type)==MINC2_SUCCESS&&r;
+      r=_minc2_write_hyperslab(h->_minc_file[f], h->_index,h->_count, f_buffer, h->_data_type)==MINC2_SUCCESS&&r;
 
       if(isfinite(buffer_min) && buffer_min<h->_min[f]) h->_min[f]=buffer_min;
       if(isfinite(buffer_max) && buffer_max>h->_max[f]) h->_max[f]=buffer_max;
@@ -2141,6 +2839,137 @@ int minc2_iterator_put_values(minc2_file_iterator_handle h,const void *val)
   return MINC2_SUCCESS;
 }
 
+int minc2_iterator_block_size(minc2_file_iterator_handle h,int *size)
+{
+  *size=h->_buffer_size;
+  return MINC2_SUCCESS;
+}
+
+int minc2_iterator_get_block(minc2_file_iterator_handle h,void *val,int *count,long long *offset)
+{
+  int f,i;
+  long long stride=1;
+  int _count=h->_buffer_size-h->_buffer_index;
+
+  /*linear index of the current voxel, first dimension is the fastest*/
+  *offset=0;
+  for(i=0;i<h->_ndim;i++)
+  {
+    *offset+=(h->_index[i]-h->_start[i])*stride;
+    stride*=h->_end[i]-h->_start[i];
+  }
+
+  for(f=0;f<h->_fnum;f++)
+    memcpy(val+(size_t)_count*h->_element_size*f,
+           h->_buffer+((size_t)h->_buffer_size*f+h->_buffer_index)*h->_element_size,
+           (size_t)_count*h->_element_size);
+
+  *count=_count;
+  return MINC2_SUCCESS;
+}
+
+int minc2_iterator_next_slice(minc2_file_iterator_handle h,int *end)
+{
+  int i;
+  *end=0;
+  if(h->_output_mode)
+  {
+    MI_LOG_ERROR(MI2_MSG_GENERIC,"Iterator: next_slice is only supported for input");
+    return MINC2_ERROR;
+  }
+
+  for(i=0;i<h->_slice_dimensions;i++)
+    h->_index[i]=h->_start[i];
+  h->_buffer_index=0;
+
+  for(i=h->_slice_dimensions;i<h->_ndim;i++)
+  {
+    h->_index[i]++;
+    if(h->_index[i]<h->_end[i])
+      return minc2_iterator_flush(h); /*read next slice*/
+    h->_index[i]=h->_start[i];
+  }
+  *end=1; /*EOF*/
+  return MINC2_SUCCESS;
+}
+
+int minc2_iterator_put_block(minc2_file_iterator_handle h,const void *val,int count,int *written,int *end)
+{
+  int f,i;
+  int done=0;
+  *written=0;
+  *end=0;
+
+  if(!h->_output_mode)
+  {
+    MI_LOG_ERROR(MI2_MSG_GENERIC,"Iterator: put_block is only supported for output");
+    return MINC2_ERROR;
+  }
+
+  while(done<count)
+  {
+    int n=h->_buffer_size-h->_buffer_index;
+    int rem;
+
+    if(h->_index[h->_ndim-1]>=h->_end[h->_ndim-1])
+    {
+      *end=1;
+      MI_LOG_ERROR(MI2_MSG_GENERIC,"Iterator: writing past the end of the volume");
+      return MINC2_ERROR;
+    }
+
+    if(n>count-done) n=count-done;
+
+    for(f=0;f<h->_fnum;f++)
+      memcpy(h->_buffer+((size_t)h->_buffer_size*f+h->_buffer_index)*h->_element_size,
+             val+((size_t)count*f+done)*h->_element_size,
+             (size_t)n*h->_element_size);
+
+    h->_buffer_index+=n;
+    done+=n;
+    *written=done;
+
+    if(h->_buffer_index<h->_buffer_size)
+    {
+      /*keep voxel index consistent with the buffer position*/
+      rem=h->_buffer_index;
+      for(i=0;i<h->_slice_dimensions;i++)
+      {
+        h->_index[i]=h->_start[i]+rem%h->_count[i];
+        rem/=h->_count[i];
+      }
+      break;
+    }
+
+    /*slice is complete: write it and move to the next one*/
+    for(i=0;i<h->_slice_dimensions;i++)
+      h->_index[i]=h->_start[i];
+    h->_buffer_index=0;
+
+    if(minc2_iterator_flush(h)!=MINC2_SUCCESS)
+      return MINC2_ERROR;
+
+    for(f=0;f<h->_fnum;f++)
+      if(minc2_set_volume_range(h->_minc_file[f], h->_min[f], h->_max[f] )!=MINC2_SUCCESS)
+        return MINC2_ERROR;
+
+    for(i=h->_slice_dimensions;i<h->_ndim;i++)
+    {
+      h->_index[i]++;
+      if(h->_index[i]<h->_end[i])
+        break;
+      h->_index[i]=h->_start[i];
+    }
+
+    if(i==h->_ndim) /*volume is complete*/
+    {
+      h->_index[h->_ndim-1]=h->_end[h->_ndim-1];
+      *end=1;
+    }
+  }
+  return MINC2_SUCCESS;
+}
+
 
 /**
  * tag operations